@@ -959,7 +959,7 @@ def pairs(argv, **kwargs):
                                    restriction_enzyme=restriction_enzyme,
                                    read_filters=read_filters, output_file=pairs_file,
                                    check_sorted=check_sam_sorted, threads=threads,
-                                   batch_size=batch_size)
+                                   batch_size=batch_size, shards=threads > 1)
             pairs.close()
         elif len(input_files) == 2:
             logger.info("Two arguments detected, assuming HiC-Pro or 4D Nucleome input.")
@@ -1127,6 +1127,28 @@ def hic_parser():
              'end after the merging step.'
     )
 
+    parser.add_argument(
+        '--bin-sizes', dest='bin_sizes',
+        help='Comma-separated list of bin sizes in base pairs, e.g. '
+             '5kb,10kb,25kb. All resolutions are generated from '
+             'a single pass over the input, coarser resolutions are '
+             'built from finer ones where possible. Requires an output '
+             'file, the bin size will be appended to its name, e.g. '
+             'output_5kb.hic. Filters and normalisation are applied '
+             'to every resolution. Cannot be used together with -b, '
+             '--downsample, or --subset.'
+    )
+
+    parser.add_argument(
+        '--multi-resolution', dest='multi_resolution',
+        action='store_true',
+        default=False,
+        help='Store all resolutions from --bin-sizes in a single '
+             'multi-resolution output file instead of one file per '
+             'resolution. Individual resolutions can be accessed '
+             'using the "@" notation, e.g. output.hic@5kb.'
+    )
+
     parser.add_argument(
         '-l', '--filter-low-coverage', dest='filter_low_coverage',
         type=float,
@@ -1228,6 +1250,15 @@ def hic_parser():
         help='Correct the whole matrix at once, rather than individual chromosomes.'
     )
 
+    parser.add_argument(
+        '--ice-chunk-size', dest='ice_chunk_size',
+        help='Do not load all contacts into memory for ICE and VC '
+             'normalisation, but stream them from disk in chunks '
+             'of this many contacts in every iteration. Slower, '
+             'but memory usage is bounded by the chunk size. '
+             'You can use human-readable formats, such as 10M.'
+    )
+
     parser.add_argument(
         '-c', '--restore-coverage', dest='restore_coverage',
         action='store_true',
@@ -1274,7 +1305,8 @@ def hic_parser():
         '-t', '--threads', dest='threads',
         type=int,
         default=1,
-        help="Number of threads (currently used for binning only)"
+        help="Number of threads used for binning and for "
+             "per-chromosome normalisation (not with --whole-matrix)"
     )
 
     parser.add_argument(
@@ -1294,6 +1326,18 @@ def hic_parser():
     return parser
 
 
+def _bin_size_file_name(file_name, bin_size):
+    """
+    Append a human-readable bin size to a file name, e.g. out.hic -> out_5kb.hic.
+    """
+    if file_name is None:
+        return None
+
+    from fanc.tools.general import human_format
+    base, extension = os.path.splitext(file_name)
+    return base + '_' + human_format(bin_size, 0).lower() + 'b' + extension
+
+
 def hic(argv, **kwargs):
     parser = hic_parser()
     args = parser.parse_args(argv[2:])
@@ -1303,6 +1347,8 @@ def hic(argv, **kwargs):
 
     input_files = [os.path.expanduser(file_name) for file_name in args.input]
     bin_size = str_to_int(args.bin_size) if args.bin_size is not None else None
+    bin_sizes = sorted({str_to_int(b) for b in args.bin_sizes.split(",")}) if args.bin_sizes is not None else None
+    multi_resolution = args.multi_resolution
     filter_low_coverage = args.filter_low_coverage
     filter_low_coverage_relative = args.filter_low_coverage_relative
     filter_low_coverage_auto = args.filter_low_coverage_auto
@@ -1317,6 +1363,7 @@ def hic(argv, **kwargs):
 
     whole_matrix = args.whole_matrix
     restore_coverage = args.restore_coverage
+    ice_chunk_size = str_to_int(args.ice_chunk_size) if args.ice_chunk_size is not None else None
     only_interchromosomal = args.only_inter
     statistics_file = os.path.expanduser(args.stats) if args.stats is not None else None
     statistics_plot_file = os.path.expanduser(args.stats_plot) if args.stats_plot is not None else None
@@ -1349,6 +1396,9 @@ def hic(argv, **kwargs):
         do_norm = True
         norm_method = 'ice'
 
+    if ice_chunk_size is not None and norm_method.lower() == 'kr':
+        parser.error("--ice-chunk-size can only be used with ICE or VC normalisation")
+
     coverage_args = 0
     if filter_low_coverage_auto:
         coverage_args += 1
@@ -1363,6 +1413,16 @@ def hic(argv, **kwargs):
     if only_interchromosomal:
         whole_matrix = True
 
+    if bin_sizes is not None:
+        if bin_size is not None:
+            parser.error("The arguments -b and --bin-sizes are mutually exclusive")
+        if downsample is not None or subset is not None:
+            parser.error("--downsample and --subset cannot be used with --bin-sizes")
+        if len(input_files) < 2:
+            parser.error("--bin-sizes requires an output file")
+    elif multi_resolution:
+        parser.error("--multi-resolution requires --bin-sizes")
+
     import tempfile
     import fanc
     from genomic_regions.files import create_temporary_copy, create_temporary_output
@@ -1373,11 +1433,14 @@ def hic(argv, **kwargs):
         output_file = input_files.pop()
         original_output_file = output_file
 
-        if not force_overwrite and os.path.exists(output_file):
-            parser.error("Output file {} exists! Use -f to force "
-                         "overwriting it!".format(output_file))
+        output_files = [output_file] if bin_sizes is None or multi_resolution else \
+            [_bin_size_file_name(output_file, b) for b in bin_sizes]
+        for f in output_files:
+            if not force_overwrite and os.path.exists(f):
+                parser.error("Output file {} exists! Use -f to force "
+                             "overwriting it!".format(f))
 
-        if tmp:
+        if tmp and bin_sizes is None:
             tmp = False
             output_file = create_temporary_output(output_file)
             tmp = True
@@ -1419,7 +1482,10 @@ def hic(argv, **kwargs):
                 if o is not None and hasattr(o, 'close'):
                     o.close()
 
-        if len(pairs_files) > 0:
+        # bin pairs straight into all resolutions if there is nothing to merge
+        pyramid_from_pairs = bin_sizes is not None and len(pairs_files) == 1 and len(hic_files) == 0
+
+        if len(pairs_files) > 0 and not pyramid_from_pairs:
             logger.info("Converting Pairs files")
 
             for pairs_file in pairs_files:
@@ -1448,7 +1514,7 @@ def hic(argv, **kwargs):
             finally:
                 for hic in hics:
                     hic.close()
-        else:
+        elif not pyramid_from_pairs:
             if deepcopy:
                 tmp_output_file = tempfile.NamedTemporaryFile(suffix='.hic', delete=False)
                 merged_hic_file = tmp_output_file.name
@@ -1459,7 +1525,52 @@ def hic(argv, **kwargs):
             else:
                 merged_hic_file = hic_files[0]
 
-        if bin_size is not None:
+        if bin_sizes is not None:
+            if multi_resolution:
+                fanc.MultiResolutionHic(output_file, mode='w').close()
+                bin_size_files = dict()
+                for b in bin_sizes:
+                    f = tempfile.NamedTemporaryFile(delete=False, suffix='.hic')
+                    bin_size_files[b] = f.name
+                    tmp_input_files.append(f.name)
+            else:
+                bin_size_files = dict(zip(bin_sizes, output_files))
+
+            if pyramid_from_pairs:
+                logger.info("Binning Pairs file ({})".format(", ".join(str(b) for b in bin_sizes)))
+                with fanc.load(pairs_files[0]) as pairs:
+                    if multi_resolution:
+                        binned_hics = pairs.to_hic_pyramid(bin_sizes, multi_resolution_file=output_file,
+                                                           chromosomes=limit_chromosomes)
+                    else:
+                        binned_hics = pairs.to_hic_pyramid(bin_sizes, file_names=output_files,
+                                                           tmpdir=True if tmp else None,
+                                                           chromosomes=limit_chromosomes)
+            else:
+                merged_hic = fanc.load(merged_hic_file)
+                binned_hics = dict()
+                for b in sorted(bin_sizes):
+                    # coarsen the largest finer resolution that fits into this one
+                    source_hic, source_chromosomes = merged_hic, limit_chromosomes
+                    for finer_bin_size in binned_hics.keys():
+                        if b % finer_bin_size == 0:
+                            source_hic, source_chromosomes = binned_hics[finer_bin_size], None
+
+                    logger.info("Binning Hic file ({})".format(b))
+                    binned_hics[b] = source_hic.bin(b, file_name=bin_size_files[b],
+                                                    tmpdir=True if tmp else None,
+                                                    threads=threads, chromosomes=source_chromosomes)
+                merged_hic.close()
+
+                if multi_resolution:
+                    logger.info("Writing resolutions to {}".format(output_file))
+                    with fanc.MultiResolutionHic(output_file, mode='a') as multi_resolution_hic:
+                        for b in bin_sizes:
+                            multi_resolution_hic.add_hic(binned_hics[b], resolution=b)
+                            binned_hics[b].close()
+                            binned_hics[b] = multi_resolution_hic.hic(b, mode='a')
+            binned_hics = [(b, binned_hics[b]) for b in bin_sizes]
+        elif bin_size is not None:
             merged_hic = fanc.load(merged_hic_file)
 
             logger.info("Binning Hic file ({})".format(bin_size))
@@ -1486,109 +1597,126 @@ def hic(argv, **kwargs):
             subset_hic = binned_hic.subset(*subset_regions, file_name=output_file)
             binned_hic = subset_hic
 
-        if reset_filters:
-            logger.info("Resetting all filters")
-            binned_hic.reset_filters()
-
-        filters = []
-        if filter_low_coverage_auto:
-            from fanc.hic import LowCoverageFilter
-            logger.info("Filtering low-coverage bins at 10%%")
-            mask = binned_hic.add_mask_description('low_coverage',
-                                                   'Mask low coverage regions in the Hic matrix '
-                                                   '(relative cutoff {:.1%}'.format(0.1))
-
-            low_coverage_auto_filter = LowCoverageFilter(binned_hic, rel_cutoff=0.1,
-                                                         cutoff=None, mask=mask)
-            filters.append(low_coverage_auto_filter)
-
-        if filter_low_coverage is not None or filter_low_coverage_relative is not None:
-            from fanc.hic import LowCoverageFilter
-            logger.info("Filtering low-coverage bins using absolute cutoff {:.4}, "
-                        "relative cutoff {:.1%}".format(float(filter_low_coverage)
-                                                        if filter_low_coverage else 0.,
-                                                        float(filter_low_coverage_relative)
-                                                        if filter_low_coverage_relative else 0.))
-            mask = binned_hic.add_mask_description('low_coverage',
-                                                   'Mask low coverage regions in the Hic matrix '
-                                                   '(absolute cutoff {:.4}, '
-                                                   'relative cutoff {:.1%}'.format(
-                                                       float(filter_low_coverage)
-                                                       if filter_low_coverage else 0.,
-                                                       float(filter_low_coverage_relative)
-                                                       if filter_low_coverage_relative else 0.)
-                                                   )
-
-            low_coverage_filter = LowCoverageFilter(binned_hic, rel_cutoff=filter_low_coverage_relative,
-                                                    cutoff=filter_low_coverage, mask=mask)
-            filters.append(low_coverage_filter)
-
-        if filter_diagonal is not None:
-            from fanc.hic import DiagonalFilter
-            logger.info("Filtering diagonal at distance {}".format(filter_diagonal))
-            mask = binned_hic.add_mask_description('diagonal',
-                                                   'Mask the diagonal of the Hic matrix '
-                                                   '(up to distance {})'.format(filter_diagonal))
-            diagonal_filter = DiagonalFilter(binned_hic, distance=filter_diagonal, mask=mask)
-            filters.append(diagonal_filter)
-
-        if len(filters) > 0:
-            logger.info("Running filters...")
-            for f in filters:
-                binned_hic.filter(f, queue=True)
-            binned_hic.run_queued_filters(log_progress=True)
-            logger.info("Done.")
+        if bin_sizes is None:
+            binned_hics = [(None, binned_hic)]
 
-        if statistics_file is not None or statistics_plot_file is not None or marginals_plot_file is not None:
-            import matplotlib
-            matplotlib.use('agg')
-            import matplotlib.pyplot as plt
-            if statistics_file is not None or statistics_plot_file is not None:
-                statistics = binned_hic.filter_statistics()
+        for level_bin_size, binned_hic in binned_hics:
+            level_statistics_file = statistics_file
+            level_statistics_plot_file = statistics_plot_file
+            level_marginals_plot_file = marginals_plot_file
+            if level_bin_size is not None:
+                level_statistics_file = _bin_size_file_name(statistics_file, level_bin_size)
+                level_statistics_plot_file = _bin_size_file_name(statistics_plot_file, level_bin_size)
+                level_marginals_plot_file = _bin_size_file_name(marginals_plot_file, level_bin_size)
 
-                if statistics_file is not None:
-                    with open(statistics_file, 'w') as o:
-                        for name, value in statistics.items():
-                            o.write("{}\t{}\n".format(name, value))
+            if reset_filters:
+                logger.info("Resetting all filters")
+                binned_hic.reset_filters()
 
-                if statistics_plot_file is not None:
-                    logger.info("Saving statistics...")
-                    from fanc.plotting.statistics import summary_statistics_plot
-                    statistics_plot_file = os.path.expanduser(statistics_plot_file)
-                    fig, ax = plt.subplots()
-                    summary_statistics_plot(statistics, ax=ax)
-                    ax.set_ylabel("Non-zero pixels / Positive contacts between region pairs")
-                    fig.savefig(statistics_plot_file)
+            filters = []
+            if filter_low_coverage_auto:
+                from fanc.hic import LowCoverageFilter
+                logger.info("Filtering low-coverage bins at 10%%")
+                mask = binned_hic.add_mask_description('low_coverage',
+                                                       'Mask low coverage regions in the Hic matrix '
+                                                       '(relative cutoff {:.1%}'.format(0.1))
+
+                low_coverage_auto_filter = LowCoverageFilter(binned_hic, rel_cutoff=0.1,
+                                                             cutoff=None, mask=mask)
+                filters.append(low_coverage_auto_filter)
+
+            if filter_low_coverage is not None or filter_low_coverage_relative is not None:
+                from fanc.hic import LowCoverageFilter
+                logger.info("Filtering low-coverage bins using absolute cutoff {:.4}, "
+                            "relative cutoff {:.1%}".format(float(filter_low_coverage)
+                                                            if filter_low_coverage else 0.,
+                                                            float(filter_low_coverage_relative)
+                                                            if filter_low_coverage_relative else 0.))
+                mask = binned_hic.add_mask_description('low_coverage',
+                                                       'Mask low coverage regions in the Hic matrix '
+                                                       '(absolute cutoff {:.4}, '
+                                                       'relative cutoff {:.1%}'.format(
+                                                           float(filter_low_coverage)
+                                                           if filter_low_coverage else 0.,
+                                                           float(filter_low_coverage_relative)
+                                                           if filter_low_coverage_relative else 0.)
+                                                       )
+
+                low_coverage_filter = LowCoverageFilter(binned_hic, rel_cutoff=filter_low_coverage_relative,
+                                                        cutoff=filter_low_coverage, mask=mask)
+                filters.append(low_coverage_filter)
+
+            if filter_diagonal is not None:
+                from fanc.hic import DiagonalFilter
+                logger.info("Filtering diagonal at distance {}".format(filter_diagonal))
+                mask = binned_hic.add_mask_description('diagonal',
+                                                       'Mask the diagonal of the Hic matrix '
+                                                       '(up to distance {})'.format(filter_diagonal))
+                diagonal_filter = DiagonalFilter(binned_hic, distance=filter_diagonal, mask=mask)
+                filters.append(diagonal_filter)
+
+            if len(filters) > 0:
+                logger.info("Running filters...")
+                for f in filters:
+                    binned_hic.filter(f, queue=True)
+                binned_hic.run_queued_filters(log_progress=True)
+                logger.info("Done.")
+
+            if level_statistics_file is not None or level_statistics_plot_file is not None or level_marginals_plot_file is not None:
+                import matplotlib
+                matplotlib.use('agg')
+                import matplotlib.pyplot as plt
+                if level_statistics_file is not None or level_statistics_plot_file is not None:
+                    statistics = binned_hic.filter_statistics()
+
+                    if level_statistics_file is not None:
+                        with open(level_statistics_file, 'w') as o:
+                            for name, value in statistics.items():
+                                o.write("{}\t{}\n".format(name, value))
+
+                    if level_statistics_plot_file is not None:
+                        logger.info("Saving statistics...")
+                        from fanc.plotting.statistics import summary_statistics_plot
+                        level_statistics_plot_file = os.path.expanduser(level_statistics_plot_file)
+                        fig, ax = plt.subplots()
+                        summary_statistics_plot(statistics, ax=ax)
+                        ax.set_ylabel("Non-zero pixels / Positive contacts between region pairs")
+                        fig.savefig(level_statistics_plot_file)
+                        plt.close(fig)
+
+                if level_marginals_plot_file is not None:
+                    from fanc.plotting.statistics import marginals_plot
+                    chromosomes = binned_hic.chromosomes()
+                    cols = min(len(chromosomes), 4)
+                    rows, remainder = divmod(len(chromosomes), cols)
+                    if remainder > 0:
+                        rows += 1
+                    # fig, axes = plt.subplots(rows, cols)
+                    fig = plt.figure(figsize=(cols*2, rows*2))
+                    for i, chromosome in enumerate(chromosomes):
+                        row, col = divmod(i, cols)
+                        ax = plt.subplot2grid((rows, cols), (row, col))
+                        marginals_plot(binned_hic, chromosome, lower=filter_low_coverage,
+                                       rel_cutoff=filter_low_coverage_relative, ax=ax)
+                        ax.set_title(chromosome)
+                    fig.savefig(level_marginals_plot_file)
                     plt.close(fig)
 
-            if marginals_plot_file is not None:
-                from fanc.plotting.statistics import marginals_plot
-                chromosomes = binned_hic.chromosomes()
-                cols = min(len(chromosomes), 4)
-                rows, remainder = divmod(len(chromosomes), cols)
-                if remainder > 0:
-                    rows += 1
-                # fig, axes = plt.subplots(rows, cols)
-                fig = plt.figure(figsize=(cols*2, rows*2))
-                for i, chromosome in enumerate(chromosomes):
-                    row, col = divmod(i, cols)
-                    ax = plt.subplot2grid((rows, cols), (row, col))
-                    marginals_plot(binned_hic, chromosome, lower=filter_low_coverage,
-                                   rel_cutoff=filter_low_coverage_relative, ax=ax)
-                    ax.set_title(chromosome)
-                fig.savefig(marginals_plot_file)
-                plt.close(fig)
+            if do_norm:
+                logger.info("Normalising binned Hic file")
 
-        if do_norm:
-            logger.info("Normalising binned Hic file")
+                norm_kwargs = dict(threads=threads)
+                if ice_chunk_size is not None:
+                    norm_kwargs['chunk_size'] = ice_chunk_size
 
-            binned_hic.normalise(norm_method, whole_matrix=whole_matrix,
-                                 intra_chromosomal=not only_interchromosomal,
-                                 restore_coverage=restore_coverage)
+                binned_hic.normalise(norm_method, whole_matrix=whole_matrix,
+                                     intra_chromosomal=not only_interchromosomal,
+                                     restore_coverage=restore_coverage,
+                                     **norm_kwargs)
 
-        binned_hic.close()
+            binned_hic.close()
     finally:
-        if tmp and original_output_file is not None:
+        if tmp and original_output_file is not None and bin_sizes is None:
             if output_file is not None:
                 shutil.copy(output_file, original_output_file)
                 os.remove(output_file)
@@ -2505,6 +2633,16 @@ def loops_parser():
              'close to the diagonal.'
     )
 
+    parser.add_argument(
+        '--max-distance', dest='max_distance',
+        help='Maximum distance between loop anchors in base pairs. '
+             'You can use abbreviated formats such as 5mb, 2000k, etc. '
+             'Only pixels in a band of this width along the diagonal are '
+             'investigated, which saves a lot of memory and time '
+             'for large chromosomes at high resolution. '
+             'Default: no maximum distance.'
+    )
+
     parser.add_argument(
         '-m', '--mappability', dest='mappability_global_cutoff',
         type=float,
@@ -2723,6 +2861,7 @@ def loops(argv, **kwargs):
     width = args.width
     threads = args.threads
     min_dist = args.min_dist
+    max_distance = args.max_distance
 
     mappability_cutoff_global = args.mappability_global_cutoff
     mappability_cutoff_donut = args.mappability_donut_cutoff
@@ -2793,7 +2932,8 @@ def loops(argv, **kwargs):
         if is_matrix and not is_rh_peaks and not is_merged_peaks:
             pk = fanc.peaks.RaoPeakCaller(p=peak_size, w_init=width, min_locus_dist=peak_size,
                                           n_processes=threads, slice_size=batch_size,
-                                          cluster=sge, min_mappable_fraction=0.0)
+                                          cluster=sge, min_mappable_fraction=0.0,
+                                          max_distance=max_distance)
             if chromosomes is not None:
                 chromosome_pairs = [(chromosome, chromosome) for chromosome in chromosomes]
             else:
@@ -4060,6 +4200,14 @@ def expected_parser():
         help='Calculate expected values on unnormalised data.'
     )
 
+    parser.add_argument(
+        '-t', '--threads', dest='threads',
+        type=int,
+        default=1,
+        help='Number of processes used for summing up contacts. '
+             'Default: %(default)d'
+    )
+
     return parser
 
 
@@ -4078,6 +4226,7 @@ def expected(argv, **kwargs):
     labels = args.labels
     recalculate = args.recalculate
     norm = args.norm
+    threads = args.threads
     tmp = args.tmp
 
     if labels is None:
@@ -4093,7 +4242,7 @@ def expected(argv, **kwargs):
     for label, input_file in zip(labels, input_files):
         with fanc.load(input_file, mode='a', tmpdir=tmp) as matrix:
             intra_expected, intra_expected_chromosome, inter_expected = matrix.expected_values(
-                force=recalculate, norm=norm)
+                force=recalculate, norm=norm, threads=threads)
 
             logger.info("Inter-chromosomal expected value: {}".format(inter_expected))
 
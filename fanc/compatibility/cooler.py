@@ -11,7 +11,7 @@ from functools import cmp_to_key
 import tempfile
 import warnings
 from ..tools.files import tmp_file_name
-from ..tools.general import str_to_int
+from ..tools.general import str_to_int, range_overlap
 import shutil
 
 
@@ -409,13 +409,66 @@ class CoolerHic(RegionMatrixContainer, cooler.Cooler):
     def _edges_subset(self, key=None, row_regions=None, col_regions=None,
                       lazy=False, *args, **kwargs):
         lazy_edge = LazyCoolerEdge(None, self) if lazy else None
+        for df in self._pixel_subset_chunks(row_regions, col_regions):
+            for index, row in df.iterrows():
+                yield self._series_to_edge(row, lazy_edge=lazy_edge, *args, **kwargs)
+
+    def _pixel_subset_chunks(self, row_regions, col_regions, chunk_size=1000000):
+        """
+        Iterate over pixels between two sets of regions in chunks of rows.
+
+        Unlike a :func:`cooler.Cooler.matrix` selector, this also returns
+        pixels that lie in the lower triangle of the requested matrix
+        section, always in their stored orientation (bin1_id <= bin2_id).
+
+        :return: iterator over :class:`~pandas.DataFrame`
+        """
         row_start, row_end = self._min_max_region_ix(row_regions)
         col_start, col_end = self._min_max_region_ix(col_regions)
 
-        df = cooler.Cooler.matrix(self, as_pixels=True, balance=False)[row_start:row_end+1, col_start:col_end+1]
-
-        for index, row in df.iterrows():
-            yield self._series_to_edge(row, lazy_edge=lazy_edge, *args, **kwargs)
+        bounds = [(row_start, row_end, col_start, col_end)]
+        if (col_start, col_end) != (row_start, row_end):
+            bounds.append((col_start, col_end, row_start, row_end))
+        overlap = range_overlap(row_start, row_end, col_start, col_end)
+
+        # pixels are stored in the upper triangle, sorted by bin1_id
+        bin1_offset = self._load_dset('indexes/bin1_offset')
+        pixels = self.pixels()
+        for i, (source_start, source_end, sink_start, sink_end) in enumerate(bounds):
+            lo, hi = bin1_offset[source_start], bin1_offset[source_end + 1]
+            for start in range(lo, hi, chunk_size):
+                df = pixels[start:min(start + chunk_size, hi)]
+                sources = df['bin1_id'].values
+                sinks = df['bin2_id'].values
+                selected = np.logical_and(sink_start <= sinks, sinks <= sink_end)
+                # pixels in the overlap have already been returned with the first bounds
+                if i > 0 and overlap is not None:
+                    selected &= ~((overlap[0] <= sources) & (sources <= overlap[1]) &
+                                  (overlap[0] <= sinks) & (sinks <= overlap[1]))
+                if np.any(selected):
+                    yield df[selected]
+
+    def _edge_subset_arrays(self, row_regions, col_regions, fields, excluded_filters=0):
+        blocks = list(self._edge_subset_array_chunks(row_regions, col_regions, fields,
+                                                     excluded_filters=excluded_filters))
+        if len(blocks) == 0:
+            return [np.array([], dtype=np.float64 if field == 'weight' else np.int64)
+                    for field in fields]
+        return [np.concatenate([block[i] for block in blocks]) for i in range(len(fields))]
+
+    def _edge_subset_array_chunks(self, row_regions, col_regions, fields, excluded_filters=0,
+                                  chunk_size=1000000):
+        columns = {
+            'source': ('bin1_id', np.int64),
+            'sink': ('bin2_id', np.int64),
+            'weight': ('count', np.float64),
+        }
+        for field in fields:
+            if field not in columns:
+                raise ValueError("Fields must be one of {}".format(list(columns.keys())))
+
+        for df in self._pixel_subset_chunks(row_regions, col_regions, chunk_size=chunk_size):
+            yield [df[columns[field][0]].values.astype(columns[field][1]) for field in fields]
 
     def _edges_getitem(self, item, *args, **kwargs):
         edges = []
@@ -444,8 +497,21 @@ class CoolerHic(RegionMatrixContainer, cooler.Cooler):
         self._mappability = mappable
         return mappable
 
+    @property
+    def field_names(self):
+        return ['source', 'sink', 'weight']
+
+    def _valid_vector(self):
+        bins = self.bins()
+        if 'valid' in bins.columns:
+            return bins['valid'][:].values.astype(bool)
+        return np.ones(len(bins), dtype=bool)
+
     def bias_vector(self):
-        return np.array([r.bias for r in self.regions(lazy=True)])
+        bins = self.bins()
+        if 'weight' in bins.columns:
+            return bins['weight'][:].values
+        return np.ones(len(bins))
 
     def expected_values_and_marginals(self, selected_chromosome=None, norm=True,
                                       *args, **kwargs):
@@ -1,6 +1,7 @@
 import logging
 import struct
 import zlib
+import itertools
 
 import numpy as np
 from genomic_regions import GenomicRegion
@@ -999,6 +1000,50 @@ class JuicerHic(RegionMatrixContainer):
                 edge.source, edge.sink, edge.weight = x, y, weight
                 yield edge
 
+    def _edge_subset_arrays(self, row_regions, col_regions, fields, excluded_filters=0):
+        blocks = list(self._edge_subset_array_chunks(row_regions, col_regions, fields,
+                                                     excluded_filters=excluded_filters))
+        if len(blocks) == 0:
+            return [np.array([], dtype=np.float64 if field == 'weight' else np.int64)
+                    for field in fields]
+        return [np.concatenate([block[i] for block in blocks]) for i in range(len(fields))]
+
+    def _edge_subset_array_chunks(self, row_regions, col_regions, fields, excluded_filters=0,
+                                  chunk_size=1000000):
+        for field in fields:
+            if field not in ('source', 'sink', 'weight'):
+                raise ValueError("Fields must be one of {}".format(['source', 'sink', 'weight']))
+
+        if row_regions[0].chromosome != row_regions[-1].chromosome:
+            raise ValueError("Cannot subset rows across multiple chromosomes!")
+
+        if col_regions[0].chromosome != col_regions[-1].chromosome:
+            raise ValueError("Cannot subset columns across multiple chromosomes!")
+
+        row_span = GenomicRegion(chromosome=row_regions[0].chromosome,
+                                 start=row_regions[0].start,
+                                 end=row_regions[-1].end)
+
+        col_span = GenomicRegion(chromosome=col_regions[0].chromosome,
+                                 start=col_regions[0].start,
+                                 end=col_regions[-1].end)
+
+        entries_iter = self._read_matrix(row_span, col_span)
+        while True:
+            entries = np.array(list(itertools.islice(entries_iter, chunk_size)),
+                               dtype=np.float64).reshape(-1, 3)
+            if len(entries) == 0:
+                break
+
+            x = entries[:, 0].astype(np.int64)
+            y = entries[:, 1].astype(np.int64)
+            columns = {
+                'source': np.minimum(x, y),
+                'sink': np.maximum(x, y),
+                'weight': entries[:, 2],
+            }
+            yield [columns[field] for field in fields]
+
     def _edges_iter(self, *args, **kwargs):
         chromosomes = self.chromosomes()
         for ix1 in range(len(chromosomes)):
@@ -1027,6 +1072,10 @@ class JuicerHic(RegionMatrixContainer):
     def bin_size(self):
         return self._resolution
 
+    @property
+    def field_names(self):
+        return ['source', 'sink', 'weight']
+
     def mappable(self, region=None):
         """
         Get the mappability vector of this matrix.
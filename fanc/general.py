@@ -557,20 +557,25 @@ class Maskable(FileBased):
             raise ValueError("First arg must be PyTable Group or MaskedTable!")
 
 
+def _excluded_mask_ix(excluded_masks=0, maskable=None):
+    if isinstance(excluded_masks, int):
+        return excluded_masks
+    elif maskable is not None:
+        if excluded_masks == 'all':
+            excluded_masks = list(maskable.masks())
+        excluded_mask_ix = maskable.get_binary_mask_from_masks(excluded_masks)
+        logger.debug("Excluded mask binary: {}".format(excluded_mask_ix))
+        return excluded_mask_ix
+    else:
+        raise ValueError("Must provide maskable object in order to derive mask "
+                         "ixs from mask names ({})".format(excluded_masks))
+
+
 class MaskedTableView(object):
     def __init__(self, masked_table, it=None, excluded_masks=0, maskable=None):
         self._mask_field = masked_table._mask_field
         self.iter = iter(it) if it is not None else masked_table._iter_visible_and_masked()
-        if isinstance(excluded_masks, int):
-            self.excluded_mask_ix = excluded_masks
-        elif maskable is not None:
-            if excluded_masks == 'all':
-                excluded_masks = list(maskable.masks())
-            self.excluded_mask_ix = maskable.get_binary_mask_from_masks(excluded_masks)
-            logger.debug("Excluded mask binary: {}".format(self.excluded_mask_ix))
-        else:
-            raise ValueError("Must provide maskable object in order to derive mask "
-                             "ixs from mask names ({})".format(excluded_masks))
+        self.excluded_mask_ix = _excluded_mask_ix(excluded_masks, maskable)
 
     def __iter__(self):
         return self
@@ -885,15 +890,43 @@ class MaskedTable(t.Table):
     def _has_mask(self, row, mask):
         return mask in self._row_masks(row)
 
-    def _filter(self, mask_filters):
+    def _filter(self, mask_filters, chunk_size=1000000):
         mask_filter_ixs = [2 ** mask_filter.mask_ix for mask_filter in mask_filters]
         n_rows = self._original_len()
         masks = self.col(self._mask_field)
 
-        for i, row in enumerate(self._iter_visible_and_masked()):
-            for j, mask_filter in enumerate(mask_filters):
-                if not mask_filter.valid(row):
-                    masks[i] = masks[i] | mask_filter_ixs[j]
+        # filters supporting chunks are run on blocks of rows,
+        # all others on every single row
+        chunk_filters = list(zip(mask_filters, mask_filter_ixs))
+        row_filters = []
+        for start in range(0, n_rows, chunk_size):
+            end = min(start + chunk_size, n_rows)
+            columns = t.Table.read(self, start, end)
+            chunk_masks = masks[start:end]
+            for mask_filter, mask_filter_ix in list(chunk_filters):
+                try:
+                    valid = mask_filter.valid_chunk(columns)
+                except NotImplementedError:
+                    chunk_filters.remove((mask_filter, mask_filter_ix))
+                    row_filters.append((mask_filter, mask_filter_ix))
+                    continue
+                chunk_masks[~np.asarray(valid, dtype=bool)] |= mask_filter_ix
+
+        if len(row_filters) > 0:
+            for i, row in enumerate(self._iter_visible_and_masked()):
+                for mask_filter, mask_filter_ix in row_filters:
+                    if not mask_filter.valid(row):
+                        masks[i] = masks[i] | mask_filter_ix
+
+        return self._set_masks(masks)
+
+    def _set_masks(self, masks):
+        """
+        Replace the mask column and update the row indexes accordingly.
+
+        :param masks: numpy array with one (binary) mask per table row
+        :return: dict with the number of rows for each mask value
+        """
         mask_ixs, masked_length, stats = self._mask_ixs_and_stats_from_masks(masks)
 
         try:
@@ -904,7 +937,7 @@ class MaskedTable(t.Table):
         except t.FileModeError:
             pass
 
-        logger.debug("Total: {}. Valid: {}".format(n_rows, masked_length))
+        logger.debug("Total: {}. Valid: {}".format(len(masks), masked_length))
 
         self.flush(update_index=False)
 
@@ -915,7 +948,9 @@ class MaskedTable(t.Table):
         Run a MaskFilter on this table.
         
         This functions calls the MaskFilter.valid function on
-        every row and masks them if the function returns False.
+        every row (or MaskFilter.valid_chunk on blocks of rows,
+        if the filter supports it) and masks them if the
+        function returns False.
         After running the filter, the table index is updated
         to match only unmasked rows.
 
@@ -954,6 +989,38 @@ class MaskedTable(t.Table):
                                             start=start, stop=stop, step=step)
         return MaskedTableView(self, it, excluded_masks=excluded_filters, maskable=maskable)
 
+    def _visible_rows(self, rows, excluded_filters=0, maskable=None):
+        excluded_mask_ix = _excluded_mask_ix(excluded_filters, maskable)
+        return rows[rows[self._mask_field] | excluded_mask_ix == excluded_mask_ix]
+
+    def read_where(self, condition, condvars=None, field=None,
+                   start=None, stop=None, step=None,
+                   excluded_filters=0, maskable=None):
+        """
+        Read all unmasked rows fulfilling condition into a numpy structured array.
+
+        See :func:`~tables.Table.read_where` for details.
+        """
+        rows = super(MaskedTable, self).read_where(condition, condvars=condvars,
+                                                   start=start, stop=stop, step=step)
+        rows = self._visible_rows(rows, excluded_filters=excluded_filters, maskable=maskable)
+        if field is not None:
+            return rows[field]
+        return rows
+
+    def read_visible(self, start=None, stop=None, step=None, field=None,
+                     excluded_filters=0, maskable=None):
+        """
+        Read all unmasked rows into a numpy structured array.
+
+        See :func:`~tables.Table.read` for details.
+        """
+        rows = t.Table.read(self, start=start, stop=stop, step=step)
+        rows = self._visible_rows(rows, excluded_filters=excluded_filters, maskable=maskable)
+        if field is not None:
+            return rows[field]
+        return rows
+
 
 class MaskFilter(with_metaclass(ABCMeta, object)):
     """
@@ -1017,3 +1084,25 @@ class MaskFilter(with_metaclass(ABCMeta, object)):
             bool: True if row is valid, False otherwise
         """
         pass
+
+    def valid_chunk(self, columns):
+        """
+        Test which rows in a block of table rows are valid according to this filter.
+
+        Implementing this method is optional, but can speed up filtering
+        considerably, as MaskedTable will then process tables in chunks
+        of rows rather than calling :func:`~MaskFilter.valid` on
+        every single row.
+
+        Args:
+            columns (numpy.ndarray):
+                A numpy structured array with one field per table column
+
+        Returns:
+            numpy.ndarray: boolean array, True for every valid row
+
+        Raises:
+            NotImplementedError: if the filter does not support chunks.
+                MaskedTable falls back to :func:`~MaskFilter.valid` in this case.
+        """
+        raise NotImplementedError("Filter does not support vectorised validation")
@@ -4,21 +4,23 @@ from .matrix import RegionMatrixTable, RegionMatrixContainer, Edge, LazyEdge
 from abc import abstractmethod, ABCMeta
 from future.utils import with_metaclass, string_types, viewitems
 from .tools.load import load
-from .tools.general import distribute_integer, RareUpdateProgressBar
+from .registry import class_id_dict
+from .tools.general import distribute_integer, RareUpdateProgressBar, human_format, str_to_int
 from .tools.matrix import restore_sparse_rows, remove_sparse_rows
-from .general import MaskFilter, MaskedTableView
+from .tools.files import hdf5_reader_pool, hdf5_file_uri
+from .general import MaskFilter, MaskedTableView, FileGroup
 from collections import defaultdict
-import multiprocessing as mp
-import threading
 import queue
+import functools
 import numpy as np
+import scipy.sparse as sp
+import tables
 import warnings
 import logging
-import msgpack
 import copy
+from timeit import default_timer as timer
 
 logger = logging.getLogger(__name__)
-fanc_access_lock = threading.Lock()
 
 
 def _edge_overlap_split_rao(original_edge, overlap_map):
@@ -109,51 +111,170 @@ def _get_overlap_map(old_regions, new_regions):
     return old_to_new
 
 
-def _bin_hic_partition_worker(hic_file, qin, qout,
-                              overlap_map, _edges_by_overlap_method,
-                              access_lock):
+def _get_bin_lookup(old_regions, new_regions):
+    """
+    Find the first and last new region overlapping each old region.
 
-    try:
-        overlap_map = msgpack.loads(overlap_map, strict_map_key=False)
-        while True:
-            worker_input = qin.get()
-            if worker_input is None:
-                logger.debug("Received stop signal, worker terminating.")
-                break
-
-            partition1, partition2 = worker_input
-            logger.debug("Received {}-{}".format(partition1, partition2))
-
-            with access_lock:
-                hic = None
-                try:
-                    hic = load(hic_file)
-                    _weight_field = hic._default_score_field
-                    all_edges = []
-                    key = slice(partition1[0], partition1[1], 1), slice(partition2[0], partition2[1], 1)
-                    for edge in hic.edges_dict(key, lazy=True):
-                        try:
-                            all_edges.append([edge['source'], edge['sink'], edge[_weight_field]])
-                        except KeyError:
-                            all_edges.append([edge['source'], edge['sink'], edge['weight']])
+    This is the array equivalent of the first and last entries of
+    each list in :func:`~_get_overlap_map`. New regions must not overlap
+    each other, which is always the case for equidistant bins.
 
-                finally:
-                    if hic is not None:
-                        hic.close()
+    :param old_regions: iterable of old regions
+    :param new_regions: iterable of new regions
+    :return: tuple of int64 arrays (first, last) with one entry per old
+             region. Old regions that do not overlap any new region
+             are assigned -1.
+    """
+    new_ixs, new_starts, new_ends = defaultdict(list), defaultdict(list), defaultdict(list)
+    for i, region in enumerate(new_regions):
+        new_ixs[region.chromosome].append(i)
+        new_starts[region.chromosome].append(region.start)
+        new_ends[region.chromosome].append(region.end)
+
+    old_ixs, old_starts, old_ends = defaultdict(list), defaultdict(list), defaultdict(list)
+    n_old = 0
+    for i, region in enumerate(old_regions):
+        old_ixs[region.chromosome].append(i)
+        old_starts[region.chromosome].append(region.start)
+        old_ends[region.chromosome].append(region.end)
+        n_old += 1
+
+    first_bins = np.full(n_old, -1, dtype=np.int64)
+    last_bins = np.full(n_old, -1, dtype=np.int64)
+    for chromosome, ixs in old_ixs.items():
+        if chromosome not in new_ixs:
+            continue
 
-            edges = defaultdict(int)
-            for old_source, old_sink, old_weight in all_edges:
-                try:
-                    for new_source, new_sink, new_weight in _edges_by_overlap_method(
-                            [old_source, old_sink, old_weight], overlap_map):
-                        if new_weight != 0:
-                            edges[(new_source, new_sink)] += new_weight
-                except KeyError:
-                    warnings.warn("key".format(old_source, old_sink))
+        starts = np.array(new_starts[chromosome], dtype=np.int64)
+        ends = np.array(new_ends[chromosome], dtype=np.int64)
+        order = np.argsort(starts, kind='stable')
+        starts, ends = starts[order], ends[order]
+        if np.any(starts[1:] <= ends[:-1]):
+            raise NotImplementedError("New regions on {} overlap, cannot "
+                                      "use bin lookup".format(chromosome))
+        chromosome_new_ixs = np.array(new_ixs[chromosome], dtype=np.int64)[order]
+
+        ixs = np.array(ixs, dtype=np.int64)
+        # first new region ending at or after the old start,
+        # last new region starting at or before the old end
+        first = np.searchsorted(ends, np.array(old_starts[chromosome], dtype=np.int64), side='left')
+        last = np.searchsorted(starts, np.array(old_ends[chromosome], dtype=np.int64), side='right') - 1
+        overlapping = first <= last
+        first_bins[ixs[overlapping]] = chromosome_new_ixs[first[overlapping]]
+        last_bins[ixs[overlapping]] = chromosome_new_ixs[last[overlapping]]
+
+    return first_bins, last_bins
+
+
+_binned_edge_dtype = np.dtype([('source', np.int64), ('sink', np.int64), ('weight', np.float64)])
+
+
+def _sum_binned_edges(sources, sinks, weights):
+    """
+    Sum the weights of edges with identical source and sink.
+
+    :return: structured array with source, sink, and weight fields,
+             sorted by source and sink
+    """
+    if len(sources) == 0:
+        return np.empty(0, dtype=_binned_edge_dtype)
+
+    order = np.lexsort((sinks, sources))
+    sources, sinks, weights = sources[order], sinks[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, np.logical_or(np.diff(sources) != 0,
+                                                      np.diff(sinks) != 0)])
+
+    edges = np.empty(len(starts), dtype=_binned_edge_dtype)
+    edges['source'] = sources[starts]
+    edges['sink'] = sinks[starts]
+    edges['weight'] = np.add.reduceat(weights, starts)
+    return edges
+
+
+def _bin_edges(sources, sinks, weights, first_bins, last_bins):
+    """
+    Resolve the distribution of contacts when binning using
+    Rao and Rowley et al. 2014 approach.
+
+    Array version of :func:`~_edge_overlap_split_rao`: each edge is split
+    between the first and last new regions overlapping its source and sink.
+    Weights are distributed in integer steps, the remainder goes to randomly
+    chosen new edges.
+
+    :param sources: array of old source region indices
+    :param sinks: array of old sink region indices
+    :param weights: array of old edge weights
+    :param first_bins: first new region overlapping each old region (-1 if none),
+                       see :func:`~_get_bin_lookup`
+    :param last_bins: last new region overlapping each old region (-1 if none)
+    :return: structured array of unique binned edges, see :func:`~_sum_binned_edges`
+    """
+    source_bins = np.stack([first_bins[sources], last_bins[sources]], axis=1)
+    sink_bins = np.stack([first_bins[sinks], last_bins[sinks]], axis=1)
+    valid = np.logical_and(source_bins[:, 0] >= 0, sink_bins[:, 0] >= 0)
+    source_bins, sink_bins = source_bins[valid], sink_bins[valid]
+    weights = np.asarray(weights, dtype=np.float64)[valid]
+
+    # all combinations of first and last bins
+    new_sources = np.repeat(source_bins, 2, axis=1)
+    new_sinks = np.tile(sink_bins, 2)
+    new_sources, new_sinks = np.minimum(new_sources, new_sinks), np.maximum(new_sources, new_sinks)
+
+    duplicate = np.zeros(new_sources.shape, dtype=bool)
+    for i in range(1, 4):
+        for j in range(i):
+            duplicate[:, i] |= np.logical_and(new_sources[:, i] == new_sources[:, j],
+                                              new_sinks[:, i] == new_sinks[:, j])
+    n_new = 4 - np.sum(duplicate, axis=1)
+
+    # rotate ranks randomly so that remainders do not always go to the same edge
+    rank = np.cumsum(~duplicate, axis=1) - 1
+    offset = (np.random.random(len(n_new)) * n_new).astype(np.int64)
+    rank = (rank + offset[:, None]) % n_new[:, None]
+
+    base = np.floor(weights / n_new)
+    remainder = weights - base * n_new
+    new_weights = base[:, None] + np.clip(remainder[:, None] - rank, 0, 1)
+
+    keep = np.logical_and(~duplicate, new_weights != 0)
+    return _sum_binned_edges(new_sources[keep], new_sinks[keep], new_weights[keep])
+
+
+def _bin_hic_partition(hic, partition, first_bins, last_bins, chunk_size=1000000):
+    """
+    Bin all edges in one edge table partition of a matrix.
+
+    :return: structured array of unique binned edges, see :func:`~_sum_binned_edges`
+    """
+    weight_field = hic._default_score_field or 'weight'
+    binned = []
+    for _, rows in hic._iter_edge_table_chunks(chunk_size=chunk_size, partitions={partition}):
+        field = weight_field if weight_field in rows.dtype.names else 'weight'
+        binned.append(_bin_edges(rows['source'], rows['sink'], rows[field],
+                                 first_bins, last_bins))
 
-            qout.put(msgpack.dumps(edges))
-    except Exception as e:
-        qout.put(e)
+    if len(binned) == 1:
+        return binned[0]
+    binned = np.concatenate(binned) if len(binned) > 0 else np.empty(0, dtype=_binned_edge_dtype)
+    return _sum_binned_edges(binned['source'], binned['sink'], binned['weight'])
+
+
+_bin_lookup = None
+
+
+def _bin_hic_worker_init(first_bins, last_bins):
+    global _bin_lookup
+    _bin_lookup = (first_bins, last_bins)
+
+
+def _bin_hic_partition_worker(hic_file, partition):
+    hic = None
+    try:
+        hic = load(hic_file, mode='r')
+        return _bin_hic_partition(hic, partition, *_bin_lookup)
+    finally:
+        if hic is not None:
+            hic.close()
 
 
 class Hic(RegionMatrixTable):
@@ -181,8 +302,7 @@ class Hic(RegionMatrixTable):
                                    _edge_buffer_size=_edge_buffer_size)
 
     def load_from_hic(self, hic, threads=1, chromosomes=None,
-                      _edges_by_overlap_method=_edge_overlap_split_rao,
-                      _regions_soft_max=50000):
+                      _edges_by_overlap_method=_edge_overlap_split_rao):
         """
         Load data from another :class:`~Hic` object.
 
@@ -196,15 +316,13 @@ class Hic(RegionMatrixTable):
         :param hic: Another :class:`~Hic` object
         :param threads: Number of parallel processing threads. More threads also
                         means higher memory usage.
+        :param chromosomes: List of chromosomes to bin. Only used if the
+                            provided object is not a :class:`~RegionMatrixTable`
         :param _edges_by_overlap_method: A function that maps reads from
                                          one genomic region to others using
                                          a supplied overlap map. By default
                                          it uses the Rao et al. (2014) method.
                                          See :func:`~_edge_overlap_split_rao`
-        :param _regions_soft_max: Maximum dimension of each processed submatrix
-                                  per thread. This is a soft maximum, which may be
-                                  increased as required for very large chromosomes or
-                                  small bin sizes
         """
         # if we do not have any nodes in this Hi-C object...
         if len(self.regions) == 0:
@@ -215,107 +333,223 @@ class Hic(RegionMatrixTable):
         else:
             logger.info("Binning Hi-C contacts")
 
-            # create region "overlap map"
-            overlap_map = _get_overlap_map(hic.regions(lazy=False), self.regions(lazy=False))
-
-            file_name = hic.file.filename
-            m = mp.Manager()
-            access_lock = m.Lock()
-            qout = m.Queue()
-            qin = m.Queue()
-
-            if not isinstance(hic, RegionMatrixTable):
-                edge_counter = 0
-                with RareUpdateProgressBar(max_value=len(hic.edges), silent=config.hide_progressbars,
-                                           prefix="Binning") as pb:
-                    if chromosomes is None:
-                        chromosomes = hic.chromosomes()
-                    for i in range(len(chromosomes)):
-                        for j in range(i, len(chromosomes)):
-                            logger.debug("Chromosomes: {}-{}".format(chromosomes[i], chromosomes[j]))
-                            edges = defaultdict(int)
-                            for edge in hic.edges_dict((chromosomes[i], chromosomes[j]), lazy=True, norm=False):
-                                old_source, old_sink = edge['source'], edge['sink']
-                                try:
-                                    old_weight = edge[hic._default_score_field]
-                                except KeyError:
-                                    old_weight = edge['weight']
-
-                                for new_source, new_sink, new_weight in _edges_by_overlap_method(
-                                        [old_source, old_sink, old_weight], overlap_map):
-                                    if new_weight != 0:
-                                        edges[(new_source, new_sink)] += new_weight
-
-                                edge_counter += 1
-                                pb.update(edge_counter)
-                            logger.debug("Adding edges {}/{} ({})".format(i, j, len(edges)))
-                            for (source, sink), weight in edges.items():
-                                self.add_edge_simple(source, sink, weight=weight)
-            else:
-                pool = None
+            bin_lookup = None
+            if _edges_by_overlap_method is _edge_overlap_split_rao:
                 try:
-                    logger.info("Launching processes")
-                    with mp.get_context("spawn").Pool(threads, _bin_hic_partition_worker,
-                                                      (file_name,
-                                                       qin, qout,
-                                                       msgpack.dumps(overlap_map),
-                                                       _edges_by_overlap_method,
-                                                       access_lock)) as pool:
-
-                        n_fragments = len(hic.regions)
-                        thread_max = min(int(n_fragments/threads), _regions_soft_max)
-                        partitions = [[0, 0]]
-                        previous_chromosome = None
-                        for i, region in enumerate(hic.regions(lazy=True)):
-                            if previous_chromosome is not None and (region.chromosome != previous_chromosome
-                                                                    or i == n_fragments - 1):
-                                partition_size = partitions[-1][1] - partitions[-1][0]
-                                current_size = i - partitions[-1][1]
-                                partition_empty = thread_max - partition_size
-
-                                if partition_size == 0 or partition_empty > current_size/2:
-                                    partitions[-1][1] = i
-                                else:
-                                    partitions.append([partitions[-1][1], i])
-                            previous_chromosome = region.chromosome
-                        partitions[-1][1] = n_fragments
-
-                        logger.info("Submitting partitions")
-
-                        # submit intra-chromosomal first to distribute
-                        # load among workers more evenly
-                        n_chunks = 0
-                        for partition in partitions:
-                            qin.put((partition, partition))
-                            n_chunks += 1
-
-                        # then submit inter-chromosomal partitions
-                        for cix1, partition1 in enumerate(partitions):
-                            for cix2 in range(cix1 + 1, len(partitions)):
-                                partition2 = partitions[cix2]
-                                qin.put((partition1, partition2))
-                                n_chunks += 1
-
-                        self._disable_edge_indexes()
-                        logger.info("Collecting results")
-                        with RareUpdateProgressBar(max_value=n_chunks, prefix="Binning") as pb:
-                            for i in range(n_chunks):
-                                out = qout.get(block=True)
-                                if isinstance(out, Exception):
-                                    raise out
-                                edges = msgpack.loads(out, use_list=False, strict_map_key=False)
-                                for (source, sink), weight in edges.items():
-                                    self.add_edge_simple(source, sink, weight=weight)
-                                pb.update(i)
-                finally:
-                    for i in range(threads):
-                        qin.put(None)
-
-                    if pool is not None:
-                        pool.terminate()
+                    bin_lookup = _get_bin_lookup(hic.regions(lazy=True), self.regions(lazy=True))
+                except NotImplementedError as e:
+                    logger.info("{}, falling back to (slower) edge by edge binning".format(e))
+
+            if bin_lookup is None:
+                binned_edges = self._binned_edges_by_overlap(hic, chromosomes,
+                                                             _edges_by_overlap_method)
+            elif isinstance(hic, RegionMatrixTable):
+                binned_edges = self._binned_edges_by_partition(hic, bin_lookup, threads=threads)
+            else:
+                binned_edges = self._binned_edges_by_chromosome(hic, chromosomes, bin_lookup)
+
+            self._add_binned_edges(binned_edges)
+
             logger.debug("Final flush")
             self.flush()
 
+    @staticmethod
+    def _binned_edges_by_partition(hic, bin_lookup, threads=1):
+        """
+        Bin the edges of a :class:`~RegionMatrixTable` table by table.
+
+        With more than one thread, every worker opens the matrix
+        file read-only and bins whole edge table partitions.
+
+        :return: iterator over structured arrays of binned edges
+        """
+        partitions = sorted(((edge_table._original_len(), partition)
+                             for partition, edge_table in hic._iter_edge_tables()),
+                            reverse=True)
+        partitions = [partition for _, partition in partitions]
+
+        file_name = None
+        if threads > 1 and len(partitions) > 1:
+            file_name = hdf5_file_uri(getattr(hic, 'file', None))
+            if file_name is None:
+                logger.warning("Matrix is not stored in a file, cannot bin "
+                               "edges in parallel.")
+                file_name = None
+
+        with RareUpdateProgressBar(max_value=len(partitions), silent=config.hide_progressbars,
+                                   prefix="Binning") as pb:
+            if file_name is None:
+                for i, partition in enumerate(partitions):
+                    yield _bin_hic_partition(hic, partition, *bin_lookup)
+                    pb.update(i)
+            else:
+                # workers need to see all data
+                hic.flush()
+                hic.file.flush()
+
+                with hdf5_reader_pool(min(threads, len(partitions)), _bin_hic_worker_init,
+                                      bin_lookup) as pool:
+                    results = pool.imap_unordered(functools.partial(_bin_hic_partition_worker,
+                                                                    file_name),
+                                                  partitions)
+                    for i, binned in enumerate(results):
+                        yield binned
+                        pb.update(i)
+
+    @staticmethod
+    def _binned_edges_by_chromosome(hic, chromosomes, bin_lookup):
+        """
+        Bin the edges of any matrix chromosome pair by chromosome pair.
+
+        :return: iterator over structured arrays of binned edges
+        """
+        if chromosomes is None:
+            chromosomes = hic.chromosomes()
+
+        edge_counter = 0
+        with RareUpdateProgressBar(max_value=len(hic.edges), silent=config.hide_progressbars,
+                                   prefix="Binning") as pb:
+            for i in range(len(chromosomes)):
+                for j in range(i, len(chromosomes)):
+                    logger.debug("Chromosomes: {}-{}".format(chromosomes[i], chromosomes[j]))
+                    for sources, sinks, weights in hic.edges_arrays((chromosomes[i], chromosomes[j]),
+                                                                    norm=False):
+                        edge_counter += len(sources)
+                        pb.update(edge_counter)
+                        yield _bin_edges(sources, sinks, weights, *bin_lookup)
+
+    def _binned_edges_by_overlap(self, hic, chromosomes, edges_by_overlap_method):
+        """
+        Bin edges one by one using an overlap map and a custom overlap method.
+
+        :return: iterator over structured arrays of binned edges
+        """
+        overlap_map = _get_overlap_map(hic.regions(lazy=False), self.regions(lazy=False))
+
+        if chromosomes is None:
+            chromosomes = hic.chromosomes()
+
+        edge_counter = 0
+        with RareUpdateProgressBar(max_value=len(hic.edges), silent=config.hide_progressbars,
+                                   prefix="Binning") as pb:
+            for i in range(len(chromosomes)):
+                for j in range(i, len(chromosomes)):
+                    logger.debug("Chromosomes: {}-{}".format(chromosomes[i], chromosomes[j]))
+                    edges = defaultdict(int)
+                    for edge in hic.edges_dict((chromosomes[i], chromosomes[j]), lazy=True, norm=False):
+                        old_source, old_sink = edge['source'], edge['sink']
+                        try:
+                            old_weight = edge[hic._default_score_field]
+                        except KeyError:
+                            old_weight = edge['weight']
+
+                        for new_source, new_sink, new_weight in edges_by_overlap_method(
+                                [old_source, old_sink, old_weight], overlap_map):
+                            if new_weight != 0:
+                                edges[(new_source, new_sink)] += new_weight
+
+                        edge_counter += 1
+                        pb.update(edge_counter)
+
+                    binned = np.empty(len(edges), dtype=_binned_edge_dtype)
+                    for k, ((source, sink), weight) in enumerate(edges.items()):
+                        binned[k] = (source, sink, weight)
+                    yield binned
+
+    def _split_binned_edges(self, binned):
+        """
+        Split a structured array of binned edges by edge table partition.
+
+        :return: iterator over ((source_partition, sink_partition), structured array) tuples
+        """
+        breaks = self._partition_breaks
+        source_partitions = np.searchsorted(breaks, binned['source'], side='right')
+        sink_partitions = np.searchsorted(breaks, binned['sink'], side='right')
+        for partition in set(zip(source_partitions.tolist(), sink_partitions.tolist())):
+            in_partition = np.logical_and(source_partitions == partition[0],
+                                          sink_partitions == partition[1])
+            yield partition, binned[in_partition]
+
+    def _write_binned_edges(self, partition, binned):
+        """
+        Append binned edges to the edge table of a single partition.
+        """
+        weight_field = self._default_score_field or 'weight'
+        edge_table = self._edge_table(partition[0], partition[1], create_index=False)
+        n_rows = edge_table._original_len()
+        rows = np.empty(len(binned), dtype=edge_table.dtype)
+        for field in edge_table.colnames:
+            rows[field] = edge_table.coldflts[field]
+        rows['source'] = binned['source']
+        rows['sink'] = binned['sink']
+        rows[weight_field] = binned['weight']
+        rows[edge_table._mask_index_field] = np.arange(n_rows, n_rows + len(rows))
+        edge_table.append(rows)
+        edge_table.flush(update_index=False)
+
+    def _add_binned_edges(self, binned_edges):
+        """
+        Collect binned edges by partition and append them in bulk.
+
+        Edges with the same source and sink from different inputs are summed.
+
+        :param binned_edges: iterable of structured arrays with source,
+                             sink, and weight fields
+        """
+        self._flush_regions()
+
+        partition_edges = defaultdict(list)
+        for binned in binned_edges:
+            for partition, partition_binned in self._split_binned_edges(binned):
+                partition_edges[partition].append(partition_binned)
+
+        self._disable_edge_indexes()
+        for partition in sorted(partition_edges.keys()):
+            binned = np.concatenate(partition_edges.pop(partition))
+            binned = _sum_binned_edges(binned['source'], binned['sink'], binned['weight'])
+            self._write_binned_edges(partition, binned)
+        self._edges_dirty = True
+
+    def _append_binned_edges(self, binned):
+        """
+        Append binned edges to their edge tables right away.
+
+        Unlike :func:`~Hic._add_binned_edges`, edges are not summed with
+        edges already written, so that nothing needs to be kept in memory
+        between calls. Edge indexes should be disabled beforehand, and
+        :func:`~Hic._merge_binned_edges` must be called once all edges
+        have been appended.
+
+        :param binned: structured array with source, sink, and weight fields
+        """
+        self._flush_regions()
+        for partition, partition_binned in self._split_binned_edges(binned):
+            self._write_binned_edges(partition, partition_binned)
+        self._edges_dirty = True
+
+    def _merge_binned_edges(self):
+        """
+        Sum duplicate edges left by :func:`~Hic._append_binned_edges`.
+
+        Edge tables are processed one at a time, so only a single
+        table is held in memory.
+        """
+        self._disable_edge_indexes()
+        weight_field = self._default_score_field or 'weight'
+        for partition, edge_table in self._iter_edge_tables():
+            n_rows = edge_table._original_len()
+            if n_rows == 0:
+                continue
+            rows = tables.Table.read(edge_table)
+            binned = _sum_binned_edges(rows['source'], rows['sink'],
+                                       rows[weight_field].astype(np.float64))
+            del rows
+            if len(binned) == n_rows:
+                continue
+            edge_table.truncate(0)
+            self._write_binned_edges(partition, binned)
+        self._edges_dirty = True
+
     def bin(self, bin_size, threads=1, chromosomes=None, *args, **kwargs):
         """
         Map edges in this object to equidistant bins.
@@ -366,7 +600,7 @@ class Hic(RegionMatrixTable):
         if vector is not None:
             self.region_data('bias', vector)
 
-        biases = np.array(list(self.region_data('bias')))
+        biases = self._regions.col('bias')
         return biases
 
     def filter_diagonal(self, distance=0, queue=False):
@@ -437,6 +671,125 @@ class Hic(RegionMatrixTable):
         return bias_vector
 
 
+class MultiResolutionHic(FileGroup):
+    """
+    Container for the same Hi-C data binned at multiple resolutions.
+
+    Every resolution is a complete :class:`~Hic` object, with its own
+    regions, edges, masks, and expected values, stored in a separate
+    group of a single HDF5 file.
+
+    Individual resolutions can be opened with :func:`~MultiResolutionHic.hic`
+    or directly using :func:`~fanc.load`:
+
+    .. code::
+
+        hic = fanc.load("/path/to/file.hic@25kb")
+        # or
+        hic = fanc.load("/path/to/file.hic", resolution=25000)
+    """
+
+    _classid = 'MULTIRESOLUTIONHIC'
+    _resolutions_group = 'resolutions'
+
+    def __init__(self, file_name=None, mode='a', tmpdir=None):
+        """
+        Initialise a multi-resolution Hi-C file.
+
+        :param file_name: Path to file or None for in-memory file
+        :param mode: File mode. Defaults to 'a' (append). Use 'r' for read-only
+                     access, and 'w' for write mode that will overwrite any
+                     previous file content.
+        :param tmpdir: If True, will copy an existing or create a new file to a
+                       temporary directory. You can also pass the path to a folder
+                       here directly.
+        """
+        FileGroup.__init__(self, self._resolutions_group, file_name=file_name,
+                           mode=mode, tmpdir=tmpdir)
+
+    @classmethod
+    def resolution_group(cls, resolution):
+        """
+        Path of the HDF5 group holding the matrix at this resolution.
+
+        :param resolution: Bin size in base pairs
+        :return: str
+        """
+        return '/{}/res_{}'.format(cls._resolutions_group, resolution)
+
+    def resolutions(self):
+        """
+        Get all resolutions stored in this file.
+
+        :return: sorted list of bin sizes in base pairs
+        """
+        return sorted(int(name[4:]) for name in self._group._v_children.keys()
+                      if name.startswith('res_'))
+
+    def hic(self, resolution, mode=None, _hic_class=Hic):
+        """
+        Open the matrix at a specific resolution.
+
+        The returned object has its own file handle and must be
+        closed independently of this container.
+
+        :param resolution: Bin size in base pairs. You can use
+                           human-readable formats, such as '25kb'
+        :param mode: File mode of the returned object. Defaults to the mode
+                     of this container ('a' if writable). Use 'w' to create
+                     a new, empty matrix at this resolution, replacing any
+                     existing data.
+        :return: :class:`~Hic`
+        """
+        resolution = str_to_int(str(resolution))
+        if mode is None:
+            mode = 'r' if self.file.mode == 'r' else 'a'
+        if mode != 'r' and self.file.mode == 'r':
+            raise ValueError("Cannot open resolution in mode '{}', multi-resolution "
+                             "file is read-only".format(mode))
+
+        group = self.resolution_group(resolution)
+        if mode == 'w':
+            if resolution in self.resolutions():
+                self.file.remove_node(group, recursive=True)
+            self.file.create_group(self._group, 'res_{}'.format(resolution))
+            self.file.flush()
+            hdf5_file = tables.open_file(self.file.filename, mode='a', root_uep=group)
+            return _hic_class(file_name=hdf5_file, mode='w')
+
+        if resolution not in self.resolutions():
+            raise ValueError("Resolution {} not found in file. Available resolutions: "
+                             "{}".format(resolution, ", ".join(str(r) for r in self.resolutions())))
+
+        classid = self.file.get_node(group + '/meta_information').meta_node.attrs['_classid']
+        classid = classid.decode() if isinstance(classid, bytes) else classid
+        hdf5_file = tables.open_file(self.file.filename, mode=mode, root_uep=group)
+        return class_id_dict[classid](file_name=hdf5_file, mode=mode)
+
+    def add_hic(self, hic, resolution=None):
+        """
+        Copy an existing matrix into this file.
+
+        :param hic: :class:`~Hic` object
+        :param resolution: Bin size in base pairs. Defaults to the
+                           bin size of hic
+        """
+        if resolution is None:
+            resolution = hic.bin_size
+        if resolution is None:
+            raise ValueError("Cannot determine resolution of matrix with unequal bin sizes, "
+                             "please specify resolution explicitly")
+        resolution = str_to_int(str(resolution))
+
+        hic.flush()
+        group = self.resolution_group(resolution)
+        if resolution in self.resolutions():
+            self.file.remove_node(group, recursive=True)
+        group_node = self.file.create_group(self._group, 'res_{}'.format(resolution))
+        hic.file.root._f_copy_children(group_node, recursive=True)
+        self.file.flush()
+
+
 class LegacyHic(Hic):
 
     _classid = 'ACCESSOPTIMISEDHIC'
@@ -616,6 +969,13 @@ class DiagonalFilter(HicEdgeFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        """
+        Check which edges in a block of edge table rows are off the diagonal.
+        """
+        distances = np.abs(columns['source'].astype(np.int64) - columns['sink'].astype(np.int64))
+        return distances > self.distance
+
 
 class LowCoverageFilter(HicEdgeFilter):
     """
@@ -662,10 +1022,8 @@ class LowCoverageFilter(HicEdgeFilter):
             cutoff = self.calculate_cutoffs(rel_cutoff)[0]
         logger.info("Final absolute cutoff threshold is {:.4}".format(float(cutoff)))
 
-        self._regions_to_mask = set()
-        for i, contacts in enumerate(self._marginals):
-            if contacts < cutoff:
-                self._regions_to_mask.add(i)
+        self._region_mask = np.asarray(self._marginals < cutoff, dtype=bool)
+        self._regions_to_mask = set(np.where(self._region_mask)[0].tolist())
         logger.info("Selected a total of {} ({:.1%}) regions to be masked".format(
             len(self._regions_to_mask), len(self._regions_to_mask)/len(hic_object.regions)))
 
@@ -684,14 +1042,302 @@ class LowCoverageFilter(HicEdgeFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        """
+        Check which edges in a block of edge table rows connect two regions
+        with sufficient coverage.
+        """
+        return ~np.logical_or(self._region_mask[columns['source']],
+                              self._region_mask[columns['sink']])
+
+
+def _edges_to_arrays(hic, key=None, **kwargs):
+    """
+    Collect unnormalised edges into contiguous source, sink, and weight arrays.
+
+    Edges are read in chunks of numpy arrays using
+    :func:`~fanc.matrix.RegionMatrixContainer.edges_arrays`, which are then
+    concatenated.
+
+    :param hic: Hi-C object
+    :param key: Edge selector, see :func:`~fanc.matrix.RegionPairsContainer.edges`
+    :param kwargs: Keyword arguments passed to
+                   :func:`~fanc.matrix.RegionMatrixContainer.edges_arrays`
+    :return: source (int64), sink (int64) and weight (float64) numpy arrays
+    """
+    chunks = list(hic.edges_arrays(key, norm=False, **kwargs))
+    if len(chunks) == 0:
+        return (np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.float64))
+    return (np.concatenate([chunk[0] for chunk in chunks]),
+            np.concatenate([chunk[1] for chunk in chunks]),
+            np.concatenate([chunk[2] for chunk in chunks]))
+
+
+def _ice_marginals(sources, sinks, weights, n):
+    """
+    Calculate the marginals of a symmetric matrix stored as upper-triangle edge arrays.
+
+    :param sources: Row indices of the upper triangle
+    :param sinks: Column indices of the upper triangle
+    :param weights: Matrix values
+    :param n: Matrix dimension
+    :return: numpy array of length n
+    """
+    off_diagonal = sources != sinks
+    m = np.bincount(sources, weights=weights, minlength=n)
+    m += np.bincount(sinks[off_diagonal], weights=weights[off_diagonal], minlength=n)
+    return m
+
+
+def _ice_marginals_chunked(hic, bias_vector, offset=0, partitions=None, chromosome_ixs=None,
+                           intra_chromosomal=True, inter_chromosomal=True, chunk_size=1000000):
+    """
+    Calculate the marginals of a bias-corrected matrix by streaming edge table chunks.
+
+    Edge weights are divided by the current (cumulative) bias factors on the fly,
+    so that the original weights on disk never need to be modified or held in memory.
+
+    :param hic: :class:`~fanc.matrix.RegionMatrixTable`
+    :param bias_vector: Current cumulative bias vector, edges with a zero
+                        bias factor do not contribute to the marginals
+    :param offset: Index of the first region covered by the bias vector
+    :param partitions: Optional collection of (source_partition, sink_partition) tuples
+                       restricting the edge tables read
+    :param chromosome_ixs: Array with a chromosome index for every region. Only
+                           required when excluding intra- or inter-chromosomal edges
+    :param intra_chromosomal: Include intra-chromosomal edges
+    :param inter_chromosomal: Include inter-chromosomal edges
+    :param chunk_size: Number of edge table rows read at a time
+    :return: numpy array of marginals, number of chunks processed
+    """
+    weight_field = hic._default_score_field
+    n = len(bias_vector)
+    m = np.zeros(n, dtype='float64')
+    n_chunks = 0
+    for _, rows in hic._iter_edge_table_chunks(chunk_size=chunk_size, partitions=partitions):
+        n_chunks += 1
+        sources = rows['source'].astype(np.int64) - offset
+        sinks = rows['sink'].astype(np.int64) - offset
+        weights = rows[weight_field].astype(np.float64)
+
+        keep = np.logical_and(sources >= 0, sinks < n)
+        if chromosome_ixs is not None and not (intra_chromosomal and inter_chromosomal):
+            intra = chromosome_ixs[sources + offset] == chromosome_ixs[sinks + offset]
+            if not intra_chromosomal:
+                keep = np.logical_and(keep, ~intra)
+            if not inter_chromosomal:
+                keep = np.logical_and(keep, intra)
+        sources, sinks, weights = sources[keep], sinks[keep], weights[keep]
+
+        source_bias = bias_vector[sources]
+        sink_bias = bias_vector[sinks]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.where(np.logical_or(source_bias == 0, sink_bias == 0), 0,
+                               weights / source_bias / sink_bias)
+
+        m += _ice_marginals(sources, sinks, weights, n)
+    return m, n_chunks
+
+
+def _ice_balancing_chunked(hic, tolerance=1e-2, max_iterations=500, whole_matrix=True,
+                           inter_chromosomal=True, intra_chromosomal=True, restore_coverage=False,
+                           sqrt=True, chunk_size=1000000):
+    """
+    Out-of-core equivalent of :func:`~ice_balancing`.
+
+    Rather than loading all edges into memory, every iteration reads
+    the edge tables of the matrix in chunks of :code:`chunk_size` rows.
+    Memory usage is bounded by the bias vector plus a single chunk.
+
+    :return: bias vector (not inverted)
+    """
+    if not hasattr(hic, '_iter_edge_table_chunks'):
+        raise ValueError("Chunked ICE balancing is only supported for "
+                         "FAN-C matrix files, not {}".format(type(hic)))
+
+    chromosome_bins = hic.chromosome_bins
+    if whole_matrix:
+        chromosome_ixs = np.zeros(len(hic.regions), dtype=np.int64)
+        for i, chromosome in enumerate(hic.chromosomes()):
+            start, end = chromosome_bins[chromosome]
+            chromosome_ixs[start:end] = i
+        # (chromosome, offset, end, partitions)
+        balancing_units = [(None, 0, len(hic.regions), None)]
+    else:
+        chromosome_ixs = None
+        balancing_units = []
+        for chromosome in hic.chromosomes():
+            start, end = chromosome_bins[chromosome]
+            partition_start = hic._get_partition_ix(start)
+            partition_end = hic._get_partition_ix(end - 1)
+            partitions = set()
+            for i in range(partition_start, partition_end + 1):
+                for j in range(i, partition_end + 1):
+                    partitions.add((i, j))
+            balancing_units.append((chromosome, start, end, partitions))
+
+    bias_vectors = []
+    for chromosome, offset, end, partitions in balancing_units:
+        if chromosome is None:
+            n_regions = end - offset
+        else:
+            n_regions = sum(1 for region in hic.regions(chromosome, lazy=True) if region.valid)
+
+        bias_vector = np.ones(end - offset, dtype='float64')
+        marginal_error = tolerance + 1
+        current_iteration = 0
+        total_weight = None
+
+        while (marginal_error > tolerance and
+               current_iteration < max_iterations):
+            iteration_start = timer()
+            m, n_chunks = _ice_marginals_chunked(hic, bias_vector, offset=offset, partitions=partitions,
+                                                 chromosome_ixs=chromosome_ixs,
+                                                 intra_chromosomal=intra_chromosomal,
+                                                 inter_chromosomal=inter_chromosomal,
+                                                 chunk_size=chunk_size)
+            if total_weight is None:
+                total_weight = np.sum(m)
+
+            marginal_error = _marginal_error(m)
+
+            # whole matrix balancing always uses square root marginals, see ice_balancing
+            if sqrt or whole_matrix:
+                m = np.sqrt(m)
+            else:
+                # multiply with constant factor so marginals are 1
+                bias_mean = np.mean(m[m != 0])
+                marginal_mean = np.sqrt(np.sum(m) / n_regions)
+                m = m * marginal_mean / bias_mean
+
+            bias_vector *= m
+
+            current_iteration += 1
+            logger.info("{}iteration {}: error {:.6f}, {} chunks in {:.1f}s".format(
+                "" if chromosome is None else "{} ".format(chromosome),
+                current_iteration, marginal_error, n_chunks, timer() - iteration_start))
+
+        if restore_coverage:
+            bias_vector = bias_vector / np.sqrt(total_weight / n_regions)
+
+        bias_vectors.append(bias_vector)
+
+    return np.concatenate(bias_vectors)
+
+
+def _ice_balance_chromosome(hic, chromosome, tolerance=1e-2, max_iterations=500,
+                            restore_coverage=False, sqrt=True):
+    """
+    ICE balancing of a single intra-chromosomal matrix.
+
+    :return: bias vector (not inverted) for the regions of this chromosome
+    """
+    offset, end = hic.chromosome_bins[chromosome]
+    bias_vector = np.ones(end - offset, dtype='float64')
+    n_regions = sum(1 for region in hic.regions(chromosome, lazy=True) if region.valid)
+
+    marginal_error = tolerance + 1
+    current_iteration = 0
+
+    sources, sinks, weights = _edges_to_arrays(hic, (chromosome, chromosome))
+    sources -= offset
+    sinks -= offset
+    total_weight = np.sum(weights) + np.sum(weights[sources != sinks])
+
+    while (marginal_error > tolerance and
+           current_iteration < max_iterations):
+        m = _ice_marginals(sources, sinks, weights, len(bias_vector))
+
+        marginal_error = _marginal_error(m)
+
+        if sqrt:
+            m = np.sqrt(m)
+        else:
+            # multiply with constant factor so marginals are 1
+            bias_mean = np.mean(m[m != 0])
+            marginal_mean = np.sqrt(np.sum(m) / n_regions)
+            m = m * marginal_mean / bias_mean
+
+        bias_vector *= m
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.where(m[sinks] == 0, 0, weights / m[sources] / m[sinks])
+
+        current_iteration += 1
+        logger.debug("{} iteration: {}, error: {}".format(chromosome, current_iteration, marginal_error))
+
+    if restore_coverage:
+        bias_vector = bias_vector / np.sqrt(total_weight / n_regions)
+
+    return bias_vector
+
+
+def _balance_chromosome_worker(file_name, chromosome, balancing_function, kwargs):
+    hic = None
+    try:
+        hic = load(file_name, mode='r')
+        return balancing_function(hic, chromosome, **kwargs)
+    finally:
+        if hic is not None:
+            hic.close()
+
+
+def _balance_chromosomes(hic, balancing_function, threads=1, **kwargs):
+    """
+    Run a per-chromosome balancing function on every chromosome of a matrix.
+
+    With more than one thread, chromosomes are balanced in a process pool.
+    Every worker opens the matrix file read-only and only reads the
+    intra-chromosomal edges of the chromosome it is assigned.
+
+    :param hic: Hi-C object
+    :param balancing_function: Module-level function with signature
+                               (hic, chromosome, **kwargs) returning the
+                               bias vector of that chromosome
+    :param threads: Number of worker processes
+    :param kwargs: Keyword arguments passed to balancing_function
+    :return: concatenated bias vector of all chromosomes
+    """
+    chromosomes = hic.chromosomes()
+
+    file_name = None
+    if threads > 1 and len(chromosomes) > 1:
+        file_name = hdf5_file_uri(getattr(hic, 'file', None))
+        if file_name is None:
+            logger.warning("Matrix is not stored in a file, cannot balance "
+                           "chromosomes in parallel.")
+            file_name = None
+
+    if file_name is None:
+        bias_vectors = [balancing_function(hic, chromosome, **kwargs) for chromosome in chromosomes]
+    else:
+        # workers need to see all data
+        hic.flush()
+        hic.file.flush()
+
+        n_processes = min(threads, len(chromosomes))
+        with hdf5_reader_pool(n_processes) as pool:
+            logger.info("Balancing {} chromosomes using {} processes".format(len(chromosomes),
+                                                                          n_processes))
+            bias_vectors = pool.starmap(_balance_chromosome_worker,
+                                        [(file_name, chromosome, balancing_function, kwargs)
+                                         for chromosome in chromosomes])
+
+    return np.concatenate(bias_vectors)
+
 
 def ice_balancing(hic, tolerance=1e-2, max_iterations=500, whole_matrix=True,
                   inter_chromosomal=True, intra_chromosomal=True, restore_coverage=False,
-                  sqrt=True):
+                  sqrt=True, chunk_size=None, threads=1):
     """
     Apply ICE balancing to Hi-C matrices.
 
     Iteratively calculates and divides by the matrix margins.
+    Marginals and rescaling are calculated in vectorised form. Unless
+    chunk_size is given, edges are loaded into memory once as contiguous
+    numpy arrays for this.
 
     :param hic: Hi-C object
     :param tolerance: Error tolerance (marginal error)
@@ -704,108 +1350,50 @@ def ice_balancing(hic, tolerance=1e-2, max_iterations=500, whole_matrix=True,
     :param restore_coverage: Restore the matrix to its original coverage after balancing,
                              i.e. the sum of contacts in the matrix after balancing remains
                              (roughly) the same
+    :param chunk_size: If provided, edges are not loaded into memory, but streamed
+                       from the edge tables in chunks of this many rows in every
+                       iteration. Much slower, but with memory usage bounded by
+                       the bias vector and a single chunk. Only supported for
+                       FAN-C matrices.
+    :param threads: Number of processes used to balance chromosomes in
+                    parallel (only if whole_matrix is False and no
+                    chunk_size is given)
     :return: bias vector
     """
     logger.info("Starting ICE matrix balancing")
 
-    if not whole_matrix:
-        bias_vectors = []
-        for chromosome in hic.chromosomes():
-            region_converter = dict()
-            bias_vector = []
-            n_regions = 0
-            for i, region in enumerate(hic.regions(chromosome)):
-                region_converter[region.ix] = i
-                bias_vector.append(1)
-                if region.valid:
-                    n_regions += 1
-            bias_vector = np.array(bias_vector, dtype='float64')
-
-            marginal_error = tolerance + 1
-            current_iteration = 0
-
-            total_weight = 0
-            edges = []
-            for e in hic.edges_dict((chromosome, chromosome), lazy=True, norm=False):
-                source, sink, weight = e['source'], e['sink'], e['weight']
-                edges.append([source, sink, weight])
-                total_weight += weight
-                if source != sink:
-                    total_weight += weight
-
-            while (marginal_error > tolerance and
-                   current_iteration < max_iterations):
-                m = np.zeros(len(bias_vector), dtype='float64')
-                for source, sink, weight in edges:
-                    source_sub = region_converter[source]
-                    sink_sub = region_converter[sink]
-                    m[source_sub] += weight
-                    if source != sink:
-                        m[sink_sub] += weight
-
-                marginal_error = _marginal_error(m)
-
-                if sqrt:
-                    m = np.sqrt(m)
-                else:
-                    # multiply with constant factor so marginals are 1
-                    bias_mean = np.mean(m[m != 0])
-                    marginal_mean = np.sqrt(np.sum(m) / n_regions)
-                    m = m * marginal_mean / bias_mean
-
-                bias_vector *= m
-
-                for i in range(len(edges)):
-                    source = region_converter[edges[i][0]]
-                    sink = region_converter[edges[i][1]]
-                    edges[i][2] = 0 if m[sink] == 0 else edges[i][2] / m[source] / m[sink]
-
-                current_iteration += 1
-                logger.debug("Iteration: %d, error: %lf" % (current_iteration, marginal_error))
-
-            if restore_coverage:
-                bias_vector = bias_vector / np.sqrt(total_weight / n_regions)
-
-            bias_vectors.append(bias_vector)
-        logger.info("Done.")
-        logger.info("Adding bias vector...")
-        bias_vector = np.concatenate(bias_vectors)
-
-        logger.info("Done.")
+    if chunk_size is not None:
+        bias_vector = _ice_balancing_chunked(hic, tolerance=tolerance, max_iterations=max_iterations,
+                                             whole_matrix=whole_matrix,
+                                             inter_chromosomal=inter_chromosomal,
+                                             intra_chromosomal=intra_chromosomal,
+                                             restore_coverage=restore_coverage,
+                                             sqrt=sqrt, chunk_size=chunk_size)
+    elif not whole_matrix:
+        bias_vector = _balance_chromosomes(hic, _ice_balance_chromosome, threads=threads,
+                                           tolerance=tolerance, max_iterations=max_iterations,
+                                           restore_coverage=restore_coverage, sqrt=sqrt)
     else:
         bias_vector = np.ones(len(hic.regions), float)
         marginal_error = tolerance + 1
         current_iteration = 0
         logger.info("Collecting edges")
 
-        total_weight = 0
-        edges = []
-        for e in hic.edges(norm=False, lazy=True,
-                           intra_chromosomal=intra_chromosomal,
-                           inter_chromosomal=inter_chromosomal):
-            source, sink, weight = e.source, e.sink, e.weight
-            edges.append([source, sink, weight])
-            total_weight += weight
-            if source != sink:
-                total_weight += weight
+        sources, sinks, weights = _edges_to_arrays(hic, intra_chromosomal=intra_chromosomal,
+                                                   inter_chromosomal=inter_chromosomal)
+        total_weight = np.sum(weights) + np.sum(weights[sources != sinks])
 
         logger.info("Starting iterations")
         while (marginal_error > tolerance and
                current_iteration < max_iterations):
-            m = np.zeros(len(bias_vector), dtype='float64')
-            for i in range(len(edges)):
-                source = edges[i][0]
-                sink = edges[i][1]
-                m[source] += edges[i][2]
-                if source != sink:
-                    m[sink] += edges[i][2]
+            m = _ice_marginals(sources, sinks, weights, len(bias_vector))
 
             bias_vector *= np.sqrt(m)
             marginal_error = _marginal_error(m)
-            for i in range(len(edges)):
-                source = edges[i][0]
-                sink = edges[i][1]
-                edges[i][2] = 0 if m[sink] == 0 else edges[i][2]/np.sqrt(m[source])/np.sqrt(m[sink])
+
+            m_sqrt = np.sqrt(m)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weights = np.where(m[sinks] == 0, 0, weights / m_sqrt[sources] / m_sqrt[sinks])
 
             current_iteration += 1
             logger.debug("Iteration: %d, error: %lf" % (current_iteration, marginal_error))
@@ -856,27 +1444,96 @@ def sqrt_vanilla_coverage_norm(*args, **kwargs):
     return ice_balancing(*args, **kwargs)
 
 
+def _edges_to_sparse_matrix(hic, n, key=None, offset=0, **kwargs):
+    """
+    Build a symmetric :mod:`scipy.sparse` CSR matrix directly from edge table chunks.
+
+    Each chunk of unnormalised upper-triangle edges returned by
+    :func:`~fanc.matrix.RegionMatrixContainer.edges_arrays` is mirrored
+    to the lower triangle right away, so the COO triplets are only
+    concatenated once before conversion to CSR.
+
+    :param hic: Hi-C object
+    :param n: Matrix dimension
+    :param key: Edge selector, see :func:`~fanc.matrix.RegionPairsContainer.edges`
+    :param offset: Subtracted from source and sink indices, e.g. the first
+                   bin of a chromosome
+    :param kwargs: Keyword arguments passed to
+                   :func:`~fanc.matrix.RegionMatrixContainer.edges_arrays`
+    :return: :class:`~scipy.sparse.csr_matrix` of shape (n, n)
+    """
+    rows, cols, values = [], [], []
+    for sources, sinks, weights in hic.edges_arrays(key, norm=False, **kwargs):
+        sources = sources - offset
+        sinks = sinks - offset
+        off_diagonal = sources != sinks
+        rows += [sources, sinks[off_diagonal]]
+        cols += [sinks, sources[off_diagonal]]
+        values += [weights, weights[off_diagonal]]
+
+    if len(values) == 0:
+        return sp.csr_matrix((n, n), dtype=np.float64)
+    return sp.csr_matrix((np.concatenate(values),
+                          (np.concatenate(rows), np.concatenate(cols))), shape=(n, n))
+
+
+def _kr_memory_estimate(m):
+    """
+    Rough estimate of the memory in bytes required for KR balancing of a sparse matrix.
+    """
+    # CSR data and indices, plus a copy when removing sparse rows
+    matrix_bytes = 2 * (m.nnz * (m.data.itemsize + m.indices.itemsize) +
+                        (m.shape[0] + 1) * m.indptr.itemsize)
+    # vectors used in get_bias_vector
+    vector_bytes = 15 * m.shape[0] * 8
+    return matrix_bytes + vector_bytes
+
+
+def _kr_balance_chromosome(hic, chromosome, restore_coverage=False):
+    """
+    Knight-Ruiz balancing of a single intra-chromosomal matrix.
+
+    :return: bias vector for the regions of this chromosome
+    """
+    offset, end = hic.chromosome_bins[chromosome]
+    m = _edges_to_sparse_matrix(hic, end - offset, (chromosome, chromosome), offset=offset)
+    logger.debug("Estimated memory usage for KR balancing of {}: {}B".format(
+        chromosome, human_format(_kr_memory_estimate(m))))
+    m_corrected, bias_vector = correct_matrix(m, restore_coverage=restore_coverage)
+    return bias_vector
+
+
 def kr_balancing(hic, whole_matrix=True, intra_chromosomal=True, inter_chromosomal=True,
-                 restore_coverage=False):
+                 restore_coverage=False, threads=1):
+    """
+    Apply Knight-Ruiz matrix balancing to Hi-C matrices.
+
+    The balancing operates on a :mod:`scipy.sparse` matrix assembled directly
+    from the matrix edges, so that even genome-wide matrices at high resolution
+    are never densified.
 
+    :param hic: Hi-C object
+    :param whole_matrix: Correct the whole matrix at once.
+                         Default is to correct each chromosome individually.
+    :param intra_chromosomal: Include intra-chromosomal contacts in balancing (only whole matrix)
+    :param inter_chromosomal: Include inter-chromosomal contacts in balancing (only whole matrix)
+    :param restore_coverage: Restore the matrix to its original coverage after balancing,
+                             i.e. the sum of contacts in the matrix after balancing remains
+                             (roughly) the same
+    :param threads: Number of processes used to balance chromosomes in
+                    parallel (only if whole_matrix is False)
+    :return: bias vector
+    """
     if not whole_matrix:
-        bias_vectors = []
-        for chromosome in hic.chromosomes():
-            m = hic.matrix((chromosome, chromosome), norm=False)
-            m_corrected, bias_vector_chromosome = correct_matrix(m, restore_coverage=restore_coverage)
-            bias_vectors.append(bias_vector_chromosome)
-        bias_vector = np.concatenate(bias_vectors)
+        bias_vector = _balance_chromosomes(hic, _kr_balance_chromosome, threads=threads,
+                                           restore_coverage=restore_coverage)
     else:
         logger.debug("Fetching whole genome matrix")
-        m = hic.matrix(norm=False)
-        cb = hic.chromosome_bins
-        if not intra_chromosomal:
-            for chromosome, bins in cb.items():
-                m[bins[0]:bins[1], bins[0]:bins[1]] = 0
-        if not inter_chromosomal:
-            for chromosome, bins in cb:
-                m[0:bins[0], bins[0]:bins[1]] = 0
-                m[bins[1]:, bins[0]:bins[1]] = 0
+        m = _edges_to_sparse_matrix(hic, len(hic.regions), intra_chromosomal=intra_chromosomal,
+                                    inter_chromosomal=inter_chromosomal)
+        logger.info("Estimated memory usage for KR balancing of {0}x{0} matrix "
+                    "with {1} non-zero entries: {2}B".format(m.shape[0], m.nnz,
+                                                            human_format(_kr_memory_estimate(m))))
 
         m_corrected, bias_vector = correct_matrix(m, restore_coverage=restore_coverage)
 
@@ -885,6 +1542,18 @@ def kr_balancing(hic, whole_matrix=True, intra_chromosomal=True, inter_chromosom
 
 
 def correct_matrix(m, max_attempts=50, restore_coverage=False):
+    """
+    Balance a symmetric matrix using the Knight-Ruiz algorithm.
+
+    If balancing fails, the sparsest rows are removed and balancing is attempted
+    again, up to :code:`max_attempts` times.
+
+    :param m: Symmetric numpy array or :mod:`scipy.sparse` matrix
+    :param max_attempts: Maximum number of sparse row removals
+    :param restore_coverage: Scale the bias vector so that the total number
+                             of contacts in the matrix remains (roughly) the same
+    :return: corrected matrix (same type as input), bias vector
+    """
     # remove zero-sum rows
     removed_rows = []
     m_nonzero, ixs = remove_sparse_rows(m, cutoff=0)
@@ -914,7 +1583,10 @@ def correct_matrix(m, max_attempts=50, restore_coverage=False):
         x = x*np.sqrt(np.sum(m_nonzero)/m_nonzero.shape[0])
 
     logger.debug("Applying bias vector")
-    m_nonzero = x*m_nonzero*x[:, np.newaxis]
+    if sp.issparse(m_nonzero):
+        m_nonzero = sp.diags(x).dot(m_nonzero).dot(sp.diags(x)).tocsr()
+    else:
+        m_nonzero = x*m_nonzero*x[:, np.newaxis]
 
     logger.debug(removed_rows)
     logger.debug("Restoring {} sets ({} total) sparse rows.".format(
@@ -935,7 +1607,13 @@ def get_bias_vector(A, x0=None, tol=1e-06, delta=0.1, Delta=3, fl=0, high_precis
         try:
             # basic variables
             # n=size_(A,1)
-            if not isinstance(A, np.ndarray):
+            if sp.issparse(A):
+                if high_precision:
+                    try:
+                        A = A.astype(np.float128)
+                    except AttributeError:
+                        pass
+            elif not isinstance(A, np.ndarray):
                 try:
                     if high_precision:
                         A = np.array(A, dtype=np.float128)
@@ -1018,17 +1696,17 @@ def get_bias_vector(A, x0=None, tol=1e-06, delta=0.1, Delta=3, fl=0, high_precis
                     alpha = rho_km1 / p.T.dot(w)
                     ap = alpha * p
                     ynew = y + ap
-                    if min(ynew) <= delta:
+                    if np.min(ynew) <= delta:
                         if delta == 0:
                             break
                         ind = np.where(ap < 0)[0]
                         # gamma = min((delta  - y(ind))./ap(ind));
-                        gamma = min((delta-y[ind])/ap[ind])
+                        gamma = np.min((delta-y[ind])/ap[ind])
                         y = y + gamma * ap
                         break
-                    if max(ynew) >= Delta:
+                    if np.max(ynew) >= Delta:
                         ind = np.where(ynew > Delta)[0]
-                        gamma = min((Delta-y[ind])/ap[ind])
+                        gamma = np.min((Delta-y[ind])/ap[ind])
                         y = y + gamma * ap
                         break
                     y = ynew.copy()
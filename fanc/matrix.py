@@ -12,6 +12,7 @@ from collections import defaultdict
 
 import intervaltree
 import numpy as np
+import scipy.sparse as sp
 import tables
 from future.utils import string_types
 
@@ -19,6 +20,7 @@ from genomic_regions import RegionBased, GenomicRegion
 from .config import config
 from .general import Maskable, MaskedTable
 from .regions import LazyGenomicRegion, RegionsTable, RegionBasedWithBins
+from .tools.files import hdf5_reader_pool, hdf5_file_exists, hdf5_file_uri
 from .tools.general import RareUpdateProgressBar, create_col_index, range_overlap, str_to_int
 from .tools.load import load
 import datetime
@@ -380,6 +382,33 @@ class RegionPairsContainer(RegionBased):
         raise NotImplementedError("Subclass must implement _edges_subset "
                                   "to enable iterating over edge subsets!")
 
+    def _valid_vector(self):
+        """
+        Boolean vector with the "valid" status of every region.
+        """
+        return np.array([getattr(r, 'valid', True) for r in self.regions(lazy=True)], dtype=bool)
+
+    def _edge_subset_arrays(self, row_regions, col_regions, fields, excluded_filters=0):
+        raise NotImplementedError("Subclass must implement _edge_subset_arrays "
+                                  "to enable vectorised access to edge subsets!")
+
+    def _edge_subset_array_chunks(self, row_regions, col_regions, fields, excluded_filters=0,
+                                  chunk_size=1000000):
+        """
+        Iterate over the output of :func:`~RegionPairsContainer._edge_subset_arrays`
+        in chunks of at most chunk_size edges.
+
+        Subclasses that can read edges in blocks should override this to avoid
+        loading the whole subset into memory.
+
+        :return: iterator over lists of numpy arrays, one for each field
+        """
+        arrays = self._edge_subset_arrays(row_regions, col_regions, fields,
+                                          excluded_filters=excluded_filters)
+        n_edges = len(arrays[0]) if len(arrays) > 0 else 0
+        for start in range(0, n_edges, chunk_size):
+            yield [a[start:start + chunk_size] for a in arrays]
+
     def _edges_length(self):
         return sum(1 for _ in self.edges)
 
@@ -705,7 +734,7 @@ class RegionPairsContainer(RegionBased):
                 else:
                     expected_genome, expected_intra, expected_inter = None, None, None
 
-                valid = [getattr(r, 'valid', True) for r in self._regions_pairs.regions(lazy=True)]
+                valid = self._regions_pairs._valid_vector()
 
                 # getting regions
                 row_regions, col_regions = self._regions_pairs._key_to_regions(key)
@@ -848,6 +877,154 @@ class RegionPairsContainer(RegionBased):
         for edge in self.edges(*args, **kwargs):
             yield getattr(edge, attribute)
 
+    def edges_arrays(self, key=None, norm=True, oe=False, chunk_size=1000000,
+                     intra_chromosomal=True, inter_chromosomal=True, check_valid=True,
+                     oe_per_chromosome=True, excluded_filters=0, score_field=None):
+        """
+        Iterate over edges as chunks of numpy arrays.
+
+        This is the vectorised counterpart of :func:`~RegionPairsContainer.edges`.
+        Rather than one :class:`~Edge` at a time, it yields
+        (source, sink, weight) tuples of numpy arrays with up to
+        chunk_size edges each. Bias and O/E transformations are already
+        applied to the weights, so the arrays can be used directly for
+        array-based analyses:
+
+        .. code ::
+
+            marginals = np.zeros(len(hic.regions))
+            for sources, sinks, weights in hic.edges_arrays('chr18'):
+                marginals += np.bincount(sources, weights=weights, minlength=len(marginals))
+                marginals += np.bincount(sinks, weights=weights, minlength=len(marginals))
+
+        Like :func:`~RegionPairsContainer.edges`, only edges in the upper
+        triangle of the matrix are returned (source <= sink), and edges
+        involving invalid regions are omitted by default.
+
+        :param key: Edge selector. See :func:`~fanc.matrix.RegionPairsContainer.edges`
+                    for all supported key types
+        :param norm: If False, will return unnormalised weights
+        :param oe: If True, will divide observed values by their expected value
+                   at the given distance
+        :param chunk_size: Maximum number of edges per chunk
+        :param intra_chromosomal: If False, omit intra-chromosomal edges
+        :param inter_chromosomal: If False, omit inter-chromosomal edges
+        :param check_valid: If False, also return edges involving invalid regions
+        :param oe_per_chromosome: If True (default), use chromosome-specific
+                                  expected values for O/E transformation
+        :param excluded_filters: Binary mask or list of names of filters
+                                 that should be ignored
+        :param score_field: Edge field returned as weight. Only the 'weight'
+                            field is normalised. Default: the default score
+                            field of this object
+        :return: iterator over (source, sink, weight) tuples of numpy arrays
+        """
+        row_regions, col_regions = self._key_to_regions(key)
+        if isinstance(row_regions, GenomicRegion):
+            row_regions = [row_regions]
+        else:
+            row_regions = list(row_regions)
+
+        if isinstance(col_regions, GenomicRegion):
+            col_regions = [col_regions]
+        else:
+            col_regions = list(col_regions)
+
+        for arrays in self._edges_arrays_from_regions(row_regions, col_regions, norm=norm, oe=oe,
+                                                      chunk_size=chunk_size,
+                                                      intra_chromosomal=intra_chromosomal,
+                                                      inter_chromosomal=inter_chromosomal,
+                                                      check_valid=check_valid,
+                                                      oe_per_chromosome=oe_per_chromosome,
+                                                      excluded_filters=excluded_filters,
+                                                      score_field=score_field):
+            yield arrays
+
+    def _edges_arrays_from_regions(self, row_regions, col_regions, norm=True, oe=False,
+                                   chunk_size=1000000, intra_chromosomal=True,
+                                   inter_chromosomal=True, check_valid=True,
+                                   oe_per_chromosome=True, excluded_filters=0,
+                                   score_field=None):
+        if score_field is None:
+            score_field = self._default_score_field or 'weight'
+
+        if len(row_regions) == 0 or len(col_regions) == 0:
+            return
+
+        if norm and hasattr(self, 'bias_vector'):
+            bias = np.asarray(self.bias_vector(), dtype=np.float64)
+        else:
+            bias = None
+
+        if oe:
+            if not hasattr(self, 'expected_values'):
+                raise ValueError("Cannot perform O/E transformation because this object does not "
+                                 "support the expected_values function!")
+            expected_genome, expected_intra, expected_inter = self.expected_values(norm=norm)
+        else:
+            expected_genome, expected_intra, expected_inter = None, None, None
+
+        if check_valid:
+            valid = self._valid_vector()
+        else:
+            valid = None
+
+        row_regions_by_chromosome = defaultdict(list)
+        for r in row_regions:
+            row_regions_by_chromosome[r.chromosome].append(r)
+
+        col_regions_by_chromosome = defaultdict(list)
+        for r in col_regions:
+            col_regions_by_chromosome[r.chromosome].append(r)
+
+        chromosome_pairs = set()
+        for row_chromosome, row_chromosome_regions in row_regions_by_chromosome.items():
+            for col_chromosome, col_chromosome_regions in col_regions_by_chromosome.items():
+                if (col_chromosome, row_chromosome) in chromosome_pairs:
+                    continue
+                chromosome_pairs.add((row_chromosome, col_chromosome))
+
+                if row_chromosome == col_chromosome:
+                    if not intra_chromosomal:
+                        continue
+                    if oe:
+                        expected = np.asarray(expected_intra[row_chromosome]
+                                              if oe_per_chromosome else expected_genome)
+                    else:
+                        expected = None
+                elif not inter_chromosomal:
+                    continue
+                else:
+                    expected = expected_inter
+
+                for sources, sinks, weights in self._edge_subset_array_chunks(
+                        row_chromosome_regions, col_chromosome_regions,
+                        ['source', 'sink', score_field],
+                        excluded_filters=excluded_filters, chunk_size=chunk_size):
+                    sources = sources.astype(np.int64)
+                    sinks = sinks.astype(np.int64)
+                    weights = weights.astype(np.float64)
+
+                    if valid is not None:
+                        is_valid = np.logical_and(valid[sources], valid[sinks])
+                        sources, sinks, weights = sources[is_valid], sinks[is_valid], weights[is_valid]
+
+                    # like LazyEdge, only the weight field is normalised
+                    if score_field == 'weight':
+                        if bias is not None:
+                            weights = weights * bias[sources] * bias[sinks]
+
+                        if expected is not None:
+                            if isinstance(expected, np.ndarray):
+                                e = expected[np.abs(sinks - sources)]
+                            else:
+                                e = expected
+                            with np.errstate(divide='ignore', invalid='ignore'):
+                                weights = weights / e
+
+                    if len(sources) > 0:
+                        yield sources, sinks, weights
+
     def regions_and_edges(self, key, *args, **kwargs):
         """
         Convenient access to regions and edges selected by key.
@@ -886,6 +1063,42 @@ class RegionPairsContainer(RegionBased):
                          for r in self.regions(region, lazy=True)])
 
 
+def _expected_value_chunk_sums(chunks, region_chromosomes, n_chromosomes, max_distance, default_value):
+    """
+    Sum up edge weights by region, intra-chromosomal distance and for
+    inter-chromosomal region pairs.
+
+    :param chunks: iterator over (source, sink, weight) numpy arrays
+    :param region_chromosomes: Chromosome index of every region
+    :param n_chromosomes: Number of chromosomes
+    :param max_distance: Number of regions in the largest chromosome
+    :param default_value: Weights with this value do not mark regions as valid
+    :return: marginals, valid, intra-chromosomal sums as (n_chromosomes, max_distance) array,
+             inter-chromosomal sum
+    """
+    n_regions = len(region_chromosomes)
+    marginals = np.zeros(n_regions)
+    valid = np.zeros(n_regions, dtype=bool)
+    intra_sums = np.zeros(n_chromosomes * max_distance)
+    inter_sums = 0.0
+    for sources, sinks, weights in chunks:
+        marginals += np.bincount(sources, weights=weights, minlength=n_regions)
+        marginals += np.bincount(sinks, weights=weights, minlength=n_regions)
+
+        has_weight = weights != default_value
+        valid[sources[has_weight]] = True
+        valid[sinks[has_weight]] = True
+
+        source_chromosomes = region_chromosomes[sources]
+        intra = source_chromosomes == region_chromosomes[sinks]
+        inter_sums += weights[~intra].sum()
+
+        ix = source_chromosomes[intra] * max_distance + (sinks[intra] - sources[intra])
+        intra_sums += np.bincount(ix, weights=weights[intra], minlength=len(intra_sums))
+
+    return marginals, valid, intra_sums.reshape((n_chromosomes, max_distance)), inter_sums
+
+
 class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
     """
     Class representing matrices where pixels correspond to genomic region pairs.
@@ -986,6 +1199,89 @@ class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
 
         return row_regions, col_regions, entry_iter
 
+    def _regions_and_matrix_arrays(self, key=None, score_field=None, norm=True,
+                                   intra_chromosomal=True, inter_chromosomal=True,
+                                   check_valid=True, oe=False, oe_per_chromosome=True,
+                                   excluded_filters=0, lazy=True, *args, **kwargs):
+        """
+        Vectorised equivalent of :func:`~RegionMatrixContainer.regions_and_matrix_entries`.
+
+        Edges are obtained as numpy arrays from
+        :func:`~RegionPairsContainer.edges_arrays`, and bias and O/E
+        transformations are applied to whole arrays rather than to each edge.
+
+        Raises :class:`NotImplementedError` if the object does not support
+        vectorised edge access, or if edge selection requires arguments
+        that are only supported by :func:`~RegionPairsContainer.edges`.
+
+        :return: list of row regions, list of col regions, and numpy arrays
+                 of row indices, col indices, and weights of matrix entries
+        """
+        if len(args) > 0 or len(kwargs) > 0:
+            raise NotImplementedError("Vectorised matrix assembly does not support "
+                                      "additional edge arguments")
+
+        if score_field is None:
+            score_field = self._default_score_field
+
+        if score_field not in getattr(self, 'field_names', []):
+            raise NotImplementedError("Vectorised matrix assembly requires an edge "
+                                      "field as score field")
+
+        row_regions, col_regions = self._key_to_regions(key)
+        if isinstance(row_regions, GenomicRegion):
+            row_regions = [row_regions]
+        else:
+            row_regions = list(row_regions)
+
+        if isinstance(col_regions, GenomicRegion):
+            col_regions = [col_regions]
+        else:
+            col_regions = list(col_regions)
+
+        empty = np.array([], dtype=np.int64)
+        all_sources, all_sinks, all_weights = [], [], []
+        for sources, sinks, weights in self._edges_arrays_from_regions(
+                row_regions, col_regions, norm=norm, oe=oe,
+                intra_chromosomal=intra_chromosomal,
+                inter_chromosomal=inter_chromosomal,
+                check_valid=check_valid,
+                oe_per_chromosome=oe_per_chromosome,
+                excluded_filters=excluded_filters,
+                score_field=score_field):
+            all_sources.append(sources)
+            all_sinks.append(sinks)
+            all_weights.append(weights)
+
+        if len(all_sources) == 0:
+            return row_regions, col_regions, empty, empty, np.array([], dtype=float)
+
+        sources = np.concatenate(all_sources)
+        sinks = np.concatenate(all_sinks)
+        weights = np.concatenate(all_weights)
+
+        row_offset = row_regions[0].ix
+        col_offset = col_regions[0].ix
+
+        # upper triangle entries
+        i = sources - row_offset
+        j = sinks - col_offset
+        direct = np.logical_and(np.logical_and(i >= 0, i < len(row_regions)),
+                                np.logical_and(j >= 0, j < len(col_regions)))
+
+        # mirrored lower triangle entries
+        k = sinks - row_offset
+        l = sources - col_offset
+        mirror = np.logical_and(np.logical_and(k >= 0, k < len(row_regions)),
+                                np.logical_and(l >= 0, l < len(col_regions)))
+        mirror = np.logical_and(mirror, np.logical_or(i != k, j != l))
+
+        ixs = np.concatenate([i[direct], k[mirror]])
+        jxs = np.concatenate([j[direct], l[mirror]])
+        weights = np.concatenate([weights[direct], weights[mirror]])
+
+        return row_regions, col_regions, ixs, jxs, weights
+
     def matrix(self, key=None,
                log=False,
                default_value=None, mask=True, log_base=2,
@@ -1015,17 +1311,24 @@ class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
             default_value = 1.0
 
         kwargs['lazy'] = True
-        row_regions, col_regions, matrix_entries = self.regions_and_matrix_entries(key,
-                                                                                   *args,
-                                                                                   **kwargs)
-
-        m = np.full((len(row_regions), len(col_regions)), default_value)
-
-        for source, sink, weight in matrix_entries:
-            ir = source
-            jr = sink
-            if 0 <= ir < m.shape[0] and 0 <= jr < m.shape[1]:
-                m[ir, jr] = weight
+        try:
+            row_regions, col_regions, ixs, jxs, weights = self._regions_and_matrix_arrays(key,
+                                                                                      *args,
+                                                                                      **kwargs)
+            m = np.full((len(row_regions), len(col_regions)), default_value)
+            m[ixs, jxs] = weights
+        except NotImplementedError:
+            row_regions, col_regions, matrix_entries = self.regions_and_matrix_entries(key,
+                                                                                       *args,
+                                                                                       **kwargs)
+
+            m = np.full((len(row_regions), len(col_regions)), default_value)
+
+            for source, sink, weight in matrix_entries:
+                ir = source
+                jr = sink
+                if 0 <= ir < m.shape[0] and 0 <= jr < m.shape[1]:
+                    m[ir, jr] = weight
 
         if log:
             m = np.log(m) / np.log(log_base)
@@ -1041,6 +1344,63 @@ class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
 
         return RegionMatrix(m, row_regions=row_regions, col_regions=col_regions, mask=mask)
 
+    def sparse_matrix(self, key=None, norm=True, oe=False, format='csr', *args, **kwargs):
+        """
+        Assemble a :mod:`scipy.sparse` matrix from region pairs.
+
+        Unlike :func:`~RegionMatrixContainer.matrix`, this never allocates
+        a dense array, so that even whole-chromosome matrices at high
+        resolution fit into memory. Matrix entries without an associated
+        edge/contact are not stored, i.e. they are 0 even in O/E matrices.
+
+        .. code ::
+
+            m, row_regions, col_regions = hic.sparse_matrix(('chr18', 'chr18'))
+            m.shape  # 79, 79
+
+        :param key: Matrix selector. See :func:`~fanc.matrix.RegionPairsContainer.edges`
+                    for all supported key types
+        :param norm: If False, will return the unnormalised matrix
+        :param oe: If True, will divide observed values by their expected value
+                   at the given distance
+        :param format: Sparse matrix format, either 'csr' (default) or 'coo'
+        :param args: Positional arguments passed to
+                     :func:`~fanc.matrix.RegionMatrixContainer.regions_and_matrix_entries`
+        :param kwargs: Keyword arguments passed to
+                       :func:`~fanc.matrix.RegionMatrixContainer.regions_and_matrix_entries`
+        :return: :class:`~scipy.sparse.csr_matrix` or :class:`~scipy.sparse.coo_matrix`,
+                 list of row regions, list of col regions
+        """
+        if format not in ('csr', 'coo'):
+            raise ValueError("Sparse matrix format must be 'csr' or 'coo', not {}".format(format))
+
+        kwargs['norm'] = norm
+        kwargs['oe'] = oe
+        kwargs['lazy'] = True
+        try:
+            row_regions, col_regions, ixs, jxs, weights = self._regions_and_matrix_arrays(key,
+                                                                                      *args,
+                                                                                      **kwargs)
+        except NotImplementedError:
+            row_regions, col_regions, matrix_entries = self.regions_and_matrix_entries(key,
+                                                                                       *args,
+                                                                                       **kwargs)
+            ixs, jxs, weights = [], [], []
+            for i, j, weight in matrix_entries:
+                if 0 <= i < len(row_regions) and 0 <= j < len(col_regions):
+                    ixs.append(i)
+                    jxs.append(j)
+                    weights.append(weight)
+            ixs = np.array(ixs, dtype=np.int64)
+            jxs = np.array(jxs, dtype=np.int64)
+            weights = np.array(weights, dtype=float)
+
+        m = sp.coo_matrix((weights, (ixs, jxs)), shape=(len(row_regions), len(col_regions)))
+        if format == 'csr':
+            m = m.tocsr()
+
+        return m, row_regions, col_regions
+
     def __getitem__(self, item):
         return self.matrix(item)
 
@@ -1062,64 +1422,48 @@ class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
                  possible inter-chromosomal pairs
         """
         logger.debug("Calculating possible counts")
-        regions = list(self.regions)
         chromosomes = self.chromosomes()
-
         cb = self.chromosome_bins
-        chromosome_max_distance = defaultdict(int)
-        max_distance = 0
-        chromosome_subtractions = dict()
-        for chromosome in chromosomes:
-            start, stop = cb[chromosome]
-            max_distance = max(max_distance, stop - start)
-            chromosome_max_distance[chromosome] = max(chromosome_max_distance[chromosome], stop - start)
-            chromosome_subtractions[chromosome] = np.zeros(stop - start,
-                                                           dtype='int32')
-
-        chromosome_mappable = defaultdict(int)
-        chromosome_unmappable = defaultdict(set)
-        for i, mappable in enumerate(self.mappable()):
-            chromosome = regions[i].chromosome
-            if not mappable:  # unmappable
-                s = chromosome_subtractions[chromosome]
-                o = cb[chromosome][0]
-                ix = i - o
-                # horizontal
-                s[0: len(s) - ix] += 1
-                # vertical
-                for j in range(1, ix + 1):
-                    if ix - j not in chromosome_unmappable[chromosome]:
-                        s[j] += 1
-                chromosome_unmappable[chromosome].add(ix)
-            else:
-                chromosome_mappable[chromosome] += 1
+        mappable = np.asarray(self.mappable(), dtype=bool)
 
-        inter_total = 0
-        intra_total = [0] * max_distance
+        max_distance = max([stop - start for start, stop in cb.values()] + [0])
+        intra_total = np.zeros(max_distance, dtype=np.int64)
         chromosome_intra_total = dict()
-        for chromosome, d in chromosome_max_distance.items():
-            chromosome_intra_total[chromosome] = [0] * d
-
-        for i, chromosome in enumerate(chromosomes):
+        chromosome_mappable = dict()
+        for chromosome in chromosomes:
             start, stop = cb[chromosome]
             count = stop - start
+            unmappable = ~mappable[start:stop]
+            distances = np.arange(count)
+
+            # all region pairs at each distance, minus the pairs
+            # where the left or the right region is unmappable ...
+            possible = count - distances
+            unmappable_cumsum = np.concatenate([[0], np.cumsum(unmappable)])
+            possible -= unmappable_cumsum[count - distances]
+            possible -= unmappable_cumsum[-1] - unmappable_cumsum[distances]
+
+            # ... plus the pairs where both are unmappable, which
+            # have been subtracted twice
+            if np.any(unmappable):
+                n_fft = 2 * count
+                f = np.fft.rfft(unmappable.astype(np.float64), n_fft)
+                both = np.fft.irfft(f * np.conj(f), n_fft)[:count]
+                possible += np.rint(both).astype(np.int64)
+
+            intra_total[:count] += possible
+            chromosome_intra_total[chromosome] = possible.tolist()
+            chromosome_mappable[chromosome] = count - int(unmappable_cumsum[-1])
 
-            # intra-chromosomal
-            s = chromosome_subtractions[chromosomes[i]]
-            for distance in range(0, count):
-                intra_total[distance] += count - distance - s[distance]
-                chromosome_intra_total[chromosome][distance] += count - distance - s[distance]
-
-            # inter-chromosomal
+        inter_total = 0
+        for i in range(len(chromosomes)):
             for j in range(i + 1, len(chromosomes)):
-                count_mappable = chromosome_mappable[chromosomes[i]]
-                count2_mappable = chromosome_mappable[chromosomes[j]]
-                inter_total += count_mappable * count2_mappable
+                inter_total += chromosome_mappable[chromosomes[i]] * chromosome_mappable[chromosomes[j]]
 
-        return intra_total, chromosome_intra_total, inter_total
+        return intra_total.tolist(), chromosome_intra_total, inter_total
 
     def expected_values_and_marginals(self, selected_chromosome=None, norm=True,
-                                      *args, **kwargs):
+                                      threads=1, *args, **kwargs):
         """
         Calculate the expected values for genomic contacts at all distances
         and the whole matrix marginals.
@@ -1140,12 +1484,126 @@ class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
                                     chromosome.
         :param norm: If False, will calculate the expected values on the
                      unnormalised matrix.
+        :param threads: Number of processes used to sum up edge weights.
+                        Only file-based matrices support more than one process.
         :param args: Not used in this context
         :param kwargs: Not used in this context
         :return: list of intra-chromosomal expected values,
                  dict of intra-chromosomal expected values by chromosome,
                  inter-chromosomal expected value
         """
+        # get the sums of edges at any given distance
+        try:
+            marginals, valid, intra_sums, chromosome_intra_sums, inter_sums = \
+                self._expected_value_sums_arrays(norm=norm, threads=threads)
+        except NotImplementedError:
+            marginals, valid, intra_sums, chromosome_intra_sums, inter_sums = \
+                self._expected_value_sums_edges(norm=norm)
+
+        intra_total, chromosome_intra_total, inter_total = self.possible_contacts()
+
+        # expected values
+        inter_expected = 0 if inter_total == 0 else inter_sums / inter_total
+
+        def _divide(sums, counts):
+            sums = np.asarray(sums, dtype=np.float64)
+            counts = np.asarray(counts, dtype=np.float64)
+            expected = np.zeros(len(sums))
+            has_counts = counts > 0
+            expected[has_counts] = sums[has_counts] / counts[has_counts]
+            return expected.tolist()
+
+        intra_expected = _divide(intra_sums, intra_total)
+        chromosome_intra_expected = dict()
+        for chromosome, sums in chromosome_intra_sums.items():
+            chromosome_intra_expected[chromosome] = _divide(sums, chromosome_intra_total[chromosome])
+
+        if selected_chromosome is not None:
+            return chromosome_intra_expected[selected_chromosome], marginals, valid
+
+        return intra_expected, chromosome_intra_expected, inter_expected, marginals, valid
+
+    def _expected_value_sums_arrays(self, norm=True, threads=1, chunk_size=1000000):
+        """
+        Sums of edge weights by distance and region, calculated on
+        chunks of edges obtained from :func:`~RegionPairsContainer.edges_arrays`.
+
+        Raises :class:`NotImplementedError` if the object does not
+        support vectorised edge access.
+
+        :param norm: If False, sum unnormalised edge weights
+        :param threads: Number of processes used by subclasses that
+                        support parallel computation. Ignored here.
+        :param chunk_size: Maximum number of edges processed at once
+        :return: list of marginals, list of region valid status,
+                 list of intra-chromosomal sums by distance,
+                 dict of intra-chromosomal sums by distance for each chromosome,
+                 inter-chromosomal sum
+        """
+        weight_field = getattr(self, '_default_score_field', None)
+        default_value = getattr(self, '_default_value', 1.)
+
+        if weight_field not in getattr(self, 'field_names', []):
+            raise NotImplementedError("Vectorised expected values require an edge "
+                                      "field as score field")
+
+        region_chromosomes, chromosome_lengths = self._region_chromosome_vector()
+
+        n_edges = len(self.edges)
+        with RareUpdateProgressBar(max_value=max(1, n_edges), prefix='Expected') as pb:
+            def chunks():
+                n_processed = 0
+                for sources, sinks, weights in self.edges_arrays(norm=norm, check_valid=False,
+                                                                 score_field=weight_field,
+                                                                 chunk_size=chunk_size):
+                    yield sources, sinks, weights
+                    n_processed += len(sources)
+                    pb.update(min(n_processed, n_edges))
+
+            sums = _expected_value_chunk_sums(chunks(), region_chromosomes,
+                                              len(chromosome_lengths), max(chromosome_lengths + [0]),
+                                              default_value)
+
+        return self._expected_value_sums_by_chromosome(*sums)
+
+    def _region_chromosome_vector(self):
+        """
+        Chromosome index of every region and number of regions per chromosome.
+
+        :return: numpy array with the index in :func:`~RegionBased.chromosomes`
+                 for every region, list of chromosome lengths in regions
+        """
+        chromosome_bins = self.chromosome_bins
+        region_chromosomes = np.zeros(len(self.regions), dtype=np.int64)
+        chromosome_lengths = []
+        for i, chromosome in enumerate(self.chromosomes()):
+            start, stop = chromosome_bins[chromosome]
+            region_chromosomes[start:stop] = i
+            chromosome_lengths.append(stop - start)
+        return region_chromosomes, chromosome_lengths
+
+    def _expected_value_sums_by_chromosome(self, marginals, valid, chromosome_intra_sums, inter_sums):
+        """
+        Convert the output of :func:`~_expected_value_chunk_sums` to
+        the return format of :func:`~RegionMatrixContainer._expected_value_sums_edges`.
+        """
+        _, chromosome_lengths = self._region_chromosome_vector()
+        intra_sums = chromosome_intra_sums.sum(axis=0)
+        chromosome_intra_sums = {chromosome: chromosome_intra_sums[i, :chromosome_lengths[i]].tolist()
+                                 for i, chromosome in enumerate(self.chromosomes())}
+
+        return marginals.tolist(), valid.tolist(), intra_sums.tolist(), chromosome_intra_sums, float(inter_sums)
+
+    def _expected_value_sums_edges(self, norm=True):
+        """
+        Sums of edge weights by distance and region, calculated
+        by iterating over edges.
+
+        :return: list of marginals, list of region valid status,
+                 list of intra-chromosomal sums by distance,
+                 dict of intra-chromosomal sums by distance for each chromosome,
+                 inter-chromosomal sum
+        """
         weight_field = getattr(self, '_default_score_field', None)
         default_value = getattr(self, '_default_value', 1.)
 
@@ -1163,12 +1621,9 @@ class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
                 chromosome_dict[i] = chromosome
 
         chromosome_intra_sums = dict()
-        chromosome_intra_expected = dict()
         for chromosome, d in chromosome_max_distance.items():
             chromosome_intra_sums[chromosome] = [0.0] * d
-            chromosome_intra_expected[chromosome] = [0.0] * d
 
-        # get the sums of edges at any given distance
         marginals = [0.0] * len(self.regions)
         valid = [False] * len(self.regions)
         inter_sums = 0.0
@@ -1198,34 +1653,7 @@ class RegionMatrixContainer(RegionPairsContainer, RegionBasedWithBins):
                     chromosome_intra_sums[source_chromosome][distance] += weight
                 pb.update(i)
 
-        intra_total, chromosome_intra_total, inter_total = self.possible_contacts()
-
-        # expected values
-        inter_expected = 0 if inter_total == 0 else inter_sums / inter_total
-
-        intra_expected = [0.0] * max_distance
-        bin_size = self.bin_size
-        distances = []
-        for d in range(max_distance):
-            distances.append(bin_size * d)
-
-            # whole genome
-            count = intra_total[d]
-            if count > 0:
-                intra_expected[d] = intra_sums[d] / count
-
-        # chromosomes
-        for chromosome in chromosome_intra_expected:
-            for d in range(chromosome_max_distance[chromosome]):
-                chromosome_count = chromosome_intra_total[chromosome][d]
-                if chromosome_count > 0:
-                    chromosome_intra_expected[chromosome][d] = chromosome_intra_sums[chromosome][
-                                                                   d] / chromosome_count
-
-        if selected_chromosome is not None:
-            return chromosome_intra_expected[selected_chromosome], marginals, valid
-
-        return intra_expected, chromosome_intra_expected, inter_expected, marginals, valid
+        return marginals, valid, intra_sums, chromosome_intra_sums, inter_sums
 
     def expected_values(self, selected_chromosome=None, norm=True, *args, **kwargs):
         """
@@ -1535,11 +1963,9 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
         self._partition_strategy = partition_strategy
         self._edge_table_prefix = _edge_table_prefix
 
-        file_exists = False
-        if file_name is not None:
+        file_exists = hdf5_file_exists(file_name)
+        if isinstance(file_name, string_types):
             file_name = os.path.expanduser(file_name)
-            if os.path.exists(file_name):
-                file_exists = True
 
         # initialise inherited objects
         RegionPairsContainer.__init__(self)
@@ -1650,6 +2076,31 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
                 except ValueError:
                     pass
 
+    def _iter_edge_table_chunks(self, chunk_size=1000000, partitions=None, excluded_filters=0):
+        """
+        Iterate over edge tables in blocks of rows.
+
+        Each block is read with a single :func:`~tables.Table.read` call
+        and returned as numpy structured array, from which masked rows
+        have been removed. Only one block is held in memory at a time.
+
+        :param chunk_size: Maximum number of table rows read per block
+        :param partitions: Optional collection of (source_partition, sink_partition)
+                           tuples. If provided, only these edge tables are read.
+        :param excluded_filters: Binary mask of filters that should be ignored,
+                                 i.e. rows masked only by these filters are returned
+        :return: iterator over ((source_partition, sink_partition), structured array) tuples
+        """
+        for partition, edge_table in self._iter_edge_tables():
+            if partitions is not None and partition not in partitions:
+                continue
+
+            n_rows = edge_table._original_len()
+            for start in range(0, n_rows, chunk_size):
+                yield partition, edge_table.read_visible(start, min(start + chunk_size, n_rows),
+                                                         excluded_filters=excluded_filters,
+                                                         maskable=self)
+
     def _flush_regions(self):
         if self._regions_dirty:
             RegionsTable._flush_regions(self)
@@ -1821,6 +2272,46 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
             self._enable_edge_indexes()
             self._flush_edges()
 
+    def _add_edge_arrays(self, edge_arrays):
+        """
+        Append edges given as column arrays in bulk.
+
+        Edges are split by partition and appended to the edge tables
+        directly, bypassing the edge buffer. Indexes are updated on the
+        next :func:`~RegionPairsTable.flush`.
+
+        :param edge_arrays: dict of edge field name -> array. Must contain
+                            'source' and 'sink' (with source <= sink), all
+                            other fields default to their column default
+        """
+        self._flush_regions()
+        self._edge_buffer.flush()
+        if not self._edges_dirty:
+            self._edges_dirty = True
+            self._disable_edge_indexes()
+
+        sources = np.asarray(edge_arrays['source'])
+        sinks = np.asarray(edge_arrays['sink'])
+        breaks = self._partition_breaks
+        source_partitions = np.searchsorted(breaks, sources, side='right')
+        sink_partitions = np.searchsorted(breaks, sinks, side='right')
+
+        for partition in sorted(set(zip(source_partitions.tolist(), sink_partitions.tolist()))):
+            in_partition = np.logical_and(source_partitions == partition[0],
+                                          sink_partitions == partition[1])
+
+            edge_table = self._edge_table(partition[0], partition[1], create_index=False)
+            n_rows = edge_table._original_len()
+            rows = np.empty(np.sum(in_partition), dtype=edge_table.dtype)
+            for field in edge_table.colnames:
+                if field in edge_arrays:
+                    rows[field] = np.asarray(edge_arrays[field])[in_partition]
+                else:
+                    rows[field] = edge_table.coldflts[field]
+            rows[edge_table._mask_index_field] = np.arange(n_rows, n_rows + len(rows))
+            edge_table.append(rows)
+            edge_table.flush(update_index=False)
+
     def _get_partition_ix(self, region_ix):
         """
         Bisect the partition table to get the partition index for a region index.
@@ -1842,6 +2333,11 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
             return True
         return False
 
+    def _valid_vector(self):
+        if 'valid' in self._regions.colnames:
+            return self._regions.col('valid').astype(bool)
+        return np.ones(len(self._regions), dtype=bool)
+
     def _edge_subset_rows(self, key=None, *args, **kwargs):
         row_regions, col_regions = self._key_to_regions(key, lazy=False)
 
@@ -1849,8 +2345,28 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
             row_regions, col_regions, *args, **kwargs
         )
 
-    def _edge_subset_rows_from_regions(self, row_regions, col_regions, excluded_filters=0,
-                                       *args, **kwargs):
+    def _partition_bounds(self, partition_ix):
+        """
+        First and last (exclusive) region index of a partition.
+        """
+        start = self._partition_breaks[partition_ix - 1] if partition_ix > 0 else 0
+        try:
+            end = self._partition_breaks[partition_ix]
+        except IndexError:
+            end = len(self.regions)
+        return start, end
+
+    def _edge_subset_queries(self, row_regions, col_regions):
+        """
+        Determine the edge tables and query bounds for a region subset.
+
+        :return: iterator over ((i, j), edge_table, bounds1, bounds2, overlap) tuples.
+                 Bounds are (source_min, source_max, sink_min, sink_max) tuples of
+                 inclusive region indices. If both bounds are None, all rows in
+                 the table are selected. Otherwise, rows within bounds2 and within
+                 the overlap range (if not None) have already been selected
+                 by bounds1 and must be skipped.
+        """
         row_start, row_end = self._min_max_region_ix(row_regions)
         col_start, col_end = self._min_max_region_ix(col_regions)
 
@@ -1882,33 +2398,152 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
 
                 # if we need to get all regions in a table, return the whole thing
                 if row_covered and col_covered:
-                    for row in edge_table.iterrows(excluded_filters=excluded_filters,
-                                                   maskable=self):
-                        yield row
+                    yield (i, j), edge_table, None, None, None
 
                 # otherwise only return the subset defined by the respective indices
                 else:
-                    condition = "(%d < source) & (source < %d) & (% d < sink) & (sink < %d)"
-                    condition1 = condition % (row_start - 1, row_end + 1, col_start - 1, col_end + 1)
-                    condition2 = condition % (col_start - 1, col_end + 1, row_start - 1, row_end + 1)
+                    bounds1 = (row_start, row_end, col_start, col_end)
+                    bounds2 = (col_start, col_end, row_start, row_end)
 
                     if row_start > col_start:
-                        condition1, condition2 = condition2, condition1
+                        bounds1, bounds2 = bounds2, bounds1
 
                     overlap = range_overlap(row_start, row_end, col_start, col_end)
 
-                    for edge_row in edge_table.where(condition1, excluded_filters=excluded_filters,
-                                                     maskable=self):
-                        yield edge_row
+                    yield (i, j), edge_table, bounds1, bounds2, overlap
 
-                    for edge_row in edge_table.where(condition2, excluded_filters=excluded_filters,
-                                                     maskable=self):
-                        if overlap is not None:
-                            if (overlap[0] <= edge_row['source'] <= overlap[1]) and (
-                                    overlap[0] <= edge_row['sink'] <= overlap[1]):
-                                continue
+    def _edge_subset_rows_from_regions(self, row_regions, col_regions, excluded_filters=0,
+                                       *args, **kwargs):
+        condition = "(%d < source) & (source < %d) & (% d < sink) & (sink < %d)"
+        for _, edge_table, bounds1, bounds2, overlap in self._edge_subset_queries(row_regions,
+                                                                                  col_regions):
+            if bounds1 is None:
+                for row in edge_table.iterrows(excluded_filters=excluded_filters,
+                                               maskable=self):
+                    yield row
+            else:
+                condition1 = condition % (bounds1[0] - 1, bounds1[1] + 1, bounds1[2] - 1, bounds1[3] + 1)
+                condition2 = condition % (bounds2[0] - 1, bounds2[1] + 1, bounds2[2] - 1, bounds2[3] + 1)
+
+                for edge_row in edge_table.where(condition1, excluded_filters=excluded_filters,
+                                                 maskable=self):
+                    yield edge_row
+
+                for edge_row in edge_table.where(condition2, excluded_filters=excluded_filters,
+                                                 maskable=self):
+                    if overlap is not None:
+                        if (overlap[0] <= edge_row['source'] <= overlap[1]) and (
+                                overlap[0] <= edge_row['sink'] <= overlap[1]):
+                            continue
+
+                    yield edge_row
+
+    def _edge_subset_arrays(self, row_regions, col_regions, fields, excluded_filters=0,
+                            scan_fraction=0.05, chunk_size=1000000):
+        """
+        Vectorised equivalent of :func:`~RegionPairsTable._edge_subset_rows_from_regions`.
+
+        :param row_regions: List of row regions
+        :param col_regions: List of col regions
+        :param fields: List of edge fields to return
+        :param excluded_filters: Binary mask or list of names of filters
+                                 that should be ignored
+        :param scan_fraction: See :func:`~RegionPairsTable._edge_subset_array_chunks`
+        :param chunk_size: Maximum number of rows read at once when
+                           reading whole edge tables
+        :return: list of numpy arrays, one for each field
+        """
+        blocks = list(self._edge_subset_array_chunks(row_regions, col_regions, fields,
+                                                     excluded_filters=excluded_filters,
+                                                     scan_fraction=scan_fraction,
+                                                     chunk_size=chunk_size))
+
+        if len(blocks) == 0:
+            return [np.array([], dtype=np.asarray(self._edge_field_defaults[field]).dtype)
+                    for field in fields]
+        return [np.concatenate([block[i] for block in blocks]) for i in range(len(fields))]
+
+    def _edge_subset_array_chunks(self, row_regions, col_regions, fields, excluded_filters=0,
+                                  chunk_size=1000000, scan_fraction=0.05):
+        """
+        Iterate over edges in a region subset in blocks of numpy arrays.
+
+        Edge tables are either read completely in chunks of rows, which are
+        then subset using numpy, or, if only a small fraction of an edge table
+        is requested, queried using the PyTables index on source and sink.
+
+        :param row_regions: List of row regions
+        :param col_regions: List of col regions
+        :param fields: List of edge fields to return
+        :param excluded_filters: Binary mask or list of names of filters
+                                 that should be ignored
+        :param chunk_size: Maximum number of rows read at once when
+                           reading whole edge tables
+        :param scan_fraction: Minimum (estimated) fraction of edge table rows in
+                              the subset for reading the whole table rather
+                              than querying the index
+        :return: iterator over lists of numpy arrays, one for each field
+        """
+        for field in fields:
+            if field not in self.field_names:
+                raise ValueError("{} is not an edge field".format(field))
+
+        def in_bounds(rows, bounds):
+            return ((bounds[0] <= rows['source']) & (rows['source'] <= bounds[1]) &
+                    (bounds[2] <= rows['sink']) & (rows['sink'] <= bounds[3]))
+
+        def bounds_fraction(partitions, bounds):
+            fraction = 1.
+            for partition_ix, (lo, hi) in zip(partitions, ((bounds[0], bounds[1]), (bounds[2], bounds[3]))):
+                start, end = self._partition_bounds(partition_ix)
+                fraction *= max(0, min(end, hi + 1) - max(start, lo)) / max(1, end - start)
+            return fraction
+
+        def outside_overlap(rows, overlap):
+            if overlap is None:
+                return np.ones(len(rows), dtype=bool)
+            return ~in_bounds(rows, (overlap[0], overlap[1], overlap[0], overlap[1]))
+
+        def block_arrays(rows):
+            return [rows[field] for field in fields]
+
+        condition = "(%d < source) & (source < %d) & (% d < sink) & (sink < %d)"
+        for partitions, edge_table, bounds1, bounds2, overlap in self._edge_subset_queries(row_regions,
+                                                                                           col_regions):
+            if bounds1 is None:
+                n_rows = edge_table._original_len()
+                for start in range(0, n_rows, chunk_size):
+                    rows = edge_table.read_visible(start, min(start + chunk_size, n_rows),
+                                                   excluded_filters=excluded_filters,
+                                                   maskable=self)
+                    if len(rows) > 0:
+                        yield block_arrays(rows)
+                continue
 
-                        yield edge_row
+            if bounds_fraction(partitions, bounds1) + bounds_fraction(partitions, bounds2) >= scan_fraction:
+                n_rows = edge_table._original_len()
+                for start in range(0, n_rows, chunk_size):
+                    rows = edge_table.read_visible(start, min(start + chunk_size, n_rows),
+                                                   excluded_filters=excluded_filters,
+                                                   maskable=self)
+                    # rows in bounds2 that are also in bounds1 lie in the overlap
+                    selected = in_bounds(rows, bounds1) | (in_bounds(rows, bounds2) &
+                                                           outside_overlap(rows, overlap))
+                    rows = rows[selected]
+                    if len(rows) > 0:
+                        yield block_arrays(rows)
+            else:
+                condition1 = condition % (bounds1[0] - 1, bounds1[1] + 1, bounds1[2] - 1, bounds1[3] + 1)
+                condition2 = condition % (bounds2[0] - 1, bounds2[1] + 1, bounds2[2] - 1, bounds2[3] + 1)
+                rows = edge_table.read_where(condition1, excluded_filters=excluded_filters,
+                                             maskable=self)
+                if len(rows) > 0:
+                    yield block_arrays(rows)
+                rows = edge_table.read_where(condition2, excluded_filters=excluded_filters,
+                                             maskable=self)
+                rows = rows[outside_overlap(rows, overlap)]
+                if len(rows) > 0:
+                    yield block_arrays(rows)
 
     def _matrix_entries(self, key, row_regions, col_regions,
                         score_field=None, *args, **kwargs):
@@ -2165,22 +2800,29 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
             partition_pairs = set()
             for pair in pairs:
                 for (source_partition, sink_partition), _ in pair._iter_edge_tables():
-                    new_pairs._edge_table(source_partition, sink_partition)
+                    new_pairs._edge_table(source_partition, sink_partition, create_index=False)
                     partition_pairs.add((source_partition, sink_partition))
 
             logger.info("Starting fast pair merge")
-            for source_partition, sink_partition in partition_pairs:
-                edge_table = new_pairs._edge_table(source_partition, sink_partition)
-                fields = edge_table.colnames
-                new_row = edge_table.row
-                for pair in pairs:
-                    if not pair._has_edge_table(source_partition, sink_partition):
-                        continue
-                    for row in pair._edge_table(source_partition, sink_partition).iterrows():
-                        for field in fields:
-                            new_row[field] = row[field]
-                        new_row.append()
-                edge_table.flush()
+            with RareUpdateProgressBar(max_value=len(partition_pairs), prefix="Merge") as pb:
+                for i, partition in enumerate(sorted(partition_pairs)):
+                    edge_table = new_pairs._edge_table(*partition)
+                    n_rows = 0
+                    for pair in pairs:
+                        for _, rows in pair._iter_edge_table_chunks(partitions={partition}):
+                            if rows.dtype != edge_table.dtype:
+                                converted = np.empty(len(rows), dtype=edge_table.dtype)
+                                for field in edge_table.colnames:
+                                    converted[field] = rows[field]
+                                rows = converted
+
+                            # only unmasked rows are copied
+                            rows[edge_table._mask_field] = 0
+                            rows[edge_table._mask_index_field] = np.arange(n_rows, n_rows + len(rows))
+                            edge_table.append(rows)
+                            n_rows += len(rows)
+                    edge_table.flush()
+                    pb.update(i)
             new_pairs._edges_dirty = True
 
             new_pairs.flush()
@@ -2281,6 +2923,34 @@ class RegionPairsTable(RegionPairsContainer, Maskable, RegionsTable):
         return copy
 
 
+def _expected_value_sums_worker(file_name, partitions, norm, chunk_size):
+    hic = None
+    try:
+        hic = load(file_name, mode='r')
+        weight_field = hic._default_score_field
+        region_chromosomes, chromosome_lengths = hic._region_chromosome_vector()
+
+        if norm and weight_field == 'weight' and hasattr(hic, 'bias_vector'):
+            bias = np.asarray(hic.bias_vector(), dtype=np.float64)
+        else:
+            bias = None
+
+        def chunks():
+            for _, rows in hic._iter_edge_table_chunks(chunk_size=chunk_size, partitions=partitions):
+                sources = rows['source'].astype(np.int64)
+                sinks = rows['sink'].astype(np.int64)
+                weights = rows[weight_field].astype(np.float64)
+                if bias is not None:
+                    weights = weights * bias[sources] * bias[sinks]
+                yield sources, sinks, weights
+
+        return _expected_value_chunk_sums(chunks(), region_chromosomes, len(chromosome_lengths),
+                                          max(chromosome_lengths + [0]), hic._default_value)
+    finally:
+        if hic is not None:
+            hic.close()
+
+
 class RegionMatrixTable(RegionMatrixContainer, RegionPairsTable):
     """
     HDF5 implementation of the :class:`~RegionMatrixContainer` interface.
@@ -2318,9 +2988,7 @@ class RegionMatrixTable(RegionMatrixContainer, RegionPairsTable):
                                   _edge_buffer_size=_edge_buffer_size)
         RegionMatrixContainer.__init__(self)
 
-        file_exists = False
-        if file_name is not None and os.path.exists(os.path.expanduser(file_name)):
-            file_exists = True
+        file_exists = hdf5_file_exists(file_name)
 
         # create expected value group
         if file_exists and mode != 'w':
@@ -2357,7 +3025,7 @@ class RegionMatrixTable(RegionMatrixContainer, RegionPairsTable):
         self._remove_expected_values()
 
     def expected_values_and_marginals(self, selected_chromosome=None, norm=True,
-                                      force=False, *args, **kwargs):
+                                      force=False, threads=1, *args, **kwargs):
         group_name = 'corrected' if norm else 'uncorrected'
 
         if not force and self._expected_value_group is not None:
@@ -2391,8 +3059,9 @@ class RegionMatrixTable(RegionMatrixContainer, RegionPairsTable):
                 pass
 
         (intra_expected, chromosome_intra_expected,
-         inter_expected, marginals, valid) = RegionMatrixContainer.expected_values_and_marginals(self, norm=norm, *args,
-                                                                                                 **kwargs)
+         inter_expected, marginals, valid) = RegionMatrixContainer.expected_values_and_marginals(self, norm=norm,
+                                                                                                 threads=threads,
+                                                                                                 *args, **kwargs)
 
         # try saving to object
         if hasattr(self, '_expected_value_group') and self._expected_value_group is not None:
@@ -2434,6 +3103,57 @@ class RegionMatrixTable(RegionMatrixContainer, RegionPairsTable):
 
         return intra_expected, chromosome_intra_expected, inter_expected, marginals, valid
 
+    def _expected_value_sums_arrays(self, norm=True, threads=1, chunk_size=1000000):
+        """
+        Sums of edge weights by distance and region.
+
+        With more than one thread, edge tables are distributed across a
+        process pool. Every worker opens the matrix file read-only and
+        returns partial sums for its edge tables, which are then added up.
+
+        See :func:`~RegionMatrixContainer._expected_value_sums_arrays`.
+        """
+        file_name = None
+        if threads > 1:
+            file_name = hdf5_file_uri(self.file)
+            if file_name is None:
+                logger.warning("Matrix is not stored in a file, cannot calculate "
+                               "expected values in parallel.")
+                file_name = None
+
+        if file_name is None or self._default_score_field not in self.field_names:
+            return RegionMatrixContainer._expected_value_sums_arrays(self, norm=norm, chunk_size=chunk_size)
+
+        # distribute edge tables across processes, largest tables first
+        table_sizes = sorted([(edge_table._original_len(), partition)
+                              for partition, edge_table in self._iter_edge_tables()], reverse=True)
+        n_processes = max(1, min(threads, len(table_sizes)))
+        process_partitions = [set() for _ in range(n_processes)]
+        process_sizes = [0] * n_processes
+        for size, partition in table_sizes:
+            ix = int(np.argmin(process_sizes))
+            process_partitions[ix].add(partition)
+            process_sizes[ix] += size
+
+        # workers need to see all data
+        self.flush()
+        self.file.flush()
+
+        with hdf5_reader_pool(n_processes) as pool:
+            logger.info("Calculating expected values using {} processes".format(n_processes))
+            results = pool.starmap(_expected_value_sums_worker,
+                                   [(file_name, partitions, norm, chunk_size)
+                                    for partitions in process_partitions])
+
+        marginals, valid, chromosome_intra_sums, inter_sums = results[0]
+        for m, v, c, i in results[1:]:
+            marginals += m
+            valid |= v
+            chromosome_intra_sums += c
+            inter_sums += i
+
+        return self._expected_value_sums_by_chromosome(marginals, valid, chromosome_intra_sums, inter_sums)
+
     def _update_mappability(self):
         _ = self.expected_values_and_marginals(force=True)
 
@@ -2491,22 +3211,37 @@ class RegionMatrixTable(RegionMatrixContainer, RegionPairsTable):
         default_field = getattr(new_matrix, '_default_score_field', 'weight')
         logger.info("Starting fast matrix merge")
         with RareUpdateProgressBar(max_value=len(partition_pairs), prefix="Merge") as pb:
-            for i, (source_partition, sink_partition) in enumerate(partition_pairs):
-                edges = defaultdict(int)
+            for i, partition in enumerate(sorted(partition_pairs)):
+                sources, sinks, weights = [], [], []
                 for matrix in matrices:
-                    if not matrix._has_edge_table(source_partition, sink_partition):
-                        continue
+                    for _, rows in matrix._iter_edge_table_chunks(partitions={partition}):
+                        sources.append(rows['source'])
+                        sinks.append(rows['sink'])
+                        weights.append(rows[default_field].astype(np.float64))
 
-                    for row in matrix._edge_table(source_partition, sink_partition).iterrows():
-                        edges[(row['source'], row['sink'])] += row[default_field]
+                if len(sources) == 0:
+                    pb.update(i)
+                    continue
 
-                edge_table = new_matrix._edge_table(source_partition, sink_partition)
-                new_row = edge_table.row
-                for (source, sink), weight in edges.items():
-                    new_row['source'] = source
-                    new_row['sink'] = sink
-                    new_row[default_field] = weight
-                    new_row.append()
+                sources = np.concatenate(sources)
+                sinks = np.concatenate(sinks)
+                weights = np.concatenate(weights)
+
+                # sum weights of identical pixels
+                order = np.lexsort((sinks, sources))
+                sources, sinks, weights = sources[order], sinks[order], weights[order]
+                starts = np.flatnonzero(np.r_[True, np.logical_or(np.diff(sources) != 0,
+                                                                  np.diff(sinks) != 0)])
+
+                edge_table = new_matrix._edge_table(*partition)
+                rows = np.empty(len(starts), dtype=edge_table.dtype)
+                for field in edge_table.colnames:
+                    rows[field] = edge_table.coldflts[field]
+                rows['source'] = sources[starts]
+                rows['sink'] = sinks[starts]
+                rows[default_field] = np.add.reduceat(weights, starts)
+                rows[edge_table._mask_index_field] = np.arange(len(rows))
+                edge_table.append(rows)
                 edge_table.flush()
                 pb.update(i)
         logger.info("Done merging matrices")
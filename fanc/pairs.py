@@ -8,11 +8,9 @@ import os
 import threading
 import uuid
 from abc import abstractmethod, ABCMeta
-from bisect import bisect_right
 from builtins import object
 from collections import defaultdict
 from queue import Empty
-from timeit import default_timer as timer
 import tempfile
 import shutil
 from datetime import datetime
@@ -21,14 +19,14 @@ import msgpack
 import numpy as np
 import pysam
 import tables as t
-from future.utils import with_metaclass, viewitems, string_types
+from future.utils import with_metaclass, string_types
 
 from genomic_regions import GenomicRegion, RegionBased
 from .config import config
 from .general import MaskFilter, Mask
-from .hic import Hic
+from .hic import Hic, MultiResolutionHic, _get_bin_lookup, _bin_edges
 from .matrix import Edge, RegionPairsTable
-from .regions import genome_regions
+from .regions import genome_regions, Genome, Chromosome
 from .tools.general import RareUpdateProgressBar, add_dict, find_alignment_match_positions, WorkerMonitor
 from .tools.sambam import natural_cmp
 from .tools.files import split_sam_pairs
@@ -84,7 +82,7 @@ def generate_pairs(sam1_file, sam2_file, regions,
 def generate_pairs_split(sam1_file, sam2_file, regions,
                          restriction_enzyme=None,
                          output_file=None, read_filters=(), check_sorted=True,
-                         threads=1, batch_size=1000000):
+                         threads=1, batch_size=1000000, shards=False):
     """
     Generate Pairs object from SAM/BAM files.
 
@@ -106,6 +104,8 @@ def generate_pairs_split(sam1_file, sam2_file, regions,
                     fragments for read pairs
     :param batch_size: Number of read pairs sent to each restriction
                        fragment worker
+    :param shards: If True, workers write pairs to temporary HDF5 files
+                   that are concatenated at the end
     :return: :class:`~ReadPairs`
     """
     regions = genome_regions(regions, restriction_enzyme=restriction_enzyme)
@@ -123,7 +123,8 @@ def generate_pairs_split(sam1_file, sam2_file, regions,
         pairs.add_regions(regions, preserve_attributes=False)
 
     pairs.add_read_pairs_from_sam(sam1_file, sam2_file, threads=threads, batch_size=batch_size,
-                                  read_filters=read_filters, check_sorted=check_sorted)
+                                  read_filters=read_filters, check_sorted=check_sorted,
+                                  shards=shards)
 
     return pairs
 
@@ -153,6 +154,18 @@ class Monitor(WorkerMonitor):
         with self.generating_pairs_lock:
             return self.generating_pairs
 
+    def outputs_pending(self, output_counter):
+        """
+        Check if more worker outputs are to be expected.
+
+        The generating status has to be read before the input counter,
+        as the counter is only final once pair generation has finished.
+
+        :param output_counter: Number of outputs received so far
+        """
+        generating = self.is_generating_pairs()
+        return generating or output_counter < self.value() or not self.workers_idle()
+
 
 def _split_sam_worker(sam_file1, sam_file2, input_queue, monitor, batch_size=10000000,
                       tmpdir=None, check_sorted=True):
@@ -177,9 +190,154 @@ def _split_sam_worker(sam_file1, sam_file2, input_queue, monitor, batch_size=100
         monitor.set_generating_pairs(False)
 
 
+_fragment_info_dtype = np.dtype([
+    ('source_partition', np.int32), ('sink_partition', np.int32),
+    ('source', np.int64), ('sink', np.int64),
+    ('left_read_position', np.int64), ('left_read_strand', np.int8),
+    ('left_fragment_start', np.int64), ('left_fragment_end', np.int64),
+    ('left_fragment_chromosome', np.int32),
+    ('right_read_position', np.int64), ('right_read_strand', np.int8),
+    ('right_fragment_start', np.int64), ('right_fragment_end', np.int64),
+    ('right_fragment_chromosome', np.int32),
+])
+
+
+def _assign_fragments(chromosomes, positions, fi, fe):
+    """
+    Find the restriction fragment for each read position.
+
+    :param chromosomes: array of chromosome names
+    :param positions: array of read positions
+    :param fi: Fragment info array (ix, chromosome ix, start, end) by chromosome
+    :param fe: Fragment end coordinates array by chromosome
+    :return: tuple (fragment infos, valid), where fragment infos is an
+             (n x 4) array and valid a boolean array that is False for reads
+             that could not be assigned to any fragment
+    """
+    infos = np.zeros((len(positions), 4), dtype=np.int64)
+    valid = np.zeros(len(positions), dtype=bool)
+    for chromosome in np.unique(chromosomes):
+        try:
+            ends = fe[chromosome]
+        except KeyError:
+            continue
+
+        ixs = np.flatnonzero(chromosomes == chromosome)
+        fragment_ixs = np.searchsorted(ends, positions[ixs], side='right')
+        in_range = fragment_ixs < len(ends)
+        infos[ixs[in_range]] = fi[chromosome][fragment_ixs[in_range]]
+        valid[ixs[in_range]] = True
+    return infos, valid
+
+
+def _fragment_info_array(chromosomes1, positions1, flags1, chromosomes2, positions2, flags2,
+                         fi, fe, partition_breaks):
+    """
+    Map read pairs to restriction fragments.
+
+    Pairs are oriented so that the left fragment index is never larger
+    than the right one.
+
+    :param chromosomes1: Chromosome names of the first reads
+    :param positions1: Positions of the first reads
+    :param flags1: SAM flags of the first reads
+    :param chromosomes2: Chromosome names of the second reads
+    :param positions2: Positions of the second reads
+    :param flags2: SAM flags of the second reads
+    :param fi: Fragment info array (ix, chromosome ix, start, end) by chromosome
+    :param fe: Fragment end coordinates array by chromosome
+    :param partition_breaks: Region indexes of partition breaks
+    :return: tuple (structured array with _fragment_info_dtype, number of skipped pairs)
+    """
+    positions1 = np.asarray(positions1, dtype=np.int64)
+    positions2 = np.asarray(positions2, dtype=np.int64)
+    flags1 = np.asarray(flags1, dtype=np.int64)
+    flags2 = np.asarray(flags2, dtype=np.int64)
+    infos1, valid1 = _assign_fragments(np.asarray(chromosomes1), positions1, fi, fe)
+    infos2, valid2 = _assign_fragments(np.asarray(chromosomes2), positions2, fi, fe)
+    valid = np.logical_and(valid1, valid2)
+
+    strands1 = np.where(flags1[valid] & 16, -1, 1)
+    strands2 = np.where(flags2[valid] & 16, -1, 1)
+    positions1, positions2 = positions1[valid], positions2[valid]
+    infos1, infos2 = infos1[valid], infos2[valid]
+
+    # left fragment is always the one with the smaller index
+    swap = infos1[:, 0] > infos2[:, 0]
+    for a, b in ((positions1, positions2), (strands1, strands2), (infos1, infos2)):
+        a[swap], b[swap] = b[swap], a[swap]
+
+    fragment_infos = np.empty(len(positions1), dtype=_fragment_info_dtype)
+    fragment_infos['source_partition'] = np.searchsorted(partition_breaks, infos1[:, 0], side='right')
+    fragment_infos['sink_partition'] = np.searchsorted(partition_breaks, infos2[:, 0], side='right')
+    fragment_infos['source'], fragment_infos['sink'] = infos1[:, 0], infos2[:, 0]
+    for side, positions, strands, infos in (('left', positions1, strands1, infos1),
+                                            ('right', positions2, strands2, infos2)):
+        fragment_infos[side + '_read_position'] = positions
+        fragment_infos[side + '_read_strand'] = strands
+        fragment_infos[side + '_fragment_chromosome'] = infos[:, 1]
+        fragment_infos[side + '_fragment_start'] = infos[:, 2]
+        fragment_infos[side + '_fragment_end'] = infos[:, 3]
+
+    return fragment_infos, len(valid) - len(positions1)
+
+
+def _split_fragment_info_array(fragment_infos, template):
+    """
+    Convert fragment infos to edge table rows and split them by partition.
+
+    :param fragment_infos: structured array with _fragment_info_dtype
+    :param template: Edge table row with default values
+    :return: dict of edge table row arrays by (source partition, sink partition)
+    """
+    if len(fragment_infos) == 0:
+        return dict()
+
+    order = np.lexsort((fragment_infos['sink_partition'], fragment_infos['source_partition']))
+    fragment_infos = fragment_infos[order]
+
+    rows = np.repeat(template, len(fragment_infos))
+    for name in fragment_infos.dtype.names[2:]:
+        rows[name] = fragment_infos[name]
+
+    source_partitions = fragment_infos['source_partition']
+    sink_partitions = fragment_infos['sink_partition']
+    starts = np.flatnonzero(np.r_[True, np.logical_or(np.diff(source_partitions) != 0,
+                                                      np.diff(sink_partitions) != 0)])
+    ends = np.r_[starts[1:], len(rows)]
+    return {(int(source_partitions[start]), int(sink_partitions[start])): rows[start:end]
+            for start, end in zip(starts, ends)}
+
+
+def _append_to_shard(shard_file, partitions, edge_table_prefix='chrpair_'):
+    """
+    Append edge table rows to a temporary HDF5 shard.
+
+    The shard stores one table per partition under /edges, using the
+    same table names as :class:`~fanc.matrix.RegionPairsTable`.
+
+    :param shard_file: Path to the shard file
+    :param partitions: dict of edge table row arrays by
+                       (source partition, sink partition)
+    :param edge_table_prefix: Prefix of partition table names
+    """
+    with t.open_file(shard_file, mode='a') as f:
+        if '/edges' not in f:
+            f.create_group('/', 'edges')
+
+        for (source_partition, sink_partition), rows in partitions.items():
+            table_name = edge_table_prefix + str(source_partition) + '_' + str(sink_partition)
+            try:
+                edge_table = f.get_node('/edges', table_name)
+            except t.NoSuchNodeError:
+                edge_table = f.create_table('/edges', table_name, description=rows.dtype,
+                                            expectedrows=1000000)
+            edge_table.append(rows)
+
+
 def _load_paired_sam_worker(monitor, input_file_queue, output_file_queue, fi, fe,
-                            partition_breaks, read_filters=None,
-                            tmpdir=None, buffer_size=1000000):
+                            partition_breaks, template, read_filters=None,
+                            tmpdir=None, shards=False):
     logger.debug("Launching SAM worker")
     worker_uuid = uuid.uuid4()
     monitor.set_worker_busy(worker_uuid)
@@ -204,60 +362,40 @@ def _load_paired_sam_worker(monitor, input_file_queue, output_file_queue, fi, fe
         monitor.set_worker_busy(worker_uuid)
         logger.debug('Worker {} received input!'.format(worker_uuid))
 
-        output_file = os.path.join(tmpdir, 'fragment_info_{}_{}.txt'.format(worker_uuid, file_counter))
+        if shards:
+            output_file = os.path.join(tmpdir, 'pairs_shard_{}.h5'.format(worker_uuid))
+        else:
+            output_file = os.path.join(tmpdir, 'fragment_info_{}_{}.npz'.format(worker_uuid, file_counter))
         logger.debug("Writing fragment info to output file {}".format(output_file))
         file_counter += 1
 
-        lines = []
-        skipped_counter = 0
         pair_generator = PairedSamBamReadPairGenerator(read_pairs_file)
         if read_filters is not None:
             for f in read_filters:
                 pair_generator.add_filter(f)
         pair_generator._unmappable_count = unmappable
 
+        chromosomes1, positions1, flags1 = [], [], []
+        chromosomes2, positions2, flags2 = [], [], []
         for read1, read2 in pair_generator:
-            chrom1, pos1, flag1 = read1.reference_name, read1.pos, read1.flag
-            chrom2, pos2, flag2 = read2.reference_name, read2.pos, read2.flag
-            chrom1 = chrom1.decode() if isinstance(chrom1, bytes) else chrom1
-            chrom2 = chrom2.decode() if isinstance(chrom2, bytes) else chrom2
-
-            try:
-                pos_ix1 = bisect_right(fe[chrom1], pos1)
-                pos_ix2 = bisect_right(fe[chrom2], pos2)
-
-                f_ix1, f_chromosome_ix1, f_start1, f_end1 = fi[chrom1][pos_ix1]
-                f_ix2, f_chromosome_ix2, f_start2, f_end2 = fi[chrom2][pos_ix2]
-
-                p_ix1 = bisect_right(partition_breaks, f_ix1)
-                p_ix2 = bisect_right(partition_breaks, f_ix2)
-
-                r_strand1 = -1 if flag1 & 16 else 1
-                r_strand2 = -1 if flag2 & 16 else 1
-
-                if p_ix1 > p_ix2:
-                    line = "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
-                        p_ix2, pos2, r_strand2, f_ix2, f_chromosome_ix2, f_start2, f_end2,
-                        p_ix1, pos1, r_strand1, f_ix1, f_chromosome_ix1, f_start1, f_end1
-                    )
-                else:
-                    line = "{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
-                        p_ix1, pos1, r_strand1, f_ix1, f_chromosome_ix1, f_start1, f_end1,
-                        p_ix2, pos2, r_strand2, f_ix2, f_chromosome_ix2, f_start2, f_end2
-                    )
-                lines.append(line)
-
-                if len(lines) > buffer_size:
-                    with open(output_file, 'a') as o:
-                        for line in lines:
-                            o.write(line)
-                    lines = []
-            except (KeyError, IndexError):
-                skipped_counter += 1
-
-        with open(output_file, 'a') as o:
-            for line in lines:
-                o.write(line)
+            chrom1, chrom2 = read1.reference_name, read2.reference_name
+            chromosomes1.append(chrom1.decode() if isinstance(chrom1, bytes) else chrom1)
+            chromosomes2.append(chrom2.decode() if isinstance(chrom2, bytes) else chrom2)
+            positions1.append(read1.pos)
+            positions2.append(read2.pos)
+            flags1.append(read1.flag)
+            flags2.append(read2.flag)
+
+        fragment_infos, skipped_counter = _fragment_info_array(chromosomes1, positions1, flags1,
+                                                               chromosomes2, positions2, flags2,
+                                                               fi, fe, partition_breaks)
+        partitions = _split_fragment_info_array(fragment_infos, template)
+        if shards:
+            _append_to_shard(output_file, partitions)
+        else:
+            np.savez(output_file, **{'{}_{}'.format(*partition): rows
+                                     for partition, rows in partitions.items()})
+        logger.debug("Worker {} skipped {} pairs".format(worker_uuid, skipped_counter))
 
         logger.debug("Done obtaining fragment info for {} in {}".format(read_pairs_file, output_file))
         output_file_queue.put((read_pairs_file, output_file, pair_generator.stats()))
@@ -266,7 +404,7 @@ def _load_paired_sam_worker(monitor, input_file_queue, output_file_queue, fi, fe
         logger.debug("Worker {} load time: {}".format(worker_uuid, l))
 
 
-def _fragment_info_worker(monitor, input_queue, output_queue, fi, fe):
+def _fragment_info_worker(monitor, input_queue, output_queue, fi, fe, partition_breaks, template):
     """
     Worker that finds the restriction fragment info for read pairs.
 
@@ -276,9 +414,11 @@ def _fragment_info_worker(monitor, input_queue, output_queue, fi, fe):
     :param monitor: :class:`~Monitor`
     :param input_queue: Queue for input read_pairs
     :param output_queue: Queue for output fragment infos
-    :param fi: Fragment info dictionary by chromosome and fragment index
-    :param fe: Fragment end coordinates by chromosome
-    :return: list of fragment infos
+    :param fi: Fragment info array (ix, chromosome ix, start, end) by chromosome
+    :param fe: Fragment end coordinates array by chromosome
+    :param partition_breaks: Region indexes of partition breaks
+    :param template: Edge table row with default values
+    :return: dict of edge table rows by partition
     """
     worker_uuid = uuid.uuid4()
     logger.debug("Starting fragment info worker {}".format(worker_uuid))
@@ -292,30 +432,21 @@ def _fragment_info_worker(monitor, input_queue, output_queue, fi, fe):
         logger.debug('Worker {} reveived input!'.format(worker_uuid))
         read_pairs = msgpack.loads(read_pairs, strict_map_key=False)
 
-        fragment_infos = []
-        skipped_counter = 0
+        chromosomes1, positions1, flags1 = [], [], []
+        chromosomes2, positions2, flags2 = [], [], []
         for (chrom1, pos1, flag1), (chrom2, pos2, flag2) in read_pairs:
-            chrom1 = chrom1.decode() if isinstance(chrom1, bytes) else chrom1
-            chrom2 = chrom2.decode() if isinstance(chrom2, bytes) else chrom2
-
-            try:
-                pos_ix1 = bisect_right(fe[chrom1], pos1)
-                pos_ix2 = bisect_right(fe[chrom2], pos2)
-
-                f_ix1, f_chromosome_ix1, f_start1, f_end1 = fi[chrom1][pos_ix1]
-                f_ix2, f_chromosome_ix2, f_start2, f_end2 = fi[chrom2][pos_ix2]
-
-                r_strand1 = -1 if flag1 & 16 else 1
-                r_strand2 = -1 if flag2 & 16 else 1
-
-                fragment_infos.append(
-                    ((pos1, r_strand1, f_ix1, f_chromosome_ix1, f_start1, f_end1),
-                     (pos2, r_strand2, f_ix2, f_chromosome_ix2, f_start2, f_end2))
-                )
-            except (KeyError, IndexError):
-                skipped_counter += 1
+            chromosomes1.append(chrom1.decode() if isinstance(chrom1, bytes) else chrom1)
+            chromosomes2.append(chrom2.decode() if isinstance(chrom2, bytes) else chrom2)
+            positions1.append(pos1)
+            positions2.append(pos2)
+            flags1.append(flag1)
+            flags2.append(flag2)
+
+        fragment_infos, skipped_counter = _fragment_info_array(chromosomes1, positions1, flags1,
+                                                               chromosomes2, positions2, flags2,
+                                                               fi, fe, partition_breaks)
         logger.debug("Worker {} skipped {} pairs".format(worker_uuid, skipped_counter))
-        output_queue.put(msgpack.dumps(fragment_infos))
+        output_queue.put(_split_fragment_info_array(fragment_infos, template))
         del read_pairs
 
 
@@ -1155,7 +1286,7 @@ class ReadPairs(RegionPairsTable):
                  _group_name='fragment_map',
                  _table_name_fragments='fragments',
                  _table_name_pairs='pairs',
-                 tmpdir=None):
+                 tmpdir=None, partition_strategy='auto'):
         """
         Initialize empty FragmentMappedReadPairs object.
 
@@ -1165,8 +1296,11 @@ class ReadPairs(RegionPairsTable):
         :param mode: File mode. Defaults to 'a' (append). Use 'w' to overwrite
                      an existing file in the same location, and 'r' for safe
                      read-only access.
+        :param partition_strategy: Strategy for partitioning pairs into
+                                   tables, see :class:`~fanc.matrix.RegionPairsTable`
         """
         RegionPairsTable.__init__(self, file_name=file_name, mode=mode, tmpdir=tmpdir,
+                                  partition_strategy=partition_strategy,
                                   additional_edge_fields={
                                       'ix': t.Int32Col(pos=0),
                                       'left_read_position': t.Int64Col(pos=1),
@@ -1249,6 +1383,25 @@ class ReadPairs(RegionPairsTable):
         return ((read1.pos, r_strand1, f_ix1, f_chromosome_ix1, f_start1, f_end1),
                 (read2.pos, r_strand2, f_ix2, f_chromosome_ix2, f_start2, f_end2))
 
+    def _fragment_info_arrays(self):
+        """
+        Fragment coordinates by chromosome for fragment lookups in workers.
+
+        :return: tuple of dicts with chromosome names as keys: (ix, chromosome ix,
+                 start, end) array of all fragments, and the array of fragment ends
+        """
+        fragment_infos = defaultdict(list)
+        for region in self.regions(lazy=True):
+            chromosome = region.chromosome
+            fragment_infos[chromosome].append((region.ix, self._chromosome_to_ix[chromosome],
+                                               region.start, region.end))
+
+        fragment_infos = {chromosome: np.array(infos, dtype=np.int64)
+                          for chromosome, infos in fragment_infos.items()}
+        fragment_ends = {chromosome: infos[:, 3].copy()
+                         for chromosome, infos in fragment_infos.items()}
+        return fragment_infos, fragment_ends
+
     def _read_pairs_fragment_info(self, read_pairs, threads=4, batch_size=1000000, timeout=600):
         """
         Parallel loading of read pairs along with mapping to restriction fragments.
@@ -1261,14 +1414,9 @@ class ReadPairs(RegionPairsTable):
         :param timeout: Time to wait for reply of first worker. If this
                         threshold is exceeded before any read pairs have been
                         returned, a warning is displayed.
+        :return: iterator over dicts of edge table rows by partition
         """
-        fragment_infos = defaultdict(list)
-        fragment_ends = defaultdict(list)
-        for region in self.regions(lazy=True):
-            chromosome = region.chromosome
-            fragment_infos[chromosome].append((region.ix, self._chromosome_to_ix[chromosome],
-                                               region.start, region.end))
-            fragment_ends[chromosome].append(region.end)
+        fragment_infos, fragment_ends = self._fragment_info_arrays()
 
         worker_pool = None
         t_pairs = None
@@ -1287,20 +1435,25 @@ class ReadPairs(RegionPairsTable):
             logger.debug("Launching fragment info workers")
             with mp.get_context("spawn").Pool(threads, _fragment_info_worker,
                                               (monitor, input_queue, output_queue,
-                                               fragment_infos, fragment_ends)) as worker_pool:
+                                               fragment_infos, fragment_ends,
+                                               self._partition_breaks,
+                                               self._edge_row_template())) as worker_pool:
                 output_counter = 0
-                while output_counter < monitor.value() or not monitor.workers_idle() or monitor.is_generating_pairs():
+                wait_time = 0
+                while monitor.outputs_pending(output_counter):
                     try:
-                        read_pair_infos = output_queue.get(block=True, timeout=timeout)
-
-                        for read1_info, read2_info in msgpack.loads(read_pair_infos, strict_map_key=False):
-                            yield read1_info, read2_info
-                        output_counter += 1
-                        del read_pair_infos
+                        partitions = output_queue.get(block=True, timeout=1)
                     except Empty:
-                        logger.warning("Reached SAM pair generator timeout. This could mean that no "
-                                       "valid read pairs were found after filtering. "
-                                       "Check filter settings!")
+                        wait_time += 1
+                        if wait_time >= timeout:
+                            logger.warning("Reached SAM pair generator timeout. This could mean that no "
+                                           "valid read pairs were found after filtering. "
+                                           "Check filter settings!")
+                            wait_time = 0
+                        continue
+                    wait_time = 0
+                    yield partitions
+                    output_counter += 1
         finally:
             if worker_pool is not None:
                 worker_pool.terminate()
@@ -1338,7 +1491,60 @@ class ReadPairs(RegionPairsTable):
         if flush:
             self.flush()
 
+    def _edge_row_template(self):
+        """
+        Edge table row with default values, for building rows in workers.
+        """
+        edge_table = self._edge_table(0, 0, create_index=False)
+        template = np.zeros(1, dtype=edge_table.dtype)
+        for name in edge_table.colnames:
+            template[name] = edge_table.coldflts[name]
+        return template
+
+    def _append_partitions(self, partitions):
+        """
+        Append edge table rows directly to their partition tables.
+
+        :param partitions: dict of edge table row arrays by
+                           (source partition, sink partition)
+        """
+        if self._pair_count is None:
+            self._pair_count = sum(edge_table._original_len()
+                                   for _, edge_table in self._iter_edge_tables())
+
+        for (source_partition, sink_partition), rows in sorted(partitions.items()):
+            rows['ix'] = np.arange(self._pair_count, self._pair_count + len(rows))
+            edge_table = self._edge_table(source_partition, sink_partition, create_index=False)
+            edge_table.append(rows)
+            edge_table.flush(update_index=False)
+            self._pair_count += len(rows)
+
+    def _append_shards(self, shard_files, chunk_size=1000000):
+        """
+        Concatenate temporary HDF5 shards written by SAM workers.
+
+        :param shard_files: Paths to shard files, see :func:`~_append_to_shard`
+        :param chunk_size: Number of rows read from a shard table at once
+        """
+        with RareUpdateProgressBar(max_value=len(shard_files), prefix='Shards',
+                                   silent=config.hide_progressbars) as pb:
+            for i, shard_file in enumerate(shard_files):
+                with t.open_file(shard_file, mode='r') as f:
+                    for shard_table in f.iter_nodes('/edges', classname='Table'):
+                        source_partition, sink_partition = shard_table.name.split('_')[-2:]
+                        partition = (int(source_partition), int(sink_partition))
+                        for start in range(0, shard_table.nrows, chunk_size):
+                            end = min(start + chunk_size, shard_table.nrows)
+                            self._append_partitions({partition: shard_table.read(start, end)})
+                pb.update(i)
+
     def load_read_pairs_fragment_info_file(self, read_pairs_file):
+        if read_pairs_file.endswith('.npz'):
+            with np.load(read_pairs_file) as f:
+                self._append_partitions({tuple(int(ix) for ix in key.split('_')): f[key]
+                                         for key in f.files})
+            return
+
         if read_pairs_file.endswith('.gz') or read_pairs_file.endswith('.gzip'):
             open_ = gzip.open
         else:
@@ -1373,17 +1579,30 @@ class ReadPairs(RegionPairsTable):
                 self._pair_count += 1
 
     def add_read_pairs_from_sam(self, sam_file1, sam_file2, batch_size=1000000, threads=1,
-                                read_filters=None, check_sorted=True, tmpdir=None):
+                                read_filters=None, check_sorted=True, tmpdir=None,
+                                shards=False):
+        """
+        Add read pairs directly from sorted SAM/BAM files.
+
+        SAM files are split into batches that are mapped to restriction
+        fragments in parallel.
+
+        :param sam_file1: Path to a sorted SAM/BAM file (1st mate)
+        :param sam_file2: Path to a sorted SAM/BAM file (2nd mate)
+        :param batch_size: Number of read pairs per batch
+        :param threads: Number of worker processes
+        :param read_filters: List of :class:`~ReadFilter` to filter reads
+        :param check_sorted: Double-check that input SAM files are sorted
+        :param tmpdir: Directory for temporary files
+        :param shards: If True, each worker writes its pairs to its own
+                       temporary HDF5 file, which are concatenated at the end.
+                       This avoids the main process being a bottleneck
+                       when using many threads.
+        """
         self._edges_dirty = True
         self._disable_edge_indexes()
 
-        fragment_infos = defaultdict(list)
-        fragment_ends = defaultdict(list)
-        for region in self.regions(lazy=True):
-            chromosome = region.chromosome
-            fragment_infos[chromosome].append((region.ix, self._chromosome_to_ix[chromosome],
-                                               region.start, region.end))
-            fragment_ends[chromosome].append(region.end)
+        fragment_infos, fragment_ends = self._fragment_info_arrays()
 
         if tmpdir is None:
             split_tmpdir = tempfile.mkdtemp()
@@ -1395,6 +1614,7 @@ class ReadPairs(RegionPairsTable):
         worker_pool = None
         t_split = None
         all_stats = defaultdict(int)
+        shard_files = set()
         try:
             queue_manager = mp.Manager()
             input_file_queue = queue_manager.Queue(maxsize=threads * 3)
@@ -1415,25 +1635,29 @@ class ReadPairs(RegionPairsTable):
             with mp.get_context("spawn").Pool(threads, _load_paired_sam_worker,
                                              (monitor, input_file_queue, output_file_queue,
                                               fragment_infos, fragment_ends, self._partition_breaks,
-                                              read_filters, pairs_tmpdir)) as worker_pool:
+                                              self._edge_row_template(),
+                                              read_filters, pairs_tmpdir, shards)) as worker_pool:
                 logger.debug("Done launching _load_paired_sam_worker workers")
 
                 output_counter = 0
                 cumulative_wait_time = 0
                 cumulative_load_time = 0
-                while output_counter < monitor.value() or not monitor.workers_idle() or monitor.is_generating_pairs():
+                while monitor.outputs_pending(output_counter):
                     try:
                         logger.debug("SAM output collection counter: {}".format(output_counter))
                         s = datetime.now()
-                        input_file, read_pairs_file, chunk_stats = output_file_queue.get(block=True)
+                        input_file, read_pairs_file, chunk_stats = output_file_queue.get(block=True, timeout=1)
                         w = datetime.now() - s
                         logger.debug("Wait time: {}".format(w))
                         cumulative_wait_time += w.total_seconds()
 
                         s = datetime.now()
                         os.remove(input_file)
-                        self.load_read_pairs_fragment_info_file(read_pairs_file)
-                        os.remove(read_pairs_file)
+                        if shards:
+                            shard_files.add(read_pairs_file)
+                        else:
+                            self.load_read_pairs_fragment_info_file(read_pairs_file)
+                            os.remove(read_pairs_file)
                         for key, value in chunk_stats.items():
                             all_stats[key] += value
                         output_counter += 1
@@ -1441,9 +1665,12 @@ class ReadPairs(RegionPairsTable):
                         logger.debug("Load time: {}".format(l))
                         cumulative_load_time += l.total_seconds()
                     except Empty:
-                        logger.warning("Reached SAM pair generator timeout. This could mean that no "
-                                       "valid read pairs were found after filtering. "
-                                       "Check filter settings!")
+                        continue
+
+            if shards:
+                s = datetime.now()
+                self._append_shards(sorted(shard_files))
+                cumulative_load_time += (datetime.now() - s).total_seconds()
         finally:
             if worker_pool is not None:
                 worker_pool.terminate()
@@ -1496,27 +1723,9 @@ class ReadPairs(RegionPairsTable):
             self._pair_count = sum(edge_table._original_len()
                                    for _, edge_table in self._iter_edge_tables())
 
-        start_time = timer()
-        chunk_start_time = timer()
-        pairs_counter = 0
-        edge = {}
-        for fi1, fi2 in self._read_pairs_fragment_info(read_pairs, batch_size=batch_size, threads=threads):
-            source, sink = int(fi1[2]), int(fi2[2])
-            if source > sink:
-                source, sink = sink, source
-                fi1, fi2 = fi2, fi1
-
-            edge['ix'] = self._pair_count
-            edge['source'] = source
-            edge['sink'] = sink
-            edge['left_read_position'], edge['right_read_position'] = int(fi1[0]), int(fi2[0])
-            edge['left_read_strand'], edge['right_read_strand'] = fi1[1], fi2[1]
-            edge['left_fragment_start'], edge['right_fragment_start'] = int(fi1[4]), int(fi2[4])
-            edge['left_fragment_end'], edge['right_fragment_end'] = int(fi1[5]), int(fi2[5])
-            edge['left_fragment_chromosome'], edge['right_fragment_chromosome'] = int(fi1[3]), int(fi2[3])
-
-            self._edge_buffer.add_dict(edge)
-            self._pair_count += 1
+        for partitions in self._read_pairs_fragment_info(read_pairs, batch_size=batch_size,
+                                                         threads=threads):
+            self._append_partitions(partitions)
 
         logger.info('Done saving read pairs.')
 
@@ -1952,6 +2161,42 @@ class ReadPairs(RegionPairsTable):
             l += len(edge_table)
         return l
 
+    def _pixel_counts(self, partition, chunk_size=1000000):
+        """
+        Count valid pairs per pixel in a pairs edge table.
+
+        Pixels are encoded as source * number of regions + sink. Counts
+        are computed per chunk and merged whenever the unmerged counts
+        outgrow the merged ones, so memory scales with the number of
+        distinct pixels rather than the number of pairs.
+
+        :param partition: (source partition, sink partition) tuple
+        :param chunk_size: Number of pair rows read at once
+        :return: tuple (sorted pixel keys, counts)
+        """
+        n_regions = len(self.regions)
+        keys, counts = [], []
+        n_merged, n_pending = 0, 0
+        for _, rows in self._iter_edge_table_chunks(chunk_size, partitions={partition}):
+            chunk_keys = rows['source'].astype(np.int64) * n_regions + rows['sink']
+            chunk_keys, chunk_counts = np.unique(chunk_keys, return_counts=True)
+            keys.append(chunk_keys)
+            counts.append(chunk_counts)
+            n_pending += len(chunk_keys)
+
+            if len(keys) > 1 and n_pending > max(n_merged, chunk_size):
+                keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+                counts = np.bincount(inverse, weights=np.concatenate(counts))
+                keys, counts = [keys], [counts]
+                n_merged, n_pending = len(keys[0]), 0
+
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate(counts))
+        return keys, counts
+
     def to_hic(self, file_name=None, tmpdir=None, _hic_class=Hic):
         """
         Convert this :class:`~ReadPairs` to a :class:`~fanc.Hic` object.
@@ -1965,37 +2210,158 @@ class ReadPairs(RegionPairsTable):
 
         hic._disable_edge_indexes()
 
-        n_pairs = len(self)
-        pairs_counter = 0
-        with RareUpdateProgressBar(max_value=n_pairs, silent=config.hide_progressbars,
+        n_regions = len(self.regions)
+        hic_breaks = hic._partition_breaks
+        partitions = [partition for partition, _ in self._iter_edge_tables()]
+        with RareUpdateProgressBar(max_value=len(partitions), silent=config.hide_progressbars,
                                    prefix="Hi-C convert") as pb:
-            for _, pairs_edge_table in self._iter_edge_tables():
-
-                partition_edge_buffer = defaultdict(lambda: defaultdict(int))
-                for row in pairs_edge_table:
-                    key = (row['source'], row['sink'])
-                    source_partition = self._get_partition_ix(key[0])
-                    sink_partition = self._get_partition_ix(key[1])
-                    partition_edge_buffer[(source_partition, sink_partition)][key] += 1
-                    pb.update(pairs_counter)
-                    pairs_counter += 1
-
-                for hic_partition_key, edge_buffer in viewitems(partition_edge_buffer):
-                    hic_edge_table = hic._edge_table(hic_partition_key[0], hic_partition_key[1])
-                    row = hic_edge_table.row
-
-                    for (source, sink), weight in viewitems(edge_buffer):
-                        row['source'] = source
-                        row['sink'] = sink
-                        row[hic._default_score_field] = float(weight)
-                        row.append()
+            for i, partition in enumerate(partitions):
+                keys, counts = self._pixel_counts(partition)
+                sources, sinks = keys // n_regions, keys % n_regions
+
+                source_partitions = np.searchsorted(hic_breaks, sources, side='right')
+                sink_partitions = np.searchsorted(hic_breaks, sinks, side='right')
+                for hic_partition in set(zip(source_partitions.tolist(), sink_partitions.tolist())):
+                    in_partition = np.logical_and(source_partitions == hic_partition[0],
+                                                  sink_partitions == hic_partition[1])
+
+                    hic_edge_table = hic._edge_table(hic_partition[0], hic_partition[1],
+                                                     create_index=False)
+                    n_rows = hic_edge_table._original_len()
+                    rows = np.empty(np.sum(in_partition), dtype=hic_edge_table.dtype)
+                    for field in hic_edge_table.colnames:
+                        rows[field] = hic_edge_table.coldflts[field]
+                    rows['source'] = sources[in_partition]
+                    rows['sink'] = sinks[in_partition]
+                    rows[hic._default_score_field] = counts[in_partition]
+                    rows[hic_edge_table._mask_index_field] = np.arange(n_rows, n_rows + len(rows))
+                    hic_edge_table.append(rows)
                     hic_edge_table.flush(update_index=False)
+                pb.update(i)
         hic.flush()
 
         hic._enable_edge_indexes()
 
         return hic
 
+    def to_hic_pyramid(self, resolutions, file_names=None, tmpdir=None, chromosomes=None,
+                       norm_method=None, multi_resolution_file=None, _hic_class=Hic, **norm_kwargs):
+        """
+        Convert this :class:`~ReadPairs` to binned :class:`~fanc.Hic` objects
+        at multiple resolutions at once.
+
+        Valid pairs are only read once. The finest resolution is binned from
+        the fragment-level contacts, and every coarser resolution that is a
+        multiple of a finer one is built by summing the counts of that finer
+        matrix. If all fragments are aligned with the bin borders, the result
+        is the same as binning the output of :func:`~ReadPairs.to_hic` with
+        :func:`~fanc.Hic.bin` at each resolution. Otherwise, contacts of
+        fragments straddling a bin border are split randomly between bins
+        (see :func:`~fanc.Hic.bin`), so individual pixels can differ, while
+        the total number of contacts is the same.
+        Binned contacts are written to each matrix as soon as an edge table of
+        pairs has been processed, and duplicate pixels are summed per matrix
+        edge table at the end, so no resolution is held in memory completely.
+
+        :param resolutions: List of bin sizes in base pairs
+        :param file_names: Optional list of output file paths, one for each
+                           entry in resolutions
+        :param tmpdir: If True (or path to temporary directory) will
+                       work in temporary directory until closed
+        :param chromosomes: Optional list of chromosomes to include
+        :param norm_method: If provided, normalise each matrix using this
+                            method. See :func:`~fanc.Hic.normalise`
+        :param multi_resolution_file: Optional path to a
+                                      :class:`~fanc.hic.MultiResolutionHic` file.
+                                      If provided, all resolutions are written
+                                      into this single file instead of
+                                      separate files
+        :param norm_kwargs: Keyword arguments passed to :func:`~fanc.Hic.normalise`
+        :return: dict of {bin size: :class:`~fanc.Hic`}
+        """
+        if multi_resolution_file is not None and file_names is not None:
+            raise ValueError("Cannot use file_names and multi_resolution_file at the same time")
+
+        if file_names is None:
+            file_names = [None] * len(resolutions)
+        elif len(file_names) != len(resolutions):
+            raise ValueError("Number of file names ({}) must match number "
+                             "of resolutions ({})".format(len(file_names), len(resolutions)))
+        file_names = dict(zip(resolutions, file_names))
+
+        if chromosomes is None:
+            chromosomes = self.chromosomes()
+        chromosome_lengths = self.chromosome_lengths
+        genome = Genome(chromosomes=[Chromosome(name=chromosome, length=chromosome_lengths[chromosome])
+                                     for chromosome in chromosomes])
+
+        container = None
+        if multi_resolution_file is not None:
+            container = MultiResolutionHic(multi_resolution_file, mode='a')
+
+        hics = dict()
+        parents = dict()
+        bin_lookups = dict()
+        try:
+            for resolution in sorted(set(resolutions)):
+                logger.info("Constructing {}b bins".format(resolution))
+                regions = genome.get_regions(resolution)
+                if container is not None:
+                    hic = container.hic(resolution, mode='w', _hic_class=_hic_class)
+                else:
+                    hic = _hic_class(file_name=file_names[resolution], mode='w', tmpdir=tmpdir)
+                hic.add_regions(regions.regions(lazy=True), preserve_attributes=False)
+                regions.close()
+
+                # coarsen the largest finer resolution that fits into this one
+                parent = None
+                for finer_resolution in hics.keys():
+                    if resolution % finer_resolution == 0:
+                        parent = finer_resolution
+                parents[resolution] = parent
+                parent_regions = self.regions(lazy=True) if parent is None else hics[parent].regions(lazy=True)
+                bin_lookups[resolution] = _get_bin_lookup(parent_regions, hic.regions(lazy=True))
+                hics[resolution] = hic
+        finally:
+            genome.close()
+            if container is not None:
+                container.close()
+
+        for hic in hics.values():
+            hic._disable_edge_indexes()
+
+        n_regions = len(self.regions)
+        partitions = [partition for partition, _ in self._iter_edge_tables()]
+        with RareUpdateProgressBar(max_value=len(partitions), silent=config.hide_progressbars,
+                                   prefix="Hi-C pyramid") as pb:
+            for i, partition in enumerate(partitions):
+                keys, counts = self._pixel_counts(partition)
+                edges = {None: (keys // n_regions, keys % n_regions, counts)}
+                del keys, counts
+                for resolution in sorted(hics.keys()):
+                    sources, sinks, weights = edges[parents[resolution]]
+                    resolution_edges = _bin_edges(sources, sinks, weights, *bin_lookups[resolution])
+                    hics[resolution]._append_binned_edges(resolution_edges)
+                    edges[resolution] = (resolution_edges['source'], resolution_edges['sink'],
+                                         resolution_edges['weight'])
+                    # only keep levels that still serve as parent of a coarser resolution
+                    for level in list(edges.keys()):
+                        if not any(parents[r] == level for r in hics.keys() if r > resolution):
+                            del edges[level]
+                pb.update(i)
+
+        for resolution in sorted(hics.keys()):
+            logger.info("Writing {}b matrix".format(resolution))
+            hic = hics[resolution]
+            hic._merge_binned_edges()
+            hic.flush()
+
+            if norm_method is not None:
+                logger.info("Normalising {}b matrix".format(resolution))
+                hic.normalise(norm_method, **norm_kwargs)
+
+        return hics
+
     def pairs_by_chromosomes(self, chromosome1, chromosome2, **kwargs):
         """
         Only iterate over read pairs in this combination of chromosomes.
@@ -2419,6 +2785,45 @@ class FragmentReadPairFilter(with_metaclass(ABCMeta, MaskFilter)):
         pair = self.pairs._pair_from_row(row, lazy_pair=self._lazy_pair)
         return self.valid_pair(pair)
 
+    @staticmethod
+    def _column(columns, name):
+        return columns[name].astype(np.int64)
+
+    @staticmethod
+    def _same_chromosome(columns):
+        """
+        Vectorised :func:`~FragmentReadPair.is_same_chromosome`.
+        """
+        return columns['left_fragment_chromosome'] == columns['right_fragment_chromosome']
+
+    @staticmethod
+    def _same_fragment(columns):
+        """
+        Vectorised :func:`~FragmentReadPair.is_same_fragment`.
+        """
+        return np.logical_and(FragmentReadPairFilter._same_chromosome(columns),
+                              columns['left_fragment_start'] == columns['right_fragment_start'])
+
+    @staticmethod
+    def _gap_size(columns):
+        """
+        Vectorised :func:`~FragmentReadPair.get_gap_size`.
+
+        Unlike the original, returns a gap for pairs on different chromosomes,
+        which must therefore be excluded separately.
+        """
+        gap = (FragmentReadPairFilter._column(columns, 'right_fragment_start') -
+               FragmentReadPairFilter._column(columns, 'left_fragment_end'))
+        gap[gap == 1] = 0  # neighboring fragments
+        gap[FragmentReadPairFilter._same_fragment(columns)] = 0
+        return gap
+
+    @staticmethod
+    def _facing(columns, left_strand, right_strand):
+        return np.logical_and(FragmentReadPairFilter._same_chromosome(columns),
+                              np.logical_and(columns['left_read_strand'] == left_strand,
+                                             columns['right_read_strand'] == right_strand))
+
 
 class InwardPairsFilter(FragmentReadPairFilter):
     """
@@ -2446,6 +2851,10 @@ class InwardPairsFilter(FragmentReadPairFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        inward = self._facing(columns, 1, -1)
+        return ~np.logical_and(inward, self._gap_size(columns) <= self.minimum_distance)
+
 
 class PCRDuplicateFilter(FragmentReadPairFilter):
     """
@@ -2468,62 +2877,128 @@ class PCRDuplicateFilter(FragmentReadPairFilter):
         FragmentReadPairFilter.__init__(self, mask=mask)
         self.threshold = threshold
         self.pairs = pairs
-        self.duplicates_set = set()
         self.duplicate_stats = defaultdict(int)
         original_len = 0
+        duplicate_ixs = []
         for _, edge_table in self.pairs._iter_edge_tables():
             original_len += edge_table._original_len()
-            self._mark_duplicates(edge_table)
+            duplicate_ixs.append(self._find_table_duplicates(edge_table))
+        self.duplicate_ixs = np.sort(np.concatenate(duplicate_ixs)) if len(duplicate_ixs) > 0 \
+            else np.zeros(0, dtype=np.int64)
+        n_dups = len(self.duplicate_ixs)
 
-        n_dups = len(self.duplicates_set)
-        percent_dups = 1. * n_dups / original_len
+        percent_dups = 1. * n_dups / original_len if original_len > 0 else 0.
         logger.info("PCR duplicate stats: " +
                     "{} ({:.1%}) of pairs marked as duplicate. ".format(n_dups, percent_dups) +
                     " (multiplicity:occurances) " +
                     " ".join("{}:{}".format(k, v) for k, v in self.duplicate_stats.items()))
 
-    def _mark_duplicates(self, edge_table):
-        pairs = [
-            (
-                row['ix'],
-                row['left_fragment_chromosome'], row['right_fragment_chromosome'],
-                row['left_read_position'], row['right_read_position']
-             ) for row in edge_table._iter_visible_and_masked()
-        ]
-        pairs = sorted(pairs, key=lambda p: p[3])
-
-        current_positions = {}
-        current_duplicates = {}
-        for ix, left_chromosome, right_chromosome, left_position, right_position in pairs:
-            chromosomes = (left_chromosome, right_chromosome)
-
-            # case 1: no current duplicates
-            if current_positions.get(chromosomes) is None:
-                current_positions[chromosomes] = (left_position, right_position)
-                current_duplicates[chromosomes] = 1
-                continue
-
-            # case 2: found duplicate
-            if (abs(left_position - current_positions[chromosomes][0]) <= self.threshold and
-                    abs(right_position - current_positions[chromosomes][1]) <= self.threshold):
-                self.duplicates_set.add(ix)
-                current_duplicates[chromosomes] += 1
-                continue
-
-            # update statistics
-            if current_duplicates[chromosomes] > 1:
-                self.duplicate_stats[current_duplicates[chromosomes]] += 1
-
-            current_positions[chromosomes] = (left_position, right_position)
-            current_duplicates[chromosomes] = 1
+    def _find_duplicates(self, left_chromosomes, right_chromosomes,
+                         left_positions, right_positions):
+        """
+        Identify PCR duplicates among pairs.
+
+        Pairs are sorted by chromosome pair and left read position (ties
+        keep their original order). A pair is a duplicate if both read
+        positions are within threshold of the first pair of the current
+        group, otherwise it starts a new group. As pairs can only be
+        duplicates if their left read positions are close, the sorted
+        pairs are split into independent segments wherever the left
+        position jumps by more than threshold. Segments are then resolved
+        in parallel, one position within a segment at a time.
+
+        :return: tuple (duplicates, group_sizes), where duplicates is a
+                 boolean array in input order and group_sizes the sizes of
+                 all duplicate groups apart from the last group of each
+                 chromosome pair
+        """
+        n = len(left_positions)
+        duplicates = np.zeros(n, dtype=bool)
+        if n == 0:
+            return duplicates, np.zeros(0, dtype=np.int64)
+
+        order = np.lexsort((left_positions, right_chromosomes, left_chromosomes))
+        lc = left_chromosomes[order]
+        rc = right_chromosomes[order]
+        lp = left_positions[order].astype(np.int64)
+        rp = right_positions[order].astype(np.int64)
+
+        new_chromosome_pair = np.ones(n, dtype=bool)
+        new_chromosome_pair[1:] = np.logical_or(lc[1:] != lc[:-1], rc[1:] != rc[:-1])
+        segment_starts = np.flatnonzero(np.logical_or(new_chromosome_pair,
+                                                      np.r_[True, np.diff(lp) > self.threshold]))
+        segment_lengths = np.diff(np.r_[segment_starts, n])
+
+        # current group anchor of every segment
+        anchors = segment_starts.copy()
+        group_anchors = np.arange(n)
+        sorted_duplicates = np.zeros(n, dtype=bool)
+
+        by_length = np.argsort(-segment_lengths, kind='stable')
+        sorted_lengths = segment_lengths[by_length]
+        for offset in range(1, sorted_lengths[0] if len(sorted_lengths) > 0 else 0):
+            active = by_length[:np.searchsorted(-sorted_lengths, -offset, side='left')]
+            ixs = segment_starts[active] + offset
+            is_duplicate = np.logical_and(
+                np.abs(lp[ixs] - lp[anchors[active]]) <= self.threshold,
+                np.abs(rp[ixs] - rp[anchors[active]]) <= self.threshold
+            )
+            anchors[active[~is_duplicate]] = ixs[~is_duplicate]
+            sorted_duplicates[ixs] = is_duplicate
+            group_anchors[ixs] = anchors[active]
+
+        duplicates[order] = sorted_duplicates
+
+        # group statistics, the final group of a chromosome pair is not counted
+        group_starts = np.flatnonzero(~sorted_duplicates)
+        group_sizes = np.bincount(group_anchors, minlength=n)[group_starts]
+        last_in_chromosome_pair = np.r_[new_chromosome_pair[group_starts[1:]], True]
+        group_sizes = group_sizes[np.logical_and(~last_in_chromosome_pair, group_sizes > 1)]
+        return duplicates, group_sizes
+
+    def _find_table_duplicates(self, edge_table):
+        """
+        Find PCR duplicates in an edge table.
+
+        :return: numpy array with the ix of every duplicate pair in this table
+        """
+        if edge_table._original_len() == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        duplicates, group_sizes = self._find_duplicates(
+            edge_table.col('left_fragment_chromosome'),
+            edge_table.col('right_fragment_chromosome'),
+            edge_table.col('left_read_position'),
+            edge_table.col('right_read_position')
+        )
+
+        for multiplicity, count in zip(*np.unique(group_sizes, return_counts=True)):
+            self.duplicate_stats[int(multiplicity)] += int(count)
+
+        return edge_table.col('ix')[duplicates].astype(np.int64)
+
+    def _is_duplicate(self, ixs):
+        """
+        Vectorised lookup of pair indices in the sorted duplicate indices.
+        """
+        ixs = np.asarray(ixs, dtype=np.int64)
+        if len(self.duplicate_ixs) == 0:
+            return np.zeros(ixs.shape, dtype=bool)
+        positions = np.minimum(np.searchsorted(self.duplicate_ixs, ixs),
+                               len(self.duplicate_ixs) - 1)
+        return self.duplicate_ixs[positions] == ixs
+
+    def valid_chunk(self, columns):
+        return ~self._is_duplicate(columns['ix'])
+
+    def valid(self, row):
+        return not self._is_duplicate([row['ix']])[0]
 
     def valid_pair(self, pair):
         """
         Check if a pair is duplicated.
         """
-        if pair.ix in self.duplicates_set:
-            return False
-        return True
+        return not self._is_duplicate([pair.ix])[0]
 
 
 class OutwardPairsFilter(FragmentReadPairFilter):
@@ -2552,6 +3027,10 @@ class OutwardPairsFilter(FragmentReadPairFilter):
             return True
         return False
 
+    def valid_chunk(self, columns):
+        outward = self._facing(columns, -1, 1)
+        return ~np.logical_and(outward, self._gap_size(columns) <= self.minimum_distance)
+
 
 class ReDistanceFilter(FragmentReadPairFilter):
     """
@@ -2577,6 +3056,14 @@ class ReDistanceFilter(FragmentReadPairFilter):
 
         return True
 
+    def valid_chunk(self, columns):
+        distances = []
+        for side in ('left', 'right'):
+            position = self._column(columns, side + '_read_position')
+            distances.append(np.minimum(np.abs(position - self._column(columns, side + '_fragment_start')),
+                                        np.abs(position - self._column(columns, side + '_fragment_end'))))
+        return distances[0] + distances[1] <= self.maximum_distance
+
 
 class SelfLigationFilter(FragmentReadPairFilter):
     """
@@ -2594,3 +3081,6 @@ class SelfLigationFilter(FragmentReadPairFilter):
         if pair.is_same_fragment():
             return False
         return True
+
+    def valid_chunk(self, columns):
+        return ~self._same_fragment(columns)
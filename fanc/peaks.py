@@ -4,6 +4,7 @@ from .config import config
 from abc import abstractmethod, ABCMeta
 import numpy as np
 from scipy.stats import poisson
+from scipy.spatial import cKDTree
 from collections import defaultdict, OrderedDict
 import tables as t
 from .matrix import RegionMatrixTable, Edge, LazyEdge
@@ -11,8 +12,9 @@ from .general import MaskFilter
 import msgpack
 import msgpack_numpy
 import math
+import multiprocessing as mp
 import pandas as pd
-from .tools.general import RareUpdateProgressBar, pairwise
+from .tools.general import RareUpdateProgressBar, pairwise, str_to_int
 import warnings
 from future.utils import with_metaclass, viewitems
 from itertools import tee
@@ -49,6 +51,12 @@ try:
 except ImportError:
     has_gridmap = False
 
+try:
+    from multiprocessing import shared_memory
+    has_shared_memory = True
+except ImportError:
+    has_shared_memory = False
+
 
 class PeakInfo(RegionMatrixTable):
     """
@@ -390,6 +398,67 @@ class RaoPeakInfo(RegionMatrixTable):
                 radius = distance
         return x, y, radius
 
+    @staticmethod
+    def _merge_peak_clusters(sources, sinks, weights, max_distance):
+        """
+        Greedily cluster peaks around the highest remaining peak.
+
+        Starting from the highest remaining peak, the peak closest to the
+        cluster centroid is added to the cluster as long as its distance
+        to the centroid is at most max_distance plus the cluster radius.
+        A KD-tree restricts the search to peaks within that distance.
+
+        :param sources: array of peak sources (bins)
+        :param sinks: array of peak sinks (bins)
+        :param weights: array of peak weights
+        :param max_distance: Maximal distance in bins to still consider
+                             two peaks to be the same
+        :return: list of (members, x, y, radius) tuples, one for each
+                 cluster. members are peak indices, starting with the
+                 highest peak in the cluster, x and y are centroid
+                 coordinates, and radius is the maximal distance of
+                 a member to the centroid (all in bins)
+        """
+        sources = np.asarray(sources, dtype=np.float64)
+        sinks = np.asarray(sinks, dtype=np.float64)
+        tree = cKDTree(np.column_stack([sources, sinks]))
+        remaining = np.ones(len(sources), dtype=bool)
+
+        clusters = []
+        with RareUpdateProgressBar(max_value=len(sources), silent=config.hide_progressbars,
+                                   prefix="Peak merge") as pb:
+            for highest_peak in np.argsort(-np.asarray(weights), kind='stable'):
+                if not remaining[highest_peak]:
+                    continue
+                remaining[highest_peak] = False
+
+                members = [highest_peak]
+                x, y, radius = sources[highest_peak], sinks[highest_peak], 0.
+                while True:
+                    # small tolerance so that rounding cannot exclude peaks at the boundary
+                    search_radius = (max_distance + radius) * (1 + 1e-9)
+                    candidates = np.sort(np.array(tree.query_ball_point([x, y], search_radius),
+                                                  dtype=np.int64))
+                    candidates = candidates[remaining[candidates]]
+                    if len(candidates) == 0:
+                        break
+
+                    distances = np.sqrt((x - sources[candidates])**2 + (y - sinks[candidates])**2)
+                    closest = np.argmin(distances)
+                    if distances[closest] > max_distance + radius:
+                        break
+
+                    closest_peak = candidates[closest]
+                    remaining[closest_peak] = False
+                    members.append(closest_peak)
+
+                    x = np.sum(sources[members]) / len(members)
+                    y = np.sum(sinks[members]) / len(members)
+                    radius = np.max(np.sqrt((x - sources[members])**2 + (y - sinks[members])**2))
+                clusters.append((members, x, y, radius))
+                pb.update(len(sources) - np.sum(remaining))
+        return clusters
+
     def merged_peaks(self, file_name=None, euclidian_distance=20000):
         """
         Merge spatially proximal peaks.
@@ -403,17 +472,8 @@ class RaoPeakInfo(RegionMatrixTable):
         merged_peaks.add_regions(self.regions(lazy=True), preserve_attributes=False)
 
         bin_size = self.bin_size
-
-        def _append_merged_peak(peak_list):
-            # add merged peak
-            hp = peak_list[0]
-            q_value_sum = hp.fdr_ll + hp.fdr_d + hp.fdr_h + hp.fdr_v
-            oe = 1 if hp.e_d == 0 else hp.weight/hp.e_d
-            merged_peak = Peak(source=hp.source, sink=hp.sink, weight=hp.weight,
-                               uncorrected=hp.uncorrected, expected_local=hp.e_d,
-                               p_value=hp.fdr_d, q_value_sum=q_value_sum, x=x, y=y,
-                               radius=radius, oe=oe)
-            merged_peaks.add_edge(merged_peak)
+        fields = ['source', 'sink', 'weight', 'uncorrected', 'e_d',
+                  'fdr_ll', 'fdr_d', 'fdr_h', 'fdr_v']
 
         merged_peak_counter = 0
         chromosome_names = self.chromosomes()
@@ -421,61 +481,33 @@ class RaoPeakInfo(RegionMatrixTable):
             for j in range(i, len(chromosome_names)):
                 chromosome_name2 = chromosome_names[j]
 
-                remaining_peaks_set = set()
-                for peak in self.edge_subset((chromosome_name1, chromosome_name2), lazy=False):
-                    remaining_peaks_set.add(peak)
-
-                if len(remaining_peaks_set) == 0:
+                row_regions, col_regions = self._key_to_regions((chromosome_name1, chromosome_name2),
+                                                                lazy=False)
+                peaks = dict(zip(fields, self._edge_subset_arrays(list(row_regions), list(col_regions),
+                                                                  fields)))
+                if len(peaks['source']) == 0:
                     continue
 
                 logger.info("Merging peaks in %s/%s" % (chromosome_name1, chromosome_name2))
-
-                last_peak_number = 0
-                current_peaks = []
-                n_remaining = len(remaining_peaks_set)
-                with RareUpdateProgressBar(max_value=n_remaining, silent=config.hide_progressbars,
-                                           prefix="Peak merge") as pb:
-                    while len(remaining_peaks_set) > 0:
-                        x, y, radius = RaoPeakInfo._centroid_and_radius(current_peaks)
-
-                        if len(current_peaks) == last_peak_number:
-                            if len(current_peaks) > 0:
-                                _append_merged_peak(current_peaks)
-                                current_peaks = []
-                                last_peak_number = 0
-                                merged_peak_counter += 1
-
-                            # find highest peak
-                            highest_peak = None
-                            for peak in remaining_peaks_set:
-                                if highest_peak is None:
-                                    highest_peak = peak
-                                else:
-                                    if highest_peak.weight < peak.weight:
-                                        highest_peak = peak
-
-                            current_peaks.append(highest_peak)
-                            remaining_peaks_set.remove(highest_peak)
-                        else:
-                            last_peak_number = len(current_peaks)
-
-                            closest_peak = None
-                            closest_distance = None
-                            for peak in remaining_peaks_set:
-                                distance = RaoPeakInfo._euclidian_distance(x, y, peak.source, peak.sink)
-                                if closest_peak is None or distance < closest_distance:
-                                    closest_peak = peak
-                                    closest_distance = distance
-
-                            if closest_distance*bin_size <= euclidian_distance+(radius*bin_size):
-                                current_peaks.append(closest_peak)
-                                remaining_peaks_set.remove(closest_peak)
-
-                        pb.update(n_remaining-len(remaining_peaks_set))
-
-                if len(current_peaks) > 0:
-                    _append_merged_peak(current_peaks)
-                    merged_peak_counter += 1
+                clusters = RaoPeakInfo._merge_peak_clusters(peaks['source'], peaks['sink'], peaks['weight'],
+                                                            euclidian_distance / bin_size)
+
+                # highest peaks represent merged peaks
+                hp = {field: values[[members[0] for members, _, _, _ in clusters]].astype(np.float64)
+                      for field, values in peaks.items()}
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    oe = np.where(hp['e_d'] == 0, 1, hp['weight'] / hp['e_d'])
+                merged_peaks._add_edge_arrays(dict(
+                    source=hp['source'].astype(np.int64), sink=hp['sink'].astype(np.int64),
+                    weight=hp['weight'], uncorrected=hp['uncorrected'],
+                    expected_local=hp['e_d'], p_value=hp['fdr_d'],
+                    q_value_sum=hp['fdr_ll'] + hp['fdr_d'] + hp['fdr_h'] + hp['fdr_v'],
+                    x=np.array([x for _, x, _, _ in clusters]),
+                    y=np.array([y for _, _, y, _ in clusters]),
+                    radius=np.array([radius for _, _, _, radius in clusters]),
+                    oe=oe
+                ))
+                merged_peak_counter += len(clusters)
 
         logger.info("Total merged peaks: {}".format(merged_peak_counter))
         merged_peaks.flush()
@@ -581,6 +613,11 @@ class PeakFilter(with_metaclass(ABCMeta, MaskFilter)):
         peak = LazyEdge(row)
         return self.valid_peak(peak)
 
+    @staticmethod
+    def _column(columns, name):
+        # compare in double precision, like values read from table rows
+        return columns[name].astype(np.float64)
+
 
 class ObservedPeakFilter(PeakFilter):
     """
@@ -606,6 +643,9 @@ class ObservedPeakFilter(PeakFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        return ~(self._column(columns, 'uncorrected') < self.cutoff)
+
 
 class DistancePeakFilter(PeakFilter):
     """
@@ -631,6 +671,10 @@ class DistancePeakFilter(PeakFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        distances = np.abs(columns['source'].astype(np.int64) - columns['sink'].astype(np.int64))
+        return ~(distances < self.cutoff)
+
 
 class FdrPeakFilter(PeakFilter):
     """
@@ -680,6 +724,14 @@ class FdrPeakFilter(PeakFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        valid = np.ones(len(columns), dtype=bool)
+        for field, cutoff in (('fdr_ll', self.fdr_ll_cutoff), ('fdr_h', self.fdr_h_cutoff),
+                              ('fdr_v', self.fdr_v_cutoff), ('fdr_d', self.fdr_d_cutoff)):
+            if cutoff is not None:
+                valid &= ~(self._column(columns, field) > cutoff)
+        return valid
+
 
 class MappabilityPeakFilter(PeakFilter):
     """
@@ -729,6 +781,16 @@ class MappabilityPeakFilter(PeakFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        valid = np.ones(len(columns), dtype=bool)
+        for field, cutoff in (('mappability_ll', self.mappability_ll_cutoff),
+                              ('mappability_h', self.mappability_h_cutoff),
+                              ('mappability_v', self.mappability_v_cutoff),
+                              ('mappability_d', self.mappability_d_cutoff)):
+            if cutoff is not None:
+                valid &= ~(self._column(columns, field) < cutoff)
+        return valid
+
 
 class EnrichmentPeakFilter(PeakFilter):
     """
@@ -778,6 +840,17 @@ class EnrichmentPeakFilter(PeakFilter):
             return False
         return True
 
+    def valid_chunk(self, columns):
+        valid = np.ones(len(columns), dtype=bool)
+        for field in ('e_d', 'e_ll', 'e_h', 'e_v'):
+            valid &= self._column(columns, field) != 0
+
+        for field, cutoff in (('oe_ll', self.enrichment_ll_cutoff), ('oe_h', self.enrichment_h_cutoff),
+                              ('oe_v', self.enrichment_v_cutoff), ('oe_d', self.enrichment_d_cutoff)):
+            if cutoff is not None:
+                valid &= ~(self._column(columns, field) < cutoff)
+        return valid
+
 
 class RaoPeakFilter(PeakFilter):
     """
@@ -822,6 +895,22 @@ class RaoPeakFilter(PeakFilter):
 
         return True
 
+    def valid_chunk(self, columns):
+        c = {field: self._column(columns, field)
+             for field in ('e_d', 'e_ll', 'e_h', 'e_v', 'oe_d', 'oe_ll', 'oe_h', 'oe_v',
+                           'fdr_d', 'fdr_ll', 'fdr_h', 'fdr_v')}
+
+        invalid = (c['e_d'] == 0) | (c['e_ll'] == 0) | (c['e_h'] == 0) | (c['e_v'] == 0)
+        # 1.
+        invalid |= (c['oe_d'] <= c['oe_ll']) & (c['oe_ll'] < 2.0)
+        # 2.
+        invalid |= (c['oe_h'] < 1.5) & (c['oe_v'] < 1.5)
+        # 3.
+        invalid |= (c['oe_d'] < 1.75) | (c['oe_ll'] < 1.75)
+        # 4.
+        invalid |= (c['fdr_d'] > .1) | (c['fdr_ll'] > .1) | (c['fdr_h'] > .1) | (c['fdr_v'] > .1)
+        return ~invalid
+
 
 class RaoMergedPeakFilter(PeakFilter):
     """
@@ -839,6 +928,10 @@ class RaoMergedPeakFilter(PeakFilter):
 
         return True
 
+    def valid_chunk(self, columns):
+        return ~((self._column(columns, 'radius') == 0) &
+                 (self._column(columns, 'q_value_sum') > self.cutoff))
+
 
 class FdrSumFilter(PeakFilter):
     """
@@ -854,6 +947,9 @@ class FdrSumFilter(PeakFilter):
 
         return True
 
+    def valid_chunk(self, columns):
+        return ~(self._column(columns, 'q_value_sum') > self.cutoff)
+
 
 class RaoPeakCaller(object):
     """
@@ -891,7 +987,8 @@ class RaoPeakCaller(object):
 
     def __init__(self, p=None, w_init=None, min_locus_dist=None, max_w=20, min_ll_reads=16,
                  process_inter=False, correct_inter='fdr', n_processes=4,
-                 slice_size=2000, min_mappable_fraction=0.7, cluster=False):
+                 slice_size=2000, min_mappable_fraction=0.7, cluster=False,
+                 max_distance=None):
         """
         Initialize RaoPeakCaller with peak calling parameters.
 
@@ -909,6 +1006,12 @@ class RaoPeakCaller(object):
         :param slice_size: length of the matrix square investigated by each process.
         :param cluster: If True, attempts to call peaks using an SGE cluster. If False,
                         will use multiprocessing.
+        :param max_distance: Maximum distance between loop anchors in base pairs,
+                             e.g. '5mb'. Peak calling is restricted to a band of
+                             this width along the diagonal, so memory usage grows
+                             with the band area rather than the squared chromosome
+                             size. If None, all intra-chromosomal pixels are
+                             investigated.
         """
         self.p = p
         self.w_init = w_init
@@ -925,6 +1028,7 @@ class RaoPeakCaller(object):
         self.slice_size = slice_size
         self.min_mappable_fraction = min_mappable_fraction
         self.cluster = cluster
+        self.max_distance = str_to_int(str(max_distance)) if max_distance is not None else None
         if self.cluster is True:
             if not has_gridmap:
                 logger.warning("Cannot use the cluster because of previous error.")
@@ -1037,6 +1141,28 @@ class RaoPeakCaller(object):
             return None
         return max(0, int(v) + 1)
 
+    @staticmethod
+    def find_chunks(values, chunk_func=lambda x: 3*np.log2(x)):
+        """
+        Vectorised version of :func:`~RaoPeakCaller.find_chunk`.
+
+        :param values: array of expected values
+        :param chunk_func: function mapping values to (fractional) chunks
+        :return: tuple (chunks, valid) of arrays, where valid is False
+                 for values without a matching lambda chunk
+        """
+        values = np.asarray(values, dtype=np.float64)
+        chunks = np.zeros(values.shape, dtype=np.int64)
+        valid = np.logical_not(np.isnan(values))
+        large = np.logical_and(valid, values >= 1)
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            v = chunk_func(values[large])
+        finite = np.isfinite(v)
+        chunks[large] = np.maximum(0, np.trunc(np.where(finite, v, 0)).astype(np.int64) + 1)
+        valid[large] = finite
+        return chunks, valid
+
     def _process_jobs(self, jobs, peaks, observed_chunk_distribution):
         """
         Process the output from :func:`~process_matrix_range` and save in peak table.
@@ -1054,78 +1180,98 @@ class RaoPeakCaller(object):
 
         for compressed_results in job_outputs:
             results = msgpack.loads(compressed_results, strict_map_key=False)
-            for result in results:
-                found_none = False
-                for value in result:
-                    if value is None:
-                        found_none = True
-                if found_none:
-                    continue
-
-                source, sink, weight, w_corr, p, observed, \
-                    ll_sum, e_ll, e_v, e_h, e_d, \
-                    o_chunk, e_ll_chunk, e_v_chunk, e_h_chunk, e_d_chunk, \
-                    e_ll_mappable, e_v_mappable, e_h_mappable, e_d_mappable = result
-
-                # update observed distribution
-                observed_chunk_distribution['ll'][e_ll_chunk][observed] += 1
-                observed_chunk_distribution['h'][e_h_chunk][observed] += 1
-                observed_chunk_distribution['v'][e_v_chunk][observed] += 1
-                observed_chunk_distribution['d'][e_d_chunk][observed] += 1
-
-                if weight == 0.0:
-                    continue
+            self._process_results(results, peaks, observed_chunk_distribution)
 
-                oe_ll = 1 if e_ll == 0 else weight / e_ll
-                oe_h = 1 if e_h == 0 else weight / e_h
-                oe_v = 1 if e_v == 0 else weight / e_v
-                oe_d = 1 if e_d == 0 else weight / e_d
-
-                peak = Edge(source=source, sink=sink,
-                            weight=weight, uncorrected=observed,
-                            w=w_corr, p=p, ll_sum=ll_sum,
-                            e_ll=e_ll, e_h=e_h, e_v=e_v, e_d=e_d,
-                            oe_ll=oe_ll, oe_h=oe_h, oe_v=oe_v, oe_d=oe_d,
-                            e_ll_chunk=e_ll_chunk, e_v_chunk=e_v_chunk,
-                            e_h_chunk=e_h_chunk, e_d_chunk=e_d_chunk,
-                            mappability_ll=e_ll_mappable, mappability_v=e_v_mappable,
-                            mappability_h=e_h_mappable, mappability_d=e_d_mappable)
-                peaks.add_edge(peak)
+    @staticmethod
+    def _process_results(results, peaks, observed_chunk_distribution):
+        """
+        Save the output of :func:`~process_matrix_segment_intra` in peak table.
+
+        :param results: list of peak information arrays (columns) for
+                        all investigated pixels of a matrix segment
+        :param peaks: :class:`~RaoPeakInfo` object
+        :param observed_chunk_distribution: dict with the distribution of
+                                            observed values per lambda chunk
+                                            (2D array of counts) for each
+                                            neighborhood type
+        """
+        source, sink, weight, w_corr, p, observed, \
+            ll_sum, e_ll, e_v, e_h, e_d, \
+            o_chunk, e_ll_chunk, e_v_chunk, e_h_chunk, e_d_chunk, \
+            e_ll_mappable, e_v_mappable, e_h_mappable, e_d_mappable = results
+
+        if len(source) == 0:
+            return
+
+        # update observed distribution
+        for e_type, e_chunk in (('ll', e_ll_chunk), ('h', e_h_chunk), ('v', e_v_chunk), ('d', e_d_chunk)):
+            observed_chunk_distribution[e_type] = _add_chunk_observed_counts(
+                observed_chunk_distribution[e_type], e_chunk, observed)
+
+        nonzero = weight != 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            oe_ll = np.where(e_ll == 0, 1, weight / e_ll)
+            oe_h = np.where(e_h == 0, 1, weight / e_h)
+            oe_v = np.where(e_v == 0, 1, weight / e_v)
+            oe_d = np.where(e_d == 0, 1, weight / e_d)
+
+        peak_arrays = dict(source=source, sink=sink,
+                           weight=weight, uncorrected=observed,
+                           w=w_corr, p=p, ll_sum=ll_sum,
+                           e_ll=e_ll, e_h=e_h, e_v=e_v, e_d=e_d,
+                           oe_ll=oe_ll, oe_h=oe_h, oe_v=oe_v, oe_d=oe_d,
+                           e_ll_chunk=e_ll_chunk, e_v_chunk=e_v_chunk,
+                           e_h_chunk=e_h_chunk, e_d_chunk=e_d_chunk,
+                           mappability_ll=e_ll_mappable, mappability_v=e_v_mappable,
+                           mappability_h=e_h_mappable, mappability_d=e_d_mappable)
+        peaks._add_edge_arrays({field: values[nonzero] for field, values in peak_arrays.items()})
 
     @staticmethod
     def _get_fdr_cutoffs(observed_chunk_distribution, e_func=lambda x: 2**(x/3)):
         """
         For all possible observed values in each lambda chunk, determine the
         FDR cutoff that denotes the lower significance bound.
-        """
-        # determine all possible observed values
 
+        :param observed_chunk_distribution: dict of neighborhood type -> 2D array
+                                            with counts of observed values (columns)
+                                            in each lambda chunk (rows)
+        :param e_func: function returning the maximum expected value of a chunk
+        :return: dict of neighborhood type -> 2D array of FDR cutoffs, indexed by
+                 lambda chunk and observed value
+        """
         fdr_cutoffs = dict()
-        for e_type in observed_chunk_distribution:  # ll, h, v, d
-            fdr_cutoffs[e_type] = defaultdict(lambda: defaultdict(int))
-            for chunk in observed_chunk_distribution[e_type].keys():
-                max_e = e_func(chunk)
-                poisson_e = poisson(max_e)
-
-                observed_sum = 0
-                for observed_count in observed_chunk_distribution[e_type][chunk].values():
-                    observed_sum += observed_count
-
-                observed_distribution_integral_left = 0
-                for observed in sorted(observed_chunk_distribution[e_type][chunk].keys()):
-                    observed_count = observed_chunk_distribution[e_type][chunk][observed]
-                    observed_distribution_integral_left += observed_count/observed_sum
-                    observed_distribution_integral_right = 1 - observed_distribution_integral_left
-                    poisson_integral_right = 1 - poisson_e.cdf(observed)
-
-                    if observed_distribution_integral_right > 0:
-                        integral_ratio = poisson_integral_right/observed_distribution_integral_right
-                        fdr_cutoff = min(1, integral_ratio)
-                        fdr_cutoffs[e_type][chunk][observed] = fdr_cutoff
-                    else:
-                        fdr_cutoffs[e_type][chunk][observed] = 0
+        for e_type, distribution in observed_chunk_distribution.items():  # ll, h, v, d
+            distribution = np.asarray(distribution, dtype=np.float64)
+            n_chunks, n_observed = distribution.shape
+            max_e = e_func(np.arange(n_chunks))
+            observed = np.arange(n_observed)
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                observed_sum = distribution.sum(axis=1)
+                observed_distribution_integral_left = np.cumsum(distribution / observed_sum[:, None], axis=1)
+                observed_distribution_integral_right = 1 - observed_distribution_integral_left
+                poisson_integral_right = poisson.sf(observed[None, :], max_e[:, None])
+                integral_ratio = poisson_integral_right / observed_distribution_integral_right
+
+            fdr = np.where(observed_distribution_integral_right > 0, np.minimum(1, integral_ratio), 0)
+            # only observed values have an FDR cutoff
+            fdr[distribution == 0] = 0
+            fdr_cutoffs[e_type] = fdr
         return fdr_cutoffs
 
+    @staticmethod
+    def _fdr_lookup(fdr_cutoffs, chunks, observed):
+        """
+        Look up FDR cutoffs for arrays of lambda chunks and observed values.
+
+        Combinations outside the FDR table are assigned an FDR of 1.
+        """
+        fdr = np.ones(len(chunks))
+        in_table = np.logical_and.reduce([chunks >= 0, chunks < fdr_cutoffs.shape[0],
+                                          observed >= 0, observed < fdr_cutoffs.shape[1]])
+        fdr[in_table] = fdr_cutoffs[chunks[in_table], observed[in_table]]
+        return fdr
+
     @staticmethod
     def segment_matrix_intra(m, chunk_size, w_max):
         for i in range(0, m.shape[0], chunk_size):
@@ -1141,34 +1287,100 @@ class RaoPeakCaller(object):
                 ms = m[i_start:i_end, j_start:j_end]
                 yield ms, i_range, i_inspect, j_range, j_inspect
 
-    def _find_peaks_intra_matrix(self, m, e, c, peak_info, mappable, ix_offset,
-                                 observed_chunk_distribution, w, p):
-        """
-        Given a matrix (strictly intra-chromosomal), calculate peak
-        information for all pixels.
+    @staticmethod
+    def segment_band_intra(n, chunk_size, w_max, max_locus_dist=None):
         """
+        Split a band of max_locus_dist bins along the diagonal of an
+        n x n matrix into overlapping segments.
 
-        jobs = []
-        for segment in RaoPeakCaller.segment_matrix_intra(m, self.slice_size, self.max_w):
-            ms, i_range, i_inspect, j_range, j_inspect = segment
+        :return: iterator over (i_range, i_inspect, j_range, j_inspect) tuples,
+                 see :func:`~RaoPeakCaller.segment_matrix_intra`
+        """
+        if max_locus_dist is None:
+            max_locus_dist = n
 
-            args = [ms, e, ix_offset,
-                    i_range, i_inspect, mappable[i_range[0]:i_range[1]], c[i_range[0]:i_range[1]],
-                    j_range, j_inspect, mappable[j_range[0]:j_range[1]], c[j_range[0]:j_range[1]],
-                    w, p, self.min_locus_dist, self.min_ll_reads, self.min_mappable_fraction,
-                    self.max_w]
+        for i in range(0, n, chunk_size):
+            i_range = (max(0, i - w_max), min(i + chunk_size + w_max, n))
+            i_inspect = (i, min(i + chunk_size, n))
+            for j in range(i, min(n, i + chunk_size + max_locus_dist), chunk_size):
+                j_range = (max(0, j - w_max), min(j + chunk_size + w_max, n))
+                j_inspect = (j, min(j + chunk_size, n))
+                yield i_range, i_inspect, j_range, j_inspect
 
-            args = msgpack.dumps(args)
-            job = gridmap.Job(process_matrix_segment_intra, [args])
-            jobs.append(job)
+    def _find_peaks_intra_band(self, hic, chromosome, e, c, mappable, peak_info,
+                               observed_chunk_distribution, w, p, pool=None):
+        """
+        Given an intra-chromosomal matrix, calculate peak information for all
+        pixels in a band along the diagonal.
 
-            # submit intermediate segments if maximum number of jobs reached
-            if len(jobs) >= self.n_processes:
-                self._process_jobs(jobs, peak_info, observed_chunk_distribution)
-                jobs = []
+        The band is assembled from sparse edges and processed in overlapping
+        segments. If a process pool is provided, band, expected values, bias
+        and mappability vectors are placed in shared memory, where workers
+        can access them without serialisation. Otherwise segments are
+        submitted as gridmap jobs.
+        """
+        start, end = hic.chromosome_bins[chromosome]
+        n = end - start
+        max_locus_dist = n if self.max_distance is None else self.max_distance // hic.bin_size
+        # neighborhoods extend up to 2*max_w bins beyond the pixel distance
+        band_width = max(1, min(n, max_locus_dist + 2 * self.max_w + 1))
 
-        if len(jobs) > 0:
-            self._process_jobs(jobs, peak_info, observed_chunk_distribution)
+        shared = dict()
+        try:
+            arrays = dict()
+            descriptors = dict()
+            for name, shape, dtype in (('band', (n, band_width), np.float64),
+                                       ('e', (len(e),), np.float64),
+                                       ('c', (n,), np.float64),
+                                       ('mappable', (n,), bool)):
+                if pool is not None:
+                    shared[name], arrays[name], descriptors[name] = _shared_array(shape, dtype)
+                else:
+                    arrays[name] = np.zeros(shape, dtype=dtype)
+            arrays['e'][:] = e
+            arrays['c'][:] = c
+            arrays['mappable'][:] = mappable
+            _fill_intra_band(hic, chromosome, arrays['band'])
+
+            segments = list(RaoPeakCaller.segment_band_intra(n, self.slice_size, self.max_w,
+                                                             max_locus_dist))
+            parameters = [w, p, self.min_locus_dist, self.min_ll_reads, self.min_mappable_fraction,
+                          self.max_w, max_locus_dist]
+
+            with RareUpdateProgressBar(max_value=len(segments), prefix='Segments',
+                                       silent=config.hide_progressbars) as pb:
+                if pool is not None:
+                    tasks = [[descriptors, start] + list(segment) + parameters for segment in segments]
+                    for i, results in enumerate(pool.imap(process_band_segment_intra, tasks)):
+                        self._process_results(results, peak_info, observed_chunk_distribution)
+                        pb.update(i)
+                else:
+                    jobs = []
+                    for i, (i_range, i_inspect, j_range, j_inspect) in enumerate(segments):
+                        ms = _band_segment(arrays['band'], i_range, j_range)
+                        args = [ms, arrays['e'], start,
+                                i_range, i_inspect, arrays['mappable'][i_range[0]:i_range[1]],
+                                arrays['c'][i_range[0]:i_range[1]],
+                                j_range, j_inspect, arrays['mappable'][j_range[0]:j_range[1]],
+                                arrays['c'][j_range[0]:j_range[1]]] + parameters
+
+                        args = msgpack.dumps(args)
+                        job = gridmap.Job(process_matrix_segment_intra, [args])
+                        jobs.append(job)
+
+                        # submit intermediate segments if maximum number of jobs reached
+                        if len(jobs) >= self.n_processes:
+                            self._process_jobs(jobs, peak_info, observed_chunk_distribution)
+                            jobs = []
+                        pb.update(i)
+
+                    if len(jobs) > 0:
+                        self._process_jobs(jobs, peak_info, observed_chunk_distribution)
+        finally:
+            arrays = None
+            for shm in shared.values():
+                shm.close()
+                shm.unlink()
 
     def call_peaks(self, hic, chromosome_pairs=None, file_name=None, intra_expected=None, inter_expected=None):
         """
@@ -1246,7 +1458,7 @@ class RaoPeakCaller(object):
         # lambda chunks container
         observed_chunk_distribution = dict()
         for e_type in ('ll', 'h', 'v', 'd'):
-            observed_chunk_distribution[e_type] = defaultdict(lambda: defaultdict(int))
+            observed_chunk_distribution[e_type] = np.zeros((0, 0), dtype=np.int64)
 
         # start processing chromosome pairs
         if chromosome_pairs is None:
@@ -1258,56 +1470,51 @@ class RaoPeakCaller(object):
                     chromosome2 = chromosomes[j_chr]
                     chromosome_pairs.append((chromosome1, chromosome2))
 
+        # segments are processed in a local process pool using shared
+        # memory, unless they are submitted to a cluster
+        pool = None
+        if has_shared_memory and not self.cluster:
+            pool = mp.get_context("spawn").Pool(self.n_processes)
+
         chromosome_bins = hic.chromosome_bins
-        for chromosome1, chromosome2 in chromosome_pairs:
-            logger.info("Processing %s-%s" % (chromosome1, chromosome2))
-
-            start1, end1 = chromosome_bins[chromosome1]
-            ix_offset = start1
-            start2, end2 = chromosome_bins[chromosome2]
-            if chromosome1 == chromosome2:
-                m = hic.matrix((chromosome1, chromosome2))
-                self._find_peaks_intra_matrix(m, intra_expected[chromosome1], c[start1:end1],
-                                              peaks, mappable[start1:end1], ix_offset,
-                                              observed_chunk_distribution, w_init, p)
-            elif self.process_inter:
-                warnings.warn("Inter-chromosomal peak calling not currently supported!")
-                # self._find_peaks_inter_matrix(m, inter_expected, c[start1:end1], c[start2:end2],
-                #                              peaks, mappable[start1:end1], mappable[start2:end2],
-                #                              None, None, w_init, p)
+        try:
+            for chromosome1, chromosome2 in chromosome_pairs:
+                logger.info("Processing %s-%s" % (chromosome1, chromosome2))
+
+                start1, end1 = chromosome_bins[chromosome1]
+                start2, end2 = chromosome_bins[chromosome2]
+                if chromosome1 == chromosome2:
+                    self._find_peaks_intra_band(hic, chromosome1, intra_expected[chromosome1],
+                                                c[start1:end1], mappable[start1:end1], peaks,
+                                                observed_chunk_distribution, w_init, p, pool=pool)
+                elif self.process_inter:
+                    warnings.warn("Inter-chromosomal peak calling not currently supported!")
+                    # self._find_peaks_inter_matrix(m, inter_expected, c[start1:end1], c[start2:end2],
+                    #                              peaks, mappable[start1:end1], mappable[start2:end2],
+                    #                              None, None, w_init, p)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
         peaks.flush()
 
         # calculate fdrs
         logger.info("Finding FDR cutoffs...")
         fdr_cutoffs = RaoPeakCaller._get_fdr_cutoffs(observed_chunk_distribution)
 
-        # regions_dict = peaks.regions_dict
-        with RareUpdateProgressBar(max_value=len(peaks.edges), prefix='FDR') as pb:
-            for i, peak in enumerate(peaks.peaks(lazy=True, writable=True)):
-                # region1 = regions_dict[peak.source]
-                # region2 = regions_dict[peak.sink]
-                # if region1.chromosome == region2.chromosome:
-                try:
-                    peak.fdr_ll = fdr_cutoffs['ll'][peak.e_ll_chunk][peak.uncorrected]
-                    peak.fdr_h = fdr_cutoffs['h'][peak.e_h_chunk][peak.uncorrected]
-                    peak.fdr_v = fdr_cutoffs['v'][peak.e_v_chunk][peak.uncorrected]
-                    peak.fdr_d = fdr_cutoffs['d'][peak.e_d_chunk][peak.uncorrected]
-                except KeyError:
-                    peak.fdr_ll = 1
-                    peak.fdr_h = 1
-                    peak.fdr_v = 1
-                    peak.fdr_d = 1
-                peak.update()
-
+        edge_tables = list(peaks._iter_edge_tables())
+        with RareUpdateProgressBar(max_value=len(edge_tables), prefix='FDR',
+                                   silent=config.hide_progressbars) as pb:
+            for i, (_, edge_table) in enumerate(edge_tables):
+                if edge_table._original_len() == 0:
+                    continue
+                observed = edge_table.col('uncorrected')
+                for e_type in ('ll', 'h', 'v', 'd'):
+                    chunks = edge_table.col('e_{}_chunk'.format(e_type))
+                    fdr = RaoPeakCaller._fdr_lookup(fdr_cutoffs[e_type], chunks, observed)
+                    edge_table.modify_column(colname='fdr_{}'.format(e_type), column=fdr)
+                edge_table.flush(update_index=False)
                 pb.update(i)
-                # else:
-                #     # Bonferroni correction
-                #     if self.correct_inter == 'bonferroni':
-                #         peak.fdr_ll *= inter_possible
-                #         peak.fdr_h *= inter_possible
-                #         peak.fdr_v *= inter_possible
-                #         peak.fdr_d *= inter_possible
-                #         peak.update()
         peaks.flush()
 
         # if self.process_inter and self.correct_inter == 'fdr':
@@ -1347,98 +1554,405 @@ class RaoPeakCaller(object):
         return peaks
 
 
-def process_matrix_segment_intra(data):
-    m_original, e, ix_offset, \
-        i_range, i_inspect, mappable_i, c_i, \
-        j_range, j_inspect, mappable_j, c_j, \
-        w, p, min_locus_dist, min_ll_reads, min_mappable, \
-        max_w = msgpack.loads(data, strict_map_key=False)
+def _clip_rect(rect, n_rows, n_cols):
+    """
+    Clip rectangle bounds [r0, r1) x [c0, c1) to a matrix of the given shape.
+    """
+    r0, r1, c0, c1 = rect
+    r0 = np.clip(r0, 0, n_rows)
+    r1 = np.maximum(np.clip(r1, 0, n_rows), r0)
+    c0 = np.clip(c0, 0, n_cols)
+    c1 = np.maximum(np.clip(c1, 0, n_cols), c0)
+    return r0, r1, c0, c1
+
+
+def _summed_area_table(m):
+    """
+    Summed-area table of a matrix, padded with a leading row and column of zeros,
+    so that sat[r, c] is the sum of m[:r, :c].
+    """
+    sat = np.zeros((m.shape[0] + 1, m.shape[1] + 1), dtype=np.result_type(m.dtype, np.int64))
+    np.cumsum(m, axis=0, out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def _rect_sum(sat, rect):
+    """
+    Sum of the rectangle [r0, r1) x [c0, c1) from a summed-area table.
+    Bounds can be arrays, in which case one sum per entry is returned.
+    """
+    r0, r1, c0, c1 = _clip_rect(rect, sat.shape[0] - 1, sat.shape[1] - 1)
+    return sat[r1, c1] - sat[r0, c1] - sat[r1, c0] + sat[r0, c0]
+
+
+def _neighborhood_rects(neighborhood, i, j, w, p):
+    """
+    Rectangles that make up a neighborhood of the pixels (i, j), as used by
+    :func:`~RaoPeakCaller.e_ll_sum`, :func:`~RaoPeakCaller.e_h_sum`,
+    :func:`~RaoPeakCaller.e_v_sum` and :func:`~RaoPeakCaller.e_d_sum`.
+    The first rectangle is added, all others are subtracted.
+    """
+    if neighborhood == 'll':
+        return [(i + 1, i + w + 1, j - w, j),
+                (i + 1, i + p + 1, j - p, j)]
+    if neighborhood == 'h':
+        return [(i - 1, i + 2, j - w, j + w + 1),
+                (i - 1, i + 2, j - p, j + p + 1)]
+    if neighborhood == 'v':
+        return [(i - w, i + w + 1, j - 1, j + 2),
+                (i - p, i + p + 1, j - 1, j + 2)]
+    if neighborhood == 'd':
+        return [(i - w, i + w + 1, j - w, j + w + 1),
+                (i - p, i + p + 1, j - p, j + p + 1),
+                (i - w, i - p, j, j + 1),
+                (i + p + 1, i + w + 1, j, j + 1),
+                (i, i + 1, j - w, j - p),
+                (i, i + 1, j + p + 1, j + w + 1)]
+    raise ValueError("Unknown neighborhood type: {}".format(neighborhood))
+
+
+def _neighborhood_sum(sats, valid_sat, neighborhood, i, j, w, p, masked=False):
+    """
+    Sum of matrix values in the neighborhoods of the pixels (i, j).
+
+    :param sats: Tuple of summed-area tables of the matrix (with masked
+                 pixels set to 0) and of its non-zero pixels
+    :param valid_sat: Summed-area table of the unmasked pixels
+    :param masked: If True, behave like the per-pixel sums on a masked matrix:
+                   lower-left, horizontal and vertical sums are NaN if one of
+                   their rectangles contains no unmasked pixel, while such
+                   rectangles contribute 0 to the donut sum.
+    """
+    sat, nonzero_sat = sats
+    total, nonzero = 0., 0
+    invalid = np.zeros(len(i), dtype=bool)
+    for k, rect in enumerate(_neighborhood_rects(neighborhood, i, j, w, p)):
+        sign = 1 if k == 0 else -1
+        total = total + sign * _rect_sum(sat, rect)
+        nonzero = nonzero + sign * _rect_sum(nonzero_sat, rect)
+        invalid |= _rect_sum(valid_sat, rect) == 0
+
+    # neighborhoods without data sum to exactly 0, free of rounding noise
+    total = np.where(nonzero == 0, 0., total)
+    if masked and neighborhood != 'd':
+        total[invalid] = np.nan
+    return total
+
+
+def _neighborhood_mappability(valid_sat, neighborhood, i, j, w, p):
+    """
+    Fraction of mappable pixels in the neighborhoods of the pixels (i, j).
+    """
+    n_rows, n_cols = valid_sat.shape[0] - 1, valid_sat.shape[1] - 1
+    area, unmappable = 0, 0
+    for k, rect in enumerate(_neighborhood_rects(neighborhood, i, j, w, p)):
+        r0, r1, c0, c1 = _clip_rect(rect, n_rows, n_cols)
+        rect_area = (r1 - r0) * (c1 - c0)
+        rect_unmappable = rect_area - _rect_sum(valid_sat, rect)
+        sign = 1 if k == 0 else -1
+        area = area + sign * rect_area
+        unmappable = unmappable + sign * rect_unmappable
 
-    m_original = np.array(m_original)
-    # construct convenient matrices
-    row_ixs = np.arange(i_range[0], i_range[1])
-    col_ixs = np.arange(j_range[0], j_range[1])
     with np.errstate(divide='ignore', invalid='ignore'):
-        m_uncorrected = np.rint(m_original/c_i[:, None]/c_j)
-    m_distance = np.array([abs(col_ixs - i) for i in row_ixs])
-    expected_f = np.vectorize(lambda x: e[x])
-    m_expected = expected_f(m_distance)
+        return 1 - unmappable / area
 
-    # mask above matrices by mappability
-    mask = np.zeros(m_original.shape, dtype=bool)
-    mask[np.logical_not(mappable_i)] = True
-    mask[:, np.logical_not(mappable_j)] = True
 
-    m_original = np.ma.masked_where(mask, m_original)
-    m_uncorrected = np.ma.masked_where(mask, m_uncorrected)
-    m_expected = np.ma.masked_where(mask, m_expected)
-    m_ones = np.ones(m_original.shape)
+def _add_chunk_observed_counts(distribution, chunks, observed):
+    """
+    Add pixels to a distribution of observed values per lambda chunk.
 
-    results = []
-    for o_i in range(i_inspect[0], i_inspect[1]):
-        i = o_i - i_range[0]
-        for o_j in range(j_inspect[0], j_inspect[1]):
-            j = o_j - j_range[0]
+    :param distribution: 2D array of counts, indexed by chunk and observed value
+    :param chunks: array of lambda chunks
+    :param observed: array of (uncorrected) observed values
+    :return: 2D array of counts, enlarged if necessary
+    """
+    if len(chunks) == 0:
+        return distribution
 
-            # only inspect pixels at a certain distance
-            # above the diagonal
-            if o_j - o_i < p + min_locus_dist:
-                continue
+    shape = (max(distribution.shape[0], int(np.max(chunks)) + 1),
+             max(distribution.shape[1], int(np.max(observed)) + 1))
+    if shape != distribution.shape:
+        enlarged = np.zeros(shape, dtype=distribution.dtype)
+        enlarged[:distribution.shape[0], :distribution.shape[1]] = distribution
+        distribution = enlarged
 
-            # only inspect mappable pixels
-            if mask[i, j]:
-                continue
+    np.add.at(distribution, (chunks, observed), 1)
+    return distribution
 
-            # only inspect pixels if they have more than
-            # a minimum number of reads
-            w_corr = w
-            ll_sum = 0
-            while ll_sum < min_ll_reads and w_corr <= max_w:
-                ll_sum = RaoPeakCaller.ll_sum(m_uncorrected, i, j, w=w_corr, p=p)
-                if np.ma.is_masked(ll_sum):
-                    ll_sum = 0
-                w_corr += 1
-
-            if w_corr > max_w:
-                continue
 
-            # calculate mappability and enrichment values
-            ll_mappable = 1 - RaoPeakCaller.e_ll_sum(mask, i, j, w, p) / RaoPeakCaller.e_ll_sum(m_ones, i, j, w, p)
-            if ll_mappable < min_mappable:
-                continue
-            e_ll = RaoPeakCaller.e_ll(m_original, i, j, m_expected, w=w_corr, p=p)
+def _shared_array(shape, dtype):
+    """
+    Create a zero-filled array backed by shared memory.
 
-            v_mappable = 1 - RaoPeakCaller.e_v_sum(mask, i, j, w, p) / RaoPeakCaller.e_v_sum(m_ones, i, j, w, p)
-            if v_mappable < min_mappable:
-                continue
-            e_v = RaoPeakCaller.e_v(m_original, i, j, m_expected, w=w_corr, p=p)
+    :return: tuple (SharedMemory, array, descriptor). Pass the descriptor
+             to :func:`~_attach_shared_arrays` to access the array in
+             another process. The caller is responsible for closing and
+             unlinking the SharedMemory.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    array[...] = 0
+    return shm, array, (shm.name, tuple(shape), dtype.str)
 
-            h_mappable = 1 - RaoPeakCaller.e_h_sum(mask, i, j, w, p) / RaoPeakCaller.e_h_sum(m_ones, i, j, w, p)
-            if h_mappable < min_mappable:
-                continue
-            e_h = RaoPeakCaller.e_h(m_original, i, j, m_expected, w=w_corr, p=p)
 
-            d_mappable = 1 - RaoPeakCaller.e_d_sum(mask, i, j, w, p) / RaoPeakCaller.e_d_sum(m_ones, i, j, w, p)
-            if d_mappable < min_mappable:
-                continue
-            e_d = RaoPeakCaller.e_d(m_original, i, j, m_expected, w=w_corr, p=p)
+_attached_shared_arrays = dict()
+
+
+def _attach_shared_arrays(descriptors):
+    """
+    Access arrays created with :func:`~_shared_array` from a worker process.
+
+    Shared memory from previous calls that is no longer referenced
+    by descriptors is released.
+
+    :param descriptors: dict of array name -> shared array descriptor
+    :return: dict of array name -> array
+    """
+    shm_names = set(descriptor[0] for descriptor in descriptors.values())
+    for shm_name in list(_attached_shared_arrays.keys()):
+        if shm_name not in shm_names:
+            shm, array = _attached_shared_arrays.pop(shm_name)
+            del array
+            shm.close()
+
+    arrays = dict()
+    for name, (shm_name, shape, dtype) in descriptors.items():
+        if shm_name not in _attached_shared_arrays:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            _attached_shared_arrays[shm_name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        arrays[name] = _attached_shared_arrays[shm_name][1]
+    return arrays
+
+
+def _fill_intra_band(hic, chromosome, band):
+    """
+    Fill a band along the diagonal of an intra-chromosomal matrix from sparse edges.
+
+    band[i, d] receives the normalised weight of the edge between the
+    i-th and (i+d)-th bin of the chromosome. Edges outside the band are ignored.
+    """
+    start, _ = hic.chromosome_bins[chromosome]
+    band_width = band.shape[1]
+    try:
+        edge_arrays = hic.edges_arrays((chromosome, chromosome), norm=True, check_valid=False)
+        for sources, sinks, weights in edge_arrays:
+            distances = sinks - sources
+            in_band = distances < band_width
+            band[sources[in_band] - start, distances[in_band]] = weights[in_band]
+    except NotImplementedError:
+        for edge in hic.edges((chromosome, chromosome), norm=True, lazy=True):
+            distance = edge.sink - edge.source
+            if distance < band_width:
+                band[edge.source - start, distance] = edge.weight
+
+
+def _band_segment(band, i_range, j_range):
+    """
+    Dense segment of a symmetric matrix stored as a band along its diagonal.
+
+    Matrix entries outside the band are 0.
+    """
+    rows, cols = np.meshgrid(np.arange(i_range[0], i_range[1]),
+                             np.arange(j_range[0], j_range[1]), indexing='ij')
+    distances = np.abs(cols - rows)
+    in_band = distances < band.shape[1]
+    m = np.zeros(rows.shape)
+    m[in_band] = band[np.minimum(rows, cols)[in_band], distances[in_band]]
+    return m
+
 
-            # find chunks
-            cf = c_i[i] * c_j[j]
-            o_chunk = RaoPeakCaller.find_chunk(m_uncorrected[i, j])
-            e_ll_chunk = RaoPeakCaller.find_chunk(e_ll/cf)
-            e_h_chunk = RaoPeakCaller.find_chunk(e_h/cf)
-            e_v_chunk = RaoPeakCaller.find_chunk(e_v/cf)
-            e_d_chunk = RaoPeakCaller.find_chunk(e_d/cf)
+def process_band_segment_intra(args):
+    """
+    Calculate peak information for a segment of a band in shared memory.
+
+    :param args: list of shared array descriptors, index offset of the
+                 chromosome, segment ranges, and peak calling parameters
+    :return: list of peak information arrays, see
+             :func:`~process_matrix_segment_intra`
+    """
+    descriptors, ix_offset, i_range, i_inspect, j_range, j_inspect = args[:6]
+    arrays = _attach_shared_arrays(descriptors)
+    m = _band_segment(arrays['band'], i_range, j_range)
+    mappable, c = arrays['mappable'], arrays['c']
+    return _process_segment_intra(m, arrays['e'], ix_offset,
+                                  i_range, i_inspect, mappable[i_range[0]:i_range[1]],
+                                  c[i_range[0]:i_range[1]],
+                                  j_range, j_inspect, mappable[j_range[0]:j_range[1]],
+                                  c[j_range[0]:j_range[1]],
+                                  *args[6:])
+
+
+def process_matrix_segment_intra(data):
+    """
+    Calculate peak information for a msgpack-serialised matrix segment.
+
+    :return: msgpack-serialised list of peak information arrays, one for
+             each of source, sink, weight, w, p, uncorrected, ll_sum,
+             e_ll, e_v, e_h, e_d, observed chunk, e_ll_chunk, e_v_chunk,
+             e_h_chunk, e_d_chunk, mappability_ll, mappability_v,
+             mappability_h, and mappability_d
+    """
+    return msgpack.dumps(_process_segment_intra(*msgpack.loads(data, strict_map_key=False)))
+
+
+def _process_segment_intra(m_original, e, ix_offset,
+                           i_range, i_inspect, mappable_i, c_i,
+                           j_range, j_inspect, mappable_j, c_j,
+                           w, p, min_locus_dist, min_ll_reads, min_mappable,
+                           max_w, max_locus_dist=None):
+    m_original = np.array(m_original, dtype=np.float64)
+    e = np.array(e, dtype=np.float64)
+    c_i = np.array(c_i, dtype=np.float64)
+    c_j = np.array(c_j, dtype=np.float64)
+
+    # construct convenient matrices
+    row_ixs = np.arange(i_range[0], i_range[1])
+    col_ixs = np.arange(j_range[0], j_range[1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m_uncorrected = np.rint(m_original/c_i[:, None]/c_j)
+    m_expected = e[np.abs(col_ixs[None, :] - row_ixs[:, None])]
+
+    # mask above matrices by mappability
+    mask = np.zeros(m_original.shape, dtype=bool)
+    mask[np.logical_not(mappable_i)] = True
+    mask[:, np.logical_not(mappable_j)] = True
+    has_mask = mask.any()
+
+    # summed-area tables for all neighborhood sums
+    valid_sat = _summed_area_table(~mask)
+    sats = dict()
+    for name, m in (('original', m_original), ('uncorrected', m_uncorrected), ('expected', m_expected)):
+        m = np.where(mask | np.logical_not(np.isfinite(m)), 0, m)
+        sats[name] = (_summed_area_table(m), _summed_area_table(m != 0))
+
+    # inspected pixels, in row-major order
+    i, j = np.meshgrid(np.arange(i_inspect[0], i_inspect[1]) - i_range[0],
+                       np.arange(j_inspect[0], j_inspect[1]) - j_range[0], indexing='ij')
+    i, j = i.ravel(), j.ravel()
+
+    # only inspect mappable pixels at a certain distance above the diagonal
+    distances = (j + j_range[0]) - (i + i_range[0])
+    valid = np.logical_and(distances >= p + min_locus_dist, np.logical_not(mask[i, j]))
+    if max_locus_dist is not None:
+        valid &= distances <= max_locus_dist
+    i, j = i[valid], j[valid]
+
+    # only inspect pixels if they have more than a minimum number
+    # of reads, widening the lower-left neighborhood up to max_w
+    w_corr = np.full(len(i), w, dtype=np.int64)
+    ll_sum = np.zeros(len(i))
+    if min_ll_reads > 0:
+        found = np.zeros(len(i), dtype=bool)
+        for w_try in range(w, max_w):
+            todo = np.where(np.logical_not(found))[0]
+            if len(todo) == 0:
+                break
+            s = _neighborhood_sum(sats['uncorrected'], valid_sat, 'll', i[todo], j[todo],
+                                  w_try, p, masked=has_mask)
+            s[np.isnan(s)] = 0
+            ll_sum[todo] = s
+            w_corr[todo] = w_try + 1
+            found[todo] = s >= min_ll_reads
+        valid = found
+    else:
+        valid = np.full(len(i), w <= max_w, dtype=bool)
+    i, j, w_corr, ll_sum = i[valid], j[valid], w_corr[valid], ll_sum[valid]
+
+    # calculate mappability
+    mappability = dict()
+    valid = np.ones(len(i), dtype=bool)
+    for neighborhood in ('ll', 'v', 'h', 'd'):
+        mappability[neighborhood] = _neighborhood_mappability(valid_sat, neighborhood, i, j, w, p)
+        valid &= np.logical_not(mappability[neighborhood] < min_mappable)
+    i, j, w_corr, ll_sum = i[valid], j[valid], w_corr[valid], ll_sum[valid]
+    mappability = {neighborhood: values[valid] for neighborhood, values in mappability.items()}
+
+    # calculate enrichment and find chunks
+    cf = c_i[i] * c_j[j]
+    o_chunk, valid = RaoPeakCaller.find_chunks(m_uncorrected[i, j])
+    enrichment, chunks = dict(), dict()
+    for neighborhood in ('ll', 'v', 'h', 'd'):
+        observed_sum = _neighborhood_sum(sats['original'], valid_sat, neighborhood,
+                                         i, j, w_corr, p, masked=has_mask)
+        expected_sum = _neighborhood_sum(sats['expected'], valid_sat, neighborhood,
+                                         i, j, w_corr, p, masked=has_mask)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            enrichment[neighborhood] = observed_sum / expected_sum * m_expected[i, j]
+            chunks[neighborhood], valid_chunk = RaoPeakCaller.find_chunks(enrichment[neighborhood] / cf)
+        valid &= valid_chunk
+
+    i, j, w_corr, ll_sum, o_chunk = i[valid], j[valid], w_corr[valid], ll_sum[valid], o_chunk[valid]
+    enrichment = {neighborhood: values[valid] for neighborhood, values in enrichment.items()}
+    chunks = {neighborhood: values[valid] for neighborhood, values in chunks.items()}
+    mappability = {neighborhood: values[valid] for neighborhood, values in mappability.items()}
+
+    columns = [i + i_range[0] + ix_offset, j + j_range[0] + ix_offset, m_original[i, j],
+               w_corr, np.full(len(i), p), m_uncorrected[i, j].astype(np.int64), ll_sum.astype(np.int64),
+               enrichment['ll'], enrichment['v'], enrichment['h'], enrichment['d'],
+               o_chunk, chunks['ll'], chunks['v'], chunks['h'], chunks['d'],
+               mappability['ll'], mappability['v'], mappability['h'], mappability['d']]
+    return columns
+
+
+def _overlap_peak_clusters(x, y, max_distance):
+    """
+    Cluster peak centroids for :func:`~overlap_peaks`.
+
+    Peaks are processed in the order given. Each cluster is seeded with
+    the first remaining peak. Subsequent remaining peaks are added in
+    order if their distance to the current cluster centroid is at most
+    max_distance plus the cluster radius. A KD-tree restricts the
+    search to peaks within that distance.
+
+    :param x: array of peak centroid x coordinates (bins)
+    :param y: array of peak centroid y coordinates (bins)
+    :param max_distance: Maximum distance between peaks for overlap (bins)
+    :return: list of (members, x, y, radius) tuples, one for each
+             cluster, where members is a list of peak indices in
+             the order they were added to the cluster
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    tree = cKDTree(np.column_stack([x, y]))
+    remaining = np.ones(len(x), dtype=bool)
 
-            result = [o_i + ix_offset, o_j + ix_offset, float(m_original.data[i, j]), w_corr, p,
-                      int(m_uncorrected.data[i, j]),
-                      int(ll_sum), e_ll, e_v, e_h, e_d,
-                      o_chunk, e_ll_chunk, e_v_chunk, e_h_chunk, e_d_chunk,
-                      ll_mappable, v_mappable, h_mappable, d_mappable]
+    clusters = []
+    with RareUpdateProgressBar(max_value=len(x), silent=config.hide_progressbars,
+                               prefix="Overlap") as pb:
+        for seed in range(len(x)):
+            if not remaining[seed]:
+                continue
+            remaining[seed] = False
 
-            results.append(result)
-    return msgpack.dumps(results)
+            members = [seed]
+            cur_x, cur_y, r = x[seed], y[seed], 0.
+            cluster_radius = max_distance
+            while True:
+                # small tolerance so that rounding cannot exclude peaks at the boundary
+                search_radius = cluster_radius * (1 + 1e-9)
+                candidates = np.array(tree.query_ball_point([cur_x, cur_y], search_radius), dtype=np.int64)
+                # peaks before the last added peak have already been considered
+                candidates = candidates[remaining[candidates] & (candidates > members[-1])]
+                distances = np.sqrt((cur_x - x[candidates])**2 + (cur_y - y[candidates])**2)
+                candidates = candidates[distances <= cluster_radius]
+                if len(candidates) == 0:
+                    break
+
+                next_peak = np.min(candidates)
+                remaining[next_peak] = False
+                members.append(next_peak)
+
+                # running mean
+                cur_x += (x[next_peak] - cur_x) / len(members)
+                cur_y += (y[next_peak] - cur_y) / len(members)
+                r = np.max(np.sqrt((cur_x - x[members])**2 + (cur_y - y[members])**2))
+                cluster_radius = max_distance + r
+            clusters.append((members, cur_x, cur_y, r))
+            pb.update(len(x) - np.sum(remaining))
+    return clusters
 
 
 def overlap_peaks(peaks, max_distance=6000):
@@ -1461,34 +1975,13 @@ def overlap_peaks(peaks, max_distance=6000):
     # blob/cb5999cb1e8e430dd29d4114fb208aca4b8d35ac/src/juicebox/
     # tools/utils/juicer/hiccups/HiCCUPSUtils.java#L235
 
-    def key_func(p):
-        try:
-            return p[1].weight
-        except AttributeError:
-            return 1
-
-    def hypotenuse(x, y):
-        return math.sqrt(x*x + y*y)
-
-    def mean(data):
-        # https://stackoverflow.com/a/31062966
-        n = 0
-        mean = 0.0
-        for x in data:
-            n += 1
-            mean += (x - mean)/n
-        if n < 1:
-            return float("nan")
-        else:
-            return mean
-
     summarize_attrs = [
-        (mean, "weight"),
-        (mean, "oe"),
-        (mean, "uncorrected"),
-        (mean, "expected_local"),
-        (sum, "p_value"),
-        (sum, "q_value_sum"),
+        ("mean", "weight"),
+        ("mean", "oe"),
+        ("mean", "uncorrected"),
+        ("mean", "expected_local"),
+        ("sum", "p_value"),
+        ("sum", "q_value_sum"),
     ]
 
     if not all(a == b for regions in zip(peaks.values()) for a, b in pairwise(regions)):
@@ -1499,57 +1992,77 @@ def overlap_peaks(peaks, max_distance=6000):
     max_distance = max_distance/bin_size
     logger.info("Fetching and sorting peaks...")
 
-    all_peaks = list(sorted(((s, p) for s, pgen in viewitems(peaks) for p in pgen),
-                            key=key_func, reverse=True))
+    samples = list(peaks.keys())
+    fields = ['x', 'y', 'weight'] + [attr for _, attr in summarize_attrs[1:]]
+    sample_ixs = [np.zeros(0, dtype=int)]
+    peak_arrays = {field: [np.zeros(0)] for field in fields}
+    for sample_ix, sample in enumerate(samples):
+        for _, rows in peaks[sample]._iter_edge_table_chunks():
+            sample_ixs.append(np.full(len(rows), sample_ix))
+            for field in fields:
+                if field == 'weight' and field not in rows.dtype.names:
+                    # peaks without weight are ranked equally
+                    peak_arrays[field].append(np.ones(len(rows)))
+                else:
+                    peak_arrays[field].append(rows[field])
+    sample_ixs = np.concatenate(sample_ixs)
+    peak_arrays = {field: np.concatenate(arrays) for field, arrays in peak_arrays.items()}
+
+    # highest peaks first, ties keep input order
+    order = np.argsort(-peak_arrays['weight'], kind='stable')
+    sample_ixs = sample_ixs[order]
+    peak_arrays = {field: array[order] for field, array in peak_arrays.items()}
 
     logger.info("Done.")
     logger.info("Finding overlaps...")
+    clusters = _overlap_peak_clusters(peak_arrays['x'], peak_arrays['y'], max_distance)
+
+    # cluster members in the order they were added, padded with -1
+    max_members = max([len(members) for members, _, _, _ in clusters], default=0)
+    member_matrix = np.full((len(clusters), max_members), -1, dtype=np.int64)
+    for i, (members, _, _, _) in enumerate(clusters):
+        member_matrix[i, :len(members)] = members
+
+    summed_attrs = {}
+    for sum_func, attr in summarize_attrs:
+        values = np.zeros(len(clusters))
+        for k in range(max_members):
+            has_member = member_matrix[:, k] >= 0
+            member_values = peak_arrays[attr][member_matrix[has_member, k]].astype(np.float64)
+            if sum_func == "mean":
+                # running mean
+                values[has_member] += (member_values - values[has_member]) / (k + 1)
+            else:
+                values[has_member] += member_values
+        summed_attrs[attr] = values
+
+    cons_x = np.array([x for _, x, _, _ in clusters], dtype=np.float64)
+    cons_y = np.array([y for _, _, y, _ in clusters], dtype=np.float64)
+    cons_peaks = dict(
+        x=cons_x,
+        y=cons_y,
+        radius=np.array([r for _, _, _, r in clusters], dtype=np.float64),
+        source=np.floor(np.minimum(cons_x, cons_y)).astype(np.int64),
+        sink=np.floor(np.maximum(cons_x, cons_y)).astype(np.int64),
+        **summed_attrs
+    )
+
     out_peaks = defaultdict(list)
-    total_n = len(all_peaks)
+    for i, (members, _, _, _) in enumerate(clusters):
+        out_peaks[frozenset(samples[ix] for ix in sample_ixs[members])].append(i)
 
-    with RareUpdateProgressBar(max_value=total_n, silent=config.hide_progressbars,
-                               prefix="Overlap") as pb:
-        while len(all_peaks) > 0:
-            cur_p = all_peaks.pop(0)
-            cur_p_list = [cur_p]
-            cur_x = cur_p[1].x
-            cur_y = cur_p[1].y
-            cluster_radius = max_distance
-            for p in all_peaks:
-                if hypotenuse(cur_x - p[1].x, cur_y - p[1].y) <= cluster_radius:
-                    cur_p_list.append(p)
-                    cur_x = mean(_p.x for _s, _p in cur_p_list)
-                    cur_y = mean(_p.y for _s, _p in cur_p_list)
-                    r = max(hypotenuse(cur_x - _p.x, cur_y - _p.y) for _s, _p in cur_p_list)
-                    cluster_radius = max_distance + r
-
-            summed_attrs = {}
-            for sum_func, attr in summarize_attrs:
-                summed_attrs[attr] = sum_func(getattr(p, attr) for s, p in cur_p_list)
-
-            cons_p = Peak(
-                x=cur_x,
-                y=cur_y,
-                radius=r if len(cur_p_list) > 1 else 0.,
-                source=math.floor(min(cur_x, cur_y)),
-                sink=math.floor(max(cur_x, cur_y)),
-                **summed_attrs
-            )
-            out_peaks[frozenset(s for s, p in cur_p_list)].append(cons_p)
-            for p in cur_p_list[1:]:
-                all_peaks.remove(p)
-            pb.update(total_n - len(all_peaks))
     logger.info("Done.")
     logger.info("Gathering overlapped peaks.")
     out_dict = {}
     out_stats = []
-    for sample_set, p_list in viewitems(out_peaks):
+    for sample_set, cluster_ixs in viewitems(out_peaks):
         pi = PeakInfo()
         pi.add_regions(peaks1.regions(), preserve_attributes=False)
-        pi.add_edges(p_list)
+        pi._add_edge_arrays({field: values[cluster_ixs] for field, values in cons_peaks.items()})
+        pi.flush()
         out_dict[sample_set] = pi
         stat = OrderedDict((s, s in sample_set) for s in peaks.keys())
-        stat["n"] = len(p_list)
+        stat["n"] = len(cluster_ixs)
         out_stats.append(stat)
     logger.info("Done.")
 
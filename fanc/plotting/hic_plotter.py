@@ -6,6 +6,9 @@ from fanc.plotting.helpers import append_axes, style_ticks_whitegrid
 from fanc.tools.general import str_to_int
 from genomic_regions import GenomicRegion, as_region
 from ..matrix import RegionMatrixTable, RegionMatrixContainer
+from ..hic import MultiResolutionHic
+from ..tools.files import hdf5_file_uri
+from ..tools.load import load
 from ..architecture.comparisons import SplitMatrix
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -16,6 +19,8 @@ from abc import ABCMeta
 import numpy as np
 from scipy.ndimage.filters import gaussian_filter
 import itertools as it
+import functools
+import weakref
 import types
 import seaborn as sns
 from future.utils import with_metaclass, string_types
@@ -29,12 +34,13 @@ logger = logging.getLogger(__name__)
 
 def prepare_hic_buffer(hic_data, buffering_strategy="relative", buffering_arg=1,
                        weight_field=None, default_value=None, smooth_sigma=None,
-                       norm=True, oe=False, log=False):
+                       norm=True, oe=False, log=False, resolution=None):
     """
     Prepare :class:`~BufferedMatrix` from hic data.
 
-    :param hic_data: :class:`~fanc.data.genomic.RegionMatrixTable` or
-                     :class:`~fanc.data.genomic.RegionMatrix`
+    :param hic_data: :class:`~fanc.data.genomic.RegionMatrixTable`,
+                     :class:`~fanc.data.genomic.RegionMatrix`, or
+                     :class:`~fanc.hic.MultiResolutionHic`
     :param buffering_strategy: "all", "fixed" or "relative"
                                "all" buffers the whole matrix
                                "fixed" buffers a fixed area, specified by buffering_arg
@@ -44,22 +50,179 @@ def prepare_hic_buffer(hic_data, buffering_strategy="relative", buffering_arg=1,
                                           the same amount upstream and downstream
                                           are buffered
     :param buffering_arg: Number specifying how much around the query area is buffered
+    :param resolution: Fixed resolution (bin size) of the buffered matrix.
+                       See :class:`~BufferedMatrix`
     """
-    if isinstance(hic_data, RegionMatrixContainer):
+    if isinstance(hic_data, (RegionMatrixContainer, MultiResolutionHic)):
         return BufferedMatrix(hic_data, buffering_strategy=buffering_strategy,
                               buffering_arg=buffering_arg, weight_field=weight_field,
                               default_value=default_value, smooth_sigma=smooth_sigma,
-                              norm=norm, oe=oe, log=log)
+                              norm=norm, oe=oe, log=log, resolution=resolution)
     else:
         raise ValueError("Unknown type for hic_data")
 
 
+def _resolution_sources(hic_data):
+    """
+    Find all resolutions in which the data of a Hi-C object is available.
+
+    Other resolutions are only found for :class:`~fanc.hic.MultiResolutionHic`
+    files (and :class:`~fanc.Hic` objects loaded from them), and
+    multi-resolution Cooler and Juicer files.
+
+    :param hic_data: :class:`~fanc.matrix.RegionMatrixContainer` or
+                     :class:`~fanc.hic.MultiResolutionHic`
+    :return: dict of {bin size: hic object or function opening it}
+    """
+    sources = dict()
+    if isinstance(hic_data, MultiResolutionHic):
+        for resolution in hic_data.resolutions():
+            sources[resolution] = functools.partial(hic_data.hic, resolution)
+        return sources
+
+    hdf5_file = getattr(hic_data, 'file', None)
+    hdf5_uri = hdf5_file_uri(hdf5_file) if hdf5_file is not None else None
+    if hdf5_uri is not None and hdf5_file.mode == 'r' and '::' in hdf5_uri:
+        file_name, group = hdf5_uri.split('::', 1)
+        if group.startswith(MultiResolutionHic.resolution_group('')):
+            with MultiResolutionHic(file_name, mode='r') as multi_resolution_hic:
+                for resolution in multi_resolution_hic.resolutions():
+                    sources[resolution] = functools.partial(load, file_name, resolution=resolution)
+
+    from ..compatibility.juicer import JuicerHic
+    if isinstance(hic_data, JuicerHic):
+        bp_resolutions, _ = hic_data.resolutions()
+        for resolution in bp_resolutions:
+            sources[resolution] = functools.partial(JuicerHic, hic_data._hic_file, resolution=resolution,
+                                                    norm=hic_data._normalisation)
+
+    try:
+        from ..compatibility.cooler import CoolerHic
+        from cooler.fileops import list_coolers
+        if isinstance(hic_data, CoolerHic) and hic_data.root.startswith('/resolutions/'):
+            for path in list_coolers(hic_data.filename):
+                if path.startswith('/resolutions/'):
+                    resolution = int(path.split('/')[-1])
+                    sources[resolution] = functools.partial(CoolerHic, hic_data.filename + '::' + path)
+    except ImportError:
+        pass
+
+    sources[hic_data.bin_size] = hic_data
+    return sources
+
+
+def _coarse_matrix(hic_data, key, bin_size, weight_field=None, default_value=None,
+                   norm=True, oe=False, log=False):
+    """
+    Assemble a matrix at a lower resolution than the native one of hic_data.
+
+    Matrix entries are obtained as sparse arrays and summarised in bins of
+    bin_size, so the matrix at native resolution is never built. Like
+    :func:`~fanc.Hic.bin`, each bin holds the sum of the native pixels it
+    contains, counting every pixel of the upper triangle once, so values
+    are on the same scale as stored lower resolutions of the same data.
+    O/E values are ratios and are therefore averaged instead.
+
+    :param hic_data: :class:`~fanc.matrix.RegionMatrixContainer`
+    :param key: Matrix selector. See :func:`~fanc.matrix.RegionMatrixContainer.matrix`
+    :param bin_size: Bin size of the returned matrix in base pairs
+    :return: :class:`~fanc.matrix.RegionMatrix`
+    """
+    if default_value is None:
+        default_value = hic_data._default_value
+    if oe:
+        default_value = 1.0
+
+    m, row_regions, col_regions = hic_data.sparse_matrix(key, norm=norm, oe=oe, format='coo',
+                                                         score_field=weight_field)
+
+    # number coarse bins consecutively across row and col regions,
+    # so that region indexes remain consistent for masking
+    bins = dict()
+    for region in sorted(list(row_regions) + list(col_regions), key=lambda r: r.ix):
+        bin_key = (region.chromosome, (region.start - 1) // bin_size)
+        if bin_key not in bins:
+            bins[bin_key] = GenomicRegion(chromosome=region.chromosome, start=region.start,
+                                          end=region.end, ix=len(bins), valid=False)
+        coarse_region = bins[bin_key]
+        coarse_region.start = min(coarse_region.start, region.start)
+        coarse_region.end = max(coarse_region.end, region.end)
+        coarse_region.valid = coarse_region.valid or getattr(region, 'valid', True)
+
+    def coarse_bins(regions):
+        ixs = np.array([bins[(r.chromosome, (r.start - 1) // bin_size)].ix for r in regions],
+                       dtype=np.int64)
+        native_ixs = np.array([r.ix for r in regions], dtype=np.int64)
+        valid = np.array([getattr(r, 'valid', True) for r in regions], dtype=bool)
+        if len(ixs) == 0:
+            return ixs, native_ixs, valid, 0, []
+        coarse_regions = [r for r in bins.values() if ixs[0] <= r.ix <= ixs[-1]]
+        return ixs - ixs[0], native_ixs, valid, ixs[0], sorted(coarse_regions, key=lambda r: r.ix)
+
+    row_ixs, row_native_ixs, row_valid, row_offset, coarse_row_regions = coarse_bins(row_regions)
+    col_ixs, col_native_ixs, col_valid, col_offset, coarse_col_regions = coarse_bins(col_regions)
+    shape = (len(coarse_row_regions), len(coarse_col_regions))
+
+    # in coarse bins on the diagonal, only count native pixels of the upper triangle
+    on_diagonal = row_ixs[m.row] + row_offset == col_ixs[m.col] + col_offset
+    upper = np.logical_or(~on_diagonal, row_native_ixs[m.row] <= col_native_ixs[m.col])
+    flat_ixs = row_ixs[m.row[upper]] * shape[1] + col_ixs[m.col[upper]]
+    n_entries = np.bincount(flat_ixs, minlength=shape[0] * shape[1]).reshape(shape)
+    sums = np.bincount(flat_ixs, weights=m.data[upper], minlength=shape[0] * shape[1]).reshape(shape)
+
+    # number of valid native pixels in every coarse bin
+    n_pixels = np.outer(np.bincount(row_ixs, weights=row_valid, minlength=shape[0]),
+                        np.bincount(col_ixs, weights=col_valid, minlength=shape[1]))
+    # on the diagonal, count valid (row, col) pairs with row <= col instead
+    n_native = max(np.max(row_native_ixs, initial=-1), np.max(col_native_ixs, initial=-1)) + 1
+    col_keys = np.sort((col_ixs + col_offset)[col_valid] * n_native + col_native_ixs[col_valid])
+    row_coarse = (row_ixs + row_offset)[row_valid]
+    n_upper = (np.searchsorted(col_keys, (row_coarse + 1) * n_native, side='left') -
+               np.searchsorted(col_keys, row_coarse * n_native + row_native_ixs[row_valid], side='left'))
+    diagonal_rows = np.unique(row_coarse)
+    diagonal_cols = diagonal_rows - col_offset
+    in_cols = np.logical_and(diagonal_cols >= 0, diagonal_cols < shape[1])
+    diagonal_rows, diagonal_cols = diagonal_rows[in_cols], diagonal_cols[in_cols]
+    n_pixels[diagonal_rows - row_offset, diagonal_cols] = np.bincount(
+        row_coarse - row_offset, weights=n_upper, minlength=shape[0])[diagonal_rows - row_offset]
+
+    coarse = np.full(shape, float(default_value))
+    if np.isnan(default_value):
+        # missing pixels have no value
+        has_pixels = n_entries > 0
+        coarse[has_pixels] = sums[has_pixels]
+        if oe:
+            coarse[has_pixels] /= n_entries[has_pixels]
+    else:
+        has_pixels = n_pixels > 0
+        coarse[has_pixels] = sums[has_pixels] + default_value * (n_pixels[has_pixels] - n_entries[has_pixels])
+        if oe:
+            coarse[has_pixels] /= n_pixels[has_pixels]
+
+    if log:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            coarse = np.log2(coarse)
+        coarse[~np.isfinite(coarse)] = default_value
+
+    return fanc.matrix.RegionMatrix(coarse, row_regions=coarse_row_regions,
+                                    col_regions=coarse_col_regions)
+
+
 class BufferedMatrix(object):
     """
     Buffer contents of any :class:`~fanc.Hic` like objects. Matrix is
     prefetched and stored in memory. Buffer contents can quickly be fetched
     from memory. Different buffering strategies allow buffering of nearby
     regions so that adjacent parts of the matrix can quickly be fetched.
+
+    When a large region is requested with a maximum number of bins (see
+    :func:`~BufferedMatrix.get_matrix`), the matrix is buffered at a lower
+    resolution: either from a coarser resolution of a multi-resolution file
+    (:class:`~fanc.hic.MultiResolutionHic`, multi-resolution Cooler, Juicer),
+    or by summing the sparse matrix entries in larger bins like
+    :func:`~fanc.Hic.bin`. Memory usage then depends on the number of
+    output bins rather than on the native resolution of the data.
+    Matrices at other resolutions are only opened while buffering.
     """
     _STRATEGY_ALL = "all"
     _STRATEGY_FIXED = "fixed"
@@ -67,7 +230,7 @@ class BufferedMatrix(object):
 
     def __init__(self, data, buffering_strategy="relative", buffering_arg=1,
                  weight_field=None, default_value=None, smooth_sigma=None,
-                 norm=True, oe=False, log=False):
+                 norm=True, oe=False, log=False, resolution=None):
         """
         Initialize a buffer for Matrix-like objects that support
         indexing using class:`~GenomicRegion` objects, such as class:`~fanc.Hic`
@@ -83,7 +246,21 @@ class BufferedMatrix(object):
                                               the same amount upstream and downstream
                                               are buffered
         :param buffering_arg: Number specifying how much around the query area is buffered
+        :param resolution: Fixed resolution (bin size) of the buffered matrix. If None
+                           (default), uses the native resolution of the data, unless
+                           a maximum number of bins is requested in
+                           :func:`~BufferedMatrix.get_matrix`
         """
+        self._sources = None
+        self._data_finalizer = None
+        if isinstance(data, MultiResolutionHic):
+            self._sources = _resolution_sources(data)
+            base_resolution = min(self._sources.keys())
+            data, opened = self._open_source(base_resolution)
+            if opened:
+                # keep the base resolution open for the lifetime of this buffer
+                self._sources[base_resolution] = data
+                self._data_finalizer = weakref.finalize(self, data.close)
         self.data = data
         if buffering_strategy not in self._BUFFERING_STRATEGIES:
             raise ValueError("Only support the buffering strategies {}".format(list(self._BUFFERING_STRATEGIES.keys())))
@@ -97,6 +274,9 @@ class BufferedMatrix(object):
         self.norm = norm
         self.oe = oe
         self.log = log
+        self.resolution = str_to_int(str(resolution)) if resolution is not None else None
+        self.buffered_resolution = None
+        self._buffer_source = (self.data, None)
 
     @classmethod
     def from_hic_matrix(cls, hic_matrix, weight_field=None, default_value=None,
@@ -113,8 +293,84 @@ class BufferedMatrix(object):
                  norm=norm, oe=oe, log=log)
         bm.buffered_region = bm._STRATEGY_ALL
         bm.buffered_matrix = hic_matrix
+        bm.buffered_resolution = (None, None)
         return bm
 
+    def _open_source(self, resolution):
+        """
+        Get the Hi-C object at the given resolution, opening it if necessary.
+
+        :return: tuple (Hi-C object, True if it was opened by this call
+                 and must be closed by the caller)
+        """
+        source = self._sources[resolution]
+        if isinstance(source, functools.partial):
+            return source(), True
+        return source, False
+
+    def _region_length(self, region):
+        if region.start is None or region.end is None:
+            return self.data.chromosome_lengths.get(region.chromosome, 0)
+        return region.end - region.start + 1
+
+    def _resolution(self, regions, max_bins=None):
+        """
+        Determine the resolution at which regions should be buffered.
+
+        Picks the coarsest available resolution that still provides at least
+        max_bins bins for the largest region. If no resolution is close
+        enough, the matrix will be coarsened on the fly by a power of 2.
+
+        :return: tuple (resolution of the source data, bin size of the buffered
+                 matrix); (None, None) for the native resolution of the data
+        """
+        if not isinstance(self.data, RegionMatrixContainer):
+            return None, None
+
+        target = self.resolution
+        if target is None:
+            if max_bins is None or max_bins < 1:
+                return None, None
+            target = int(np.ceil(max(self._region_length(r) for r in regions) / max_bins))
+
+        if self._sources is None:
+            self._sources = _resolution_sources(self.data)
+
+        resolutions = sorted(self._sources.keys())
+        finer_resolutions = [r for r in resolutions if r <= target]
+        source_resolution = finer_resolutions[-1] if len(finer_resolutions) > 0 else resolutions[0]
+
+        bin_size = source_resolution
+        if target >= 2 * source_resolution:
+            if self.resolution is not None:
+                bin_size = target
+            else:
+                bin_size = source_resolution * 2 ** int(np.log2(target / source_resolution))
+
+        if source_resolution == self.data.bin_size and bin_size == source_resolution:
+            return None, None
+        return source_resolution, bin_size
+
+    def _matrix(self, key):
+        source, bin_size = self._buffer_source
+        if bin_size is None or bin_size == source.bin_size:
+            return source.matrix(key, score_field=self.weight_field,
+                                 default_value=self.default_value,
+                                 norm=self.norm, oe=self.oe, log=self.log)
+        return _coarse_matrix(source, key, bin_size, weight_field=self.weight_field,
+                              default_value=self.default_value,
+                              norm=self.norm, oe=self.oe, log=self.log)
+
+    def close(self):
+        """
+        Close the Hi-C object opened by this buffer from a
+        :class:`~fanc.hic.MultiResolutionHic`, if any.
+
+        This also happens automatically when the buffer is garbage collected.
+        """
+        if self._data_finalizer is not None:
+            self._data_finalizer()
+
     def is_buffered_region(self, *regions):
         """
         Check if set of :class:`~GenomicRegion`s is already buffered in this matrix.
@@ -128,19 +384,39 @@ class BufferedMatrix(object):
             return False
         return True
 
-    def get_matrix(self, *regions):
+    def get_matrix(self, *regions, **kwargs):
         """
         Retrieve a sub-matrix by the given :class:`~GenomicRegion` object(s).
 
         Will automatically load data if a non-buffered region is requested.
 
         :param regions: :class:`~GenomicRegion` object(s)
+        :param max_bins: Maximum number of bins along each matrix axis,
+                         typically the width of the plot in pixels. If
+                         the regions contain more bins at the native
+                         resolution, a lower resolution is used
         :return: :class:`~HicMatrix`
         """
+        max_bins = kwargs.pop('max_bins', None)
         # regions = tuple(reversed([r for r in regions]))
-        if not self.is_buffered_region(*regions):
+        resolution = self._resolution(regions, max_bins=max_bins)
+        if resolution != self.buffered_resolution or not self.is_buffered_region(*regions):
             logger.debug("Buffering matrix")
-            self._BUFFERING_STRATEGIES[self.buffering_strategy](self, *regions)
+            source_resolution, bin_size = resolution
+            if source_resolution is None:
+                source, opened = self.data, False
+            else:
+                source, opened = self._open_source(source_resolution)
+                logger.debug("Using {}b resolution, bin size {}b".format(source_resolution, bin_size))
+            self._buffer_source = (source, bin_size)
+            try:
+                self.buffered_resolution = resolution
+                self._BUFFERING_STRATEGIES[self.buffering_strategy](self, *regions)
+            finally:
+                # the buffered matrix is in memory, other resolutions are no longer needed
+                self._buffer_source = (self.data, None)
+                if opened:
+                    source.close()
         m = self.buffered_matrix[tuple(regions)]
         if self.smooth_sigma is not None:
             mf = gaussian_filter(m, self.smooth_sigma)
@@ -157,10 +433,7 @@ class BufferedMatrix(object):
         :return: :class:`~HicMatrix`
         """
         self.buffered_region = self._STRATEGY_ALL
-        self.buffered_matrix = self.data.matrix(key=tuple([slice(0, None, None)]*len(regions)),
-                                                score_field=self.weight_field,
-                                                default_value=self.default_value,
-                                                norm=self.norm, oe=self.oe, log=self.log)
+        self.buffered_matrix = self._matrix(tuple([slice(0, None, None)]*len(regions)))
 
     def _buffer_relative(self, *regions):
         """
@@ -180,10 +453,7 @@ class BufferedMatrix(object):
                                                           chromosome=rq.chromosome))
             else:
                 self.buffered_region.append(GenomicRegion(start=None, end=None, chromosome=rq.chromosome))
-        self.buffered_matrix = self.data.matrix(tuple(self.buffered_region),
-                                                score_field=self.weight_field,
-                                                default_value=self.default_value,
-                                                norm=self.norm, oe=self.oe, log=self.log)
+        self.buffered_matrix = self._matrix(tuple(self.buffered_region))
 
     def _buffer_fixed(self, *regions):
         """
@@ -202,10 +472,7 @@ class BufferedMatrix(object):
                                                           chromosome=rq.chromosome))
             else:
                 self.buffered_region.append(GenomicRegion(start=None, end=None, chromosome=rq.chromosome))
-        self.buffered_matrix = self.data.matrix(tuple(self.buffered_region),
-                                                score_field=self.weight_field,
-                                                default_value=self.default_value,
-                                                norm=self.norm, oe=self.oe, log=self.log)
+        self.buffered_matrix = self._matrix(tuple(self.buffered_region))
 
     @property
     def buffered_min(self):
@@ -258,26 +525,49 @@ class BasePlotterHic(BasePlotterMatrix):
 
     def __init__(self, hic_data, adjust_range=False, buffering_strategy="relative",
                  buffering_arg=1, weight_field=None, default_value=None, smooth_sigma=None,
-                 matrix_norm=True, oe=False, log=False, **kwargs):
+                 matrix_norm=True, oe=False, log=False, resolution=None, **kwargs):
         """
         :param hic_data: Path to Hi-C data on disk or
                         :class:`~fanc.data.genomic.Hic` or :class:`~fanc.data.genomic.RegionMatrix`
         :param adjust_range: Draw a slider to adjust vmin/vmax interactively. Default: False
         :param buffering_strategy: A valid buffering strategy for :class:`~BufferedMatrix`
         :param buffering_arg: Adjust range of buffering for :class:`~BufferedMatrix`
+        :param resolution: Resolution of the plotted matrix. None (default) always
+                           uses the native resolution of the data. 'auto' uses
+                           a lower resolution if the plotted region contains more
+                           bins than the plot has pixels; each plotted pixel is then
+                           the mean of the native pixels it covers. A bin size
+                           (e.g. '50kb') plots the matrix at that resolution
         """
         super(BasePlotterHic, self).__init__(**kwargs)
         if isinstance(hic_data, string_types):
             hic_data = fanc.load(hic_data, mode="r")
-        self.hic_data = hic_data
+        self.auto_resolution = resolution == 'auto'
         self.hic_buffer = prepare_hic_buffer(hic_data, buffering_strategy=buffering_strategy,
                                              buffering_arg=buffering_arg, weight_field=weight_field,
                                              default_value=default_value, smooth_sigma=smooth_sigma,
-                                             norm=matrix_norm, oe=oe, log=log)
+                                             norm=matrix_norm, oe=oe, log=log,
+                                             resolution=None if self.auto_resolution else resolution)
+        self.hic_data = self.hic_buffer.data
         self.slider = None
         self.adjust_range = adjust_range
         self.vmax_slider = None
 
+    def _max_bins(self):
+        """
+        Largest number of matrix bins that can be displayed along the axes.
+
+        :return: int or None if the resolution should not be adjusted
+        """
+        if not self.auto_resolution or self.ax is None:
+            return None
+        bbox = self.ax.get_window_extent()
+        scale = 1.
+        savefig_dpi = mpl.rcParams['savefig.dpi']
+        if savefig_dpi != 'figure':
+            scale = max(1., float(savefig_dpi) / self.ax.figure.dpi)
+        return int(max(bbox.width, bbox.height) * scale)
+
 
 class SquareMatrixPlot(BasePlotterHic, BasePlotter2D):
     """
@@ -339,7 +629,7 @@ class SquareMatrixPlot(BasePlotterHic, BasePlotter2D):
 
     def _refresh(self, region):
         if region is not None:
-            self.current_matrix = self.hic_buffer.get_matrix(*region)
+            self.current_matrix = self.hic_buffer.get_matrix(*region, max_bins=self._max_bins())
         old_image = self.im
 
         m = np.transpose(self.current_matrix)
@@ -525,7 +815,7 @@ class TriangularMatrixPlot(BasePlotterHic, BasePlotter1D):
         self.ax.drag_pan = types.MethodType(drag_pan, self.ax)
 
     def _mesh_data(self, region):
-        hm = self.hic_buffer.get_matrix(region, region)
+        hm = self.hic_buffer.get_matrix(region, region, max_bins=self._max_bins())
         hm_copy = fanc.matrix.RegionMatrix(np.copy(hm), col_regions=hm.col_regions,
                                            row_regions=hm.row_regions)
         # update coordinates
@@ -69,7 +69,7 @@ import tables as t
 from Bio import SeqIO, Restriction, Seq
 from genomic_regions import RegionBased, GenomicRegion, load as gr_load
 from .general import FileGroup
-from .tools.files import is_fasta_file
+from .tools.files import is_fasta_file, hdf5_file_exists
 from .tools.general import create_col_index, str_to_int
 
 try:
@@ -469,9 +469,7 @@ class RegionsTable(RegionBasedWithBins, FileGroup):
         """
         self._regions_dirty = False
 
-        file_exists = False
-        if file_name is not None and os.path.exists(os.path.expanduser(file_name)):
-            file_exists = True
+        file_exists = hdf5_file_exists(file_name)
 
         FileGroup.__init__(self, _table_name_regions, file_name, mode=mode, tmpdir=tmpdir)
 
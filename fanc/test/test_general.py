@@ -138,6 +138,17 @@ class TestMaskedTable:
             if test['b'] < self.cutoff:
                 return False
             return True
+
+    class ExampleChunkFilter(MaskFilter):
+        def __init__(self, cutoff=10, mask=None):
+            super(TestMaskedTable.ExampleChunkFilter, self).__init__(mask=mask)
+            self.cutoff = cutoff
+
+        def valid(self, test):
+            raise AssertionError("Row mode should not be used")
+
+        def valid_chunk(self, columns):
+            return columns['c'] >= self.cutoff
             
     def setup_method(self, method):
         f = create_or_open_pytables_file()
@@ -205,6 +216,17 @@ class TestMaskedTable:
                 assert row[self.table._mask_index_field] == i
                 i += 1
             
+    def test_filter_chunks(self):
+        self.table.queue_filter(TestMaskedTable.ExampleFilter(cutoff=25))
+        self.table.queue_filter(TestMaskedTable.ExampleChunkFilter(cutoff=10, mask=1))
+        self.table._filter(self.table._queued_filters, chunk_size=7)
+
+        assert len(self.table) == 25
+        masks = self.table.col(self.table._mask_field)
+        assert np.array_equal(masks[:10], [3] * 10)
+        assert np.array_equal(masks[10:25], [1] * 15)
+        assert np.array_equal(masks[25:], [0] * 25)
+
     def test_masked(self):
         assert self.filtered_table.masked_rows()[0][1] == 0
         assert self.filtered_table.masked_rows()[-1][1] == 24
@@ -12,7 +12,8 @@ class TestAuto:
                            'AggregateMatrix', 'ComparisonMatrix',
                            'FoldChangeMatrix', 'DifferenceMatrix',
                            'ComparisonRegions', 'FoldChangeRegions',
-                           'DifferenceRegions', 'DirectionalityIndex'
+                           'DifferenceRegions', 'DirectionalityIndex',
+                           'MultiResolutionHic'
                            ):
             file_name = str(tmpdir) + '/{}.h5'.format(class_name)
             cls_ = class_name_dict[class_name]
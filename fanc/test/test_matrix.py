@@ -3,7 +3,8 @@ import numpy as np
 from fanc.compatibility.cooler import to_cooler
 from genomic_regions import GenomicRegion
 from fanc.matrix import Edge, RegionPairsTable, RegionMatrixTable, RegionMatrix
-from fanc.hic import Hic, _get_overlap_map, _edge_overlap_split_rao, kr_balancing, ice_balancing
+from fanc.hic import Hic, MultiResolutionHic, _get_overlap_map, _edge_overlap_split_rao, kr_balancing, ice_balancing, \
+    correct_matrix, _get_bin_lookup, _bin_edges
 from fanc.regions import Chromosome, Genome
 from fanc.pairs import ReadPairs, SamBamReadPairGenerator
 from fanc.tools.matrix import is_symmetric
@@ -11,6 +12,7 @@ from fanc.compatibility.juicer import JuicerHic
 from fanc.compatibility.cooler import CoolerHic
 from fanc.tools.load import load
 import tables
+import scipy.sparse
 import pytest
 
 test_dir = os.path.dirname(os.path.realpath(__file__))
@@ -111,6 +113,36 @@ class RegionMatrixContainerTestFactory:
                               rtol=1e-03)
 
 
+    def test_edges_arrays_chunks(self):
+        chromosome = self.matrix.chromosomes()[0]
+        regions = list(self.matrix.regions(chromosome))
+        sub_regions = regions[:len(regions) // 2]
+        sub_key = '{}:{}-{}'.format(chromosome, sub_regions[0].start, sub_regions[-1].end)
+
+        fields = ['source', 'sink', 'weight']
+        arrays = self.matrix._edge_subset_arrays(sub_regions, regions, fields)
+        blocks = list(self.matrix._edge_subset_array_chunks(sub_regions, regions, fields, chunk_size=7))
+        assert len(blocks) > 1
+        for block in blocks:
+            assert len(block[0]) <= 7
+        for i in range(len(fields)):
+            assert np.array_equal(np.concatenate([block[i] for block in blocks]), arrays[i])
+
+        for key in [chromosome, (sub_key, chromosome)]:
+            for norm in (True, False):
+                edges = {(e.source, e.sink): e.weight for e in self.matrix.edges(key, norm=norm, lazy=True)}
+                chunks = list(self.matrix.edges_arrays(key, norm=norm, chunk_size=7))
+                assert len(chunks) > 1
+
+                n_edges = 0
+                for sources, sinks, weights in chunks:
+                    assert len(sources) <= 7
+                    for source, sink, weight in zip(sources, sinks, weights):
+                        assert np.isclose(weight, edges[(source, sink)])
+                    n_edges += len(sources)
+                assert n_edges == len(edges)
+
+
 class TestHic(RegionMatrixContainerTestFactory):
     def setup_method(self, method):
         hic_file = os.path.join(test_dir, 'test_matrix', 'test_fanc.hic')
@@ -607,6 +639,124 @@ class TestHicBasic:
         m = self.hic[1:1, 2:2]
         assert np.array_equal(m.shape, [0, 0])
 
+    @pytest.mark.parametrize("kwargs", [{}, {'norm': False}, {'oe': True},
+                                        {'oe': True, 'oe_per_chromosome': False},
+                                        {'intra_chromosomal': False}])
+    def test_get_matrix_vectorised(self, kwargs):
+        self.hic.region_data('bias', np.linspace(0.5, 2, len(self.hic.regions)))
+
+        for key in [None, 'chr2', ('chr1', 'chr3'), ('chr3', 'chr1'),
+                    ('chr1:1-3000', 'chr2'), ('chr1:2000-4000', 'chr1:1-2500')]:
+            m = self.hic.matrix(key, **kwargs)
+
+            row_regions, col_regions, entries = self.hic.regions_and_matrix_entries(key, lazy=True,
+                                                                                    **kwargs)
+            m_entries = np.full((len(row_regions), len(col_regions)), 1.0 if kwargs.get('oe') else 0.0)
+            for i, j, weight in entries:
+                if 0 <= i < m_entries.shape[0] and 0 <= j < m_entries.shape[1]:
+                    m_entries[i, j] = weight
+
+            assert np.allclose(m.data, m_entries)
+
+    @pytest.mark.parametrize("format", ['csr', 'coo'])
+    def test_get_sparse_matrix(self, tmpdir, format):
+        out = str(tmpdir.join("test_sparse.cool"))
+        to_cooler(self.hic, out, multires=False)
+        cooler_hic = CoolerHic(out)
+
+        for hic in (self.hic, cooler_hic):
+            for key in [None, 'chr2', ('chr1', 'chr3'), ('chr1:1-3000', 'chr2')]:
+                for kwargs in [{'norm': False}, {'oe': True}]:
+                    m = hic.matrix(key, **kwargs)
+                    m_sparse, row_regions, col_regions = hic.sparse_matrix(key, format=format, **kwargs)
+
+                    assert m_sparse.format == format
+                    assert [r.ix for r in row_regions] == [r.ix for r in m.row_regions]
+                    assert [r.ix for r in col_regions] == [r.ix for r in m.col_regions]
+                    m_dense = m_sparse.toarray()
+                    if kwargs.get('oe', False):
+                        # missing entries are stored as zeros, not as expected ratio 1
+                        nz = m_dense != 0
+                        assert np.allclose(m_dense[nz], m.data[nz])
+                    else:
+                        assert np.allclose(m_dense, m.data)
+
+        with pytest.raises(ValueError):
+            self.hic.sparse_matrix(format='dense')
+
+    def test_edges_arrays(self, tmpdir):
+        out = str(tmpdir.join("test_edges_arrays.cool"))
+        to_cooler(self.hic, out, multires=False)
+        cooler_hic = CoolerHic(out)
+
+        for hic in (self.hic, cooler_hic):
+            for key in [None, 'chr2', ('chr1', 'chr3'), ('chr2', 'chr1:1-3000')]:
+                for kwargs in [{}, {'norm': False}, {'oe': True}, {'inter_chromosomal': False}]:
+                    edges = {(e.source, e.sink): e.weight for e in hic.edges(key, lazy=True, **kwargs)}
+
+                    chunks = list(hic.edges_arrays(key, chunk_size=2, **kwargs))
+                    for sources, sinks, weights in chunks:
+                        assert len(sources) <= 2
+                        assert np.all(sources <= sinks)
+
+                    if len(chunks) == 0:
+                        assert len(edges) == 0
+                        continue
+
+                    sources = np.concatenate([c[0] for c in chunks])
+                    sinks = np.concatenate([c[1] for c in chunks])
+                    weights = np.concatenate([c[2] for c in chunks])
+                    assert len(sources) == len(edges)
+                    for source, sink, weight in zip(sources, sinks, weights):
+                        assert np.isclose(weight, edges[(source, sink)])
+
+    def test_unbalanced_cooler(self, tmpdir):
+        out = str(tmpdir.join("test_unbalanced.cool"))
+        to_cooler(self.hic, out, balance=False, multires=False)
+        cooler_hic = CoolerHic(out)
+
+        assert np.allclose(cooler_hic.bias_vector(), 1.)
+        m = cooler_hic.matrix()
+        m_raw = cooler_hic.matrix(norm=False)
+        assert np.allclose(m.data, m_raw.data)
+
+    def test_expected_values(self):
+        hic = self.hic_class()
+        hic.add_regions(self.hic.regions(lazy=False))
+
+        # regions 1 and 9 are unmappable
+        edges = [[e.source, e.sink, e.weight] for e in self.hic.edges(norm=False)
+                 if e.source not in (1, 9) and e.sink not in (1, 9)]
+        hic.add_edges(edges)
+
+        m = hic.matrix(norm=False, mask=False, default_value=0.0)
+        mappable = hic.mappable()
+        intra_total, chromosome_intra_total, inter_total = hic.possible_contacts()
+        intra, chromosome_intra, inter = hic.expected_values(norm=False)
+
+        intra_sums = np.zeros(len(intra))
+        intra_counts = np.zeros(len(intra))
+        for chromosome, (start, end) in hic.chromosome_bins.items():
+            mc = m[start:end, start:end]
+            mappable_pairs = np.outer(mappable[start:end], mappable[start:end])
+            for d in range(end - start):
+                possible = np.diagonal(mappable_pairs, d).sum()
+                assert chromosome_intra_total[chromosome][d] == possible
+                if possible > 0:
+                    assert np.isclose(chromosome_intra[chromosome][d],
+                                      np.diagonal(mc, d).sum() / possible)
+                intra_sums[d] += np.diagonal(mc, d).sum()
+                intra_counts[d] += possible
+
+        assert np.array_equal(intra_total, intra_counts)
+        assert np.allclose(intra, intra_sums / intra_counts)
+
+        chromosome_ix = np.array([r.chromosome for r in hic.regions])
+        inter_mask = np.triu(chromosome_ix[:, None] != chromosome_ix[None, :])
+        assert inter_total == np.sum(np.triu(np.outer(mappable, mappable))[inter_mask])
+        assert np.isclose(inter, m[inter_mask].sum() / inter_total)
+        hic.close()
+
     def test_merge(self):
         hic = self.hic_class()
 
@@ -786,13 +936,53 @@ class TestHicBasic:
             weight_sum += new_edge[2]
         assert weight_sum == original_edge[2]
 
-    def test_bin(self):
+    def test_bin_lookup(self):
+        # ----|----|----|----|---|-----|-| new
+        # -------|-------|-------|-------| old
+        old_regions = [
+            GenomicRegion(chromosome='chr1', start=1, end=8),
+            GenomicRegion(chromosome='chr1', start=9, end=16),
+            GenomicRegion(chromosome='chr1', start=17, end=24),
+            GenomicRegion(chromosome='chr1', start=25, end=32),
+            GenomicRegion(chromosome='chr2', start=1, end=10),
+        ]
+
+        new_regions = [
+            GenomicRegion(chromosome='chr1', start=1, end=5),
+            GenomicRegion(chromosome='chr1', start=6, end=10),
+            GenomicRegion(chromosome='chr1', start=11, end=15),
+            GenomicRegion(chromosome='chr1', start=16, end=20),
+            GenomicRegion(chromosome='chr1', start=21, end=24),
+            GenomicRegion(chromosome='chr1', start=25, end=30),
+            GenomicRegion(chromosome='chr1', start=31, end=32)
+        ]
+
+        first_bins, last_bins = _get_bin_lookup(old_regions, new_regions)
+        assert np.array_equal(first_bins, [0, 1, 3, 5, -1])
+        assert np.array_equal(last_bins, [1, 3, 4, 6, -1])
+
+        overlap_map = _get_overlap_map(old_regions, new_regions)
+        for source, sink, weight in ([0, 1, 12.0], [0, 0, 12.0], [0, 2, 9.0], [2, 2, 9.0], [1, 3, 3.0]):
+            new_edges = _edge_overlap_split_rao([source, sink, weight], overlap_map)
+            binned = _bin_edges(np.array([source]), np.array([sink]), np.array([weight]),
+                                first_bins, last_bins)
+            assert sum(binned['weight']) == weight
+            assert sorted(binned['weight']) == sorted(e[2] for e in new_edges if e[2] != 0)
+            assert {(e[0], e[1]) for e in binned} <= {(e[0], e[1]) for e in new_edges}
+
+        # edges involving unmapped regions are dropped
+        binned = _bin_edges(np.array([0, 4]), np.array([4, 4]), np.array([3.0, 5.0]),
+                            first_bins, last_bins)
+        assert len(binned) == 0
+
+    @pytest.mark.parametrize("threads", [1, 2])
+    def test_bin(self, threads):
         original_reads = 0
         for edge in self.hic_cerevisiae.edges():
             original_reads += edge.weight
 
         def assert_binning(bin_size):
-            binned = self.hic_cerevisiae.bin(bin_size)
+            binned = self.hic_cerevisiae.bin(bin_size, threads=threads)
 
             new_reads = 0
             for edge in binned.edges():
@@ -888,6 +1078,44 @@ class TestHicBasic:
         hic.close()
         binned.close()
 
+    @pytest.mark.parametrize("threads", [1, 2])
+    def test_multi_resolution(self, tmpdir, threads):
+        dest_file = os.path.join(str(tmpdir), "multi.hic")
+
+        binned = {r: self.hic_cerevisiae.bin(r) for r in (10000, 20000)}
+        multi = MultiResolutionHic(file_name=dest_file, mode='w')
+        multi.add_hic(binned[10000])
+        multi.add_hic(binned[20000], resolution='20kb')
+        assert multi.resolutions() == [10000, 20000]
+        multi.close()
+
+        multi = load(dest_file, mode='r')
+        assert isinstance(multi, MultiResolutionHic)
+        multi.close()
+
+        for hic in (load(dest_file + '@10kb'), load(dest_file, resolution=10000)):
+            assert hic.bin_size == 10000
+            assert np.array_equal(hic.matrix(), binned[10000].matrix())
+            hic.close()
+
+        # threaded operations open the resolution group in worker processes
+        hic = load(dest_file + '@20kb')
+        coarse = hic.bin(40000, threads=threads)
+        expected = binned[20000].bin(40000)
+        assert np.array_equal(coarse.matrix(), expected.matrix())
+        hic.close()
+        coarse.close()
+        expected.close()
+
+        with pytest.raises(ValueError):
+            load(dest_file + '@5kb')
+
+        with pytest.raises(ValueError):
+            load(self.dir + "/test_matrix/cerevisiae.chrI.HindIII_upgrade.hic", resolution=10000)
+
+        for hic in binned.values():
+            hic.close()
+
     def test_knight_matrix_balancing(self):
         chrI = Chromosome.from_fasta(self.dir + "/test_matrix/chrI.fa")
         genome = Genome(chromosomes=[chrI])
@@ -936,6 +1164,16 @@ class TestHicBasic:
             assert abs(1.0 - n) < 1e-5 or n == 0
         hic.close()
 
+    def test_knight_matrix_balancing_sparse(self):
+        m = self.hic_cerevisiae.matrix(norm=False)
+        m_sparse = scipy.sparse.csr_matrix(m)
+
+        m_corrected, bias = correct_matrix(m)
+        m_corrected_sparse, bias_sparse = correct_matrix(m_sparse)
+        assert scipy.sparse.issparse(m_corrected_sparse)
+        assert np.allclose(bias, bias_sparse)
+        assert np.allclose(m_corrected, m_corrected_sparse.toarray())
+
     def test_ice_matrix_balancing(self):
         chrI = Chromosome.from_fasta(self.dir + "/test_matrix/chrI.fa")
         genome = Genome(chromosomes=[chrI])
@@ -961,6 +1199,70 @@ class TestHicBasic:
             assert (sum_m_corr[0] - 5 < n < sum_m_corr[0] + 5) or n == 0
         hic.close()
 
+    def test_ice_matrix_balancing_per_chromosome(self):
+        chrI = Chromosome.from_fasta(self.dir + "/test_matrix/chrI.fa")
+        genome = Genome(chromosomes=[chrI])
+
+        hic = self.hic_class()
+        regions = genome.get_regions(10000)
+        genome.close()
+        hic.add_regions(regions)
+        regions.close()
+        hic.load_from_hic(self.hic_cerevisiae)
+
+        bias_whole = ice_balancing(hic)
+        bias_chromosome = ice_balancing(hic, whole_matrix=False)
+        assert np.allclose(bias_whole, bias_chromosome)
+
+        m_corr = hic[:, :]
+        assert is_symmetric(m_corr)
+        hic.close()
+
+    @pytest.mark.parametrize("whole_matrix", [True, False])
+    @pytest.mark.parametrize("intra_chromosomal", [True, False])
+    def test_ice_matrix_balancing_chunked(self, whole_matrix, intra_chromosomal):
+        if not whole_matrix and not intra_chromosomal:
+            return
+
+        bias = ice_balancing(self.hic, whole_matrix=whole_matrix,
+                             intra_chromosomal=intra_chromosomal)
+        bias_chunked = ice_balancing(self.hic, whole_matrix=whole_matrix,
+                                     intra_chromosomal=intra_chromosomal,
+                                     chunk_size=7)
+        assert np.allclose(bias, bias_chunked)
+
+    @pytest.mark.parametrize("balancing_function", [ice_balancing, kr_balancing])
+    def test_matrix_balancing_per_chromosome_parallel(self, tmpdir, balancing_function):
+        dest_file = os.path.join(str(tmpdir), "hic.h5")
+        hic = self.hic_class(file_name=dest_file, mode='w')
+        hic.add_regions(self.hic.regions(lazy=False))
+        hic.add_edges(self.hic.edges(norm=False))
+        hic.flush()
+
+        bias = balancing_function(hic, whole_matrix=False)
+        bias_parallel = balancing_function(hic, whole_matrix=False, threads=3)
+        hic.close()
+        assert np.allclose(bias, bias_parallel)
+
+    def test_expected_values_parallel(self, tmpdir):
+        dest_file = os.path.join(str(tmpdir), "hic.h5")
+        hic = self.hic_class(file_name=dest_file, mode='w', partition_strategy=3)
+        hic.add_regions(self.hic.regions(lazy=False))
+        hic.add_edges(self.hic.edges(norm=False))
+        hic.flush()
+
+        intra, chromosome_intra, inter, marginals, valid = hic.expected_values_and_marginals(force=True)
+        (intra_parallel, chromosome_intra_parallel, inter_parallel,
+         marginals_parallel, valid_parallel) = hic.expected_values_and_marginals(force=True, threads=3)
+        hic.close()
+
+        assert np.allclose(intra, intra_parallel)
+        for chromosome, expected in chromosome_intra.items():
+            assert np.allclose(expected, chromosome_intra_parallel[chromosome])
+        assert np.isclose(inter, inter_parallel)
+        assert np.allclose(marginals, marginals_parallel)
+        assert np.array_equal(valid, valid_parallel)
+
     def test_diagonal_filter(self):
         hic = self.hic
 
@@ -3,10 +3,11 @@ import pytest
 from fanc.pairs import SamBamReadPairGenerator, ReadPairs, UnmappedFilter, FragmentReadPair, \
     FragmentRead, InwardPairsFilter, OutwardPairsFilter, ContaminantFilter, QualityFilter, \
     BwaMemQualityFilter, ReDistanceFilter, SelfLigationFilter, LazyFragment, LazyFragmentRead, \
-    PCRDuplicateFilter
+    PCRDuplicateFilter, _fragment_info_array, _split_fragment_info_array
 from genomic_regions import GenomicRegion
 from fanc.regions import Genome, Chromosome
 from fanc.general import Mask
+from fanc.tools.load import load
 import numpy as np
 
 
@@ -166,6 +167,155 @@ class TestReadPairs:
         assert b.tolist() == [830, 413, 423]
         pairs.close()
 
+    def test_merge(self):
+        pairs = self.pairs_class()
+        regions = self.genome.get_regions(1000)
+        pairs.add_regions(regions.regions)
+        regions.close()
+        sam1_file = os.path.join(self.dir, "test_pairs", "lambda_reads1_sort.sam")
+        sam2_file = os.path.join(self.dir, "test_pairs", "lambda_reads2_sort.sam")
+        pairs.add_read_pairs(SamBamReadPairGenerator(sam1_file, sam2_file))
+        mask = pairs.add_mask_description('inwards', 'Mask read pairs that are inward '
+                                                     'facing and closer than 100bp')
+        pairs.filter(InwardPairsFilter(minimum_distance=100, mask=mask))
+        assert len(pairs) == 18
+
+        merged = self.pairs_class.merge([self.pairs, pairs])
+        assert isinstance(merged, self.pairs_class)
+        assert len(merged) == 62
+
+        def pair_tuples(p):
+            return sorted((pair.left.position, pair.left.strand, pair.left.fragment.start,
+                           pair.right.position, pair.right.strand, pair.right.fragment.start)
+                          for pair in p.pairs(lazy=True))
+
+        assert pair_tuples(merged) == sorted(pair_tuples(self.pairs) + pair_tuples(pairs))
+        pairs.close()
+        merged.close()
+
+    def test_to_hic(self):
+        mask = self.pairs.add_mask_description('inwards', 'Mask read pairs that are inward '
+                                                          'facing and closer than 100bp')
+        self.pairs.filter(InwardPairsFilter(minimum_distance=100, mask=mask))
+
+        for partition, _ in self.pairs._iter_edge_tables():
+            keys, counts = self.pairs._pixel_counts(partition)
+            chunked_keys, chunked_counts = self.pairs._pixel_counts(partition, chunk_size=3)
+            assert np.array_equal(keys, chunked_keys)
+            assert np.array_equal(counts, chunked_counts)
+
+        expected = np.zeros((len(self.pairs.regions), len(self.pairs.regions)))
+        for pair in self.pairs.pairs(lazy=True):
+            source, sink = sorted([pair.left.fragment.ix, pair.right.fragment.ix])
+            expected[source, sink] += 1
+            expected[sink, source] = expected[source, sink]
+
+        hic = self.pairs.to_hic()
+        assert np.array_equal(hic.matrix(norm=False), expected)
+        hic.close()
+
+    def test_to_hic_pyramid(self):
+        hic = self.pairs.to_hic()
+        hics = self.pairs.to_hic_pyramid([4000, 2000, 3000])
+        assert sorted(hics.keys()) == [2000, 3000, 4000]
+
+        for resolution, binned_hic in hics.items():
+            expected_hic = hic.bin(resolution)
+            assert list(binned_hic.regions) == list(expected_hic.regions)
+            assert np.array_equal(binned_hic.matrix(norm=False), expected_hic.matrix(norm=False))
+            expected_hic.close()
+            binned_hic.close()
+        hic.close()
+
+        with pytest.raises(ValueError):
+            self.pairs.to_hic_pyramid([2000, 4000], file_names=['a.hic'])
+
+    def test_to_hic_pyramid_unaligned(self):
+        sam1_file = os.path.join(self.dir, "test_pairs", "lambda_reads1_sort.sam")
+        sam2_file = os.path.join(self.dir, "test_pairs", "lambda_reads2_sort.sam")
+        pairs = self.pairs_class()
+        regions = self.genome.get_regions(700)
+        pairs.add_regions(regions.regions)
+        regions.close()
+        pairs.add_read_pairs(SamBamReadPairGenerator(sam1_file, sam2_file))
+
+        def total(h):
+            return sum(edge.weight for edge in h.edges(norm=False, lazy=True))
+
+        hic = pairs.to_hic()
+        hics = pairs.to_hic_pyramid([2000, 4000])
+        for resolution, binned_hic in hics.items():
+            # fragments straddling bin borders are split randomly,
+            # but no contacts are lost
+            expected_hic = hic.bin(resolution)
+            assert list(binned_hic.regions) == list(expected_hic.regions)
+            assert total(binned_hic) == total(hic) == total(expected_hic)
+            expected_hic.close()
+            binned_hic.close()
+        hic.close()
+        pairs.close()
+
+    def test_to_hic_pyramid_multi_resolution(self, tmpdir):
+        file_name = os.path.join(str(tmpdir), "multi.hic")
+        hics = self.pairs.to_hic_pyramid([2000, 4000], multi_resolution_file=file_name)
+        expected = {resolution: hic.matrix(norm=False) for resolution, hic in hics.items()}
+        for hic in hics.values():
+            hic.close()
+
+        multi = load(file_name)
+        assert multi.resolutions() == [2000, 4000]
+        multi.close()
+
+        for resolution in (2000, 4000):
+            hic = load(file_name + '@{}'.format(resolution))
+            assert np.array_equal(hic.matrix(norm=False), expected[resolution])
+            hic.close()
+
+    @pytest.mark.parametrize("shards", [False, True])
+    def test_add_read_pairs_from_sam(self, shards):
+        sam_file1 = os.path.join(self.dir, "test_pairs", "lambda_reads1_sort.sam")
+        sam_file2 = os.path.join(self.dir, "test_pairs", "lambda_reads2_sort.sam")
+        pairs = self.pairs_class()
+        regions = self.genome.get_regions(1000)
+        pairs.add_regions(regions.regions)
+        regions.close()
+        pairs.add_read_pairs_from_sam(sam_file1, sam_file2, batch_size=10, threads=2, shards=shards)
+
+        def pair_tuples(p):
+            return sorted((pair.left.position, pair.left.strand, pair.left.fragment.start,
+                           pair.right.position, pair.right.strand, pair.right.fragment.start)
+                          for pair in p.pairs(lazy=True))
+
+        assert len(pairs) == 44
+        assert pair_tuples(pairs) == pair_tuples(self.pairs)
+        assert sorted(pair.ix for pair in pairs.pairs(lazy=True)) == list(range(44))
+        pairs.close()
+
+    @pytest.mark.parametrize("queue", [False, True])
+    def test_filter_pcr_duplicates(self, queue):
+        sam_file1 = os.path.join(self.dir, "test_matrix", "yeast.sample.chrI.1_sorted.sam")
+        sam_file2 = os.path.join(self.dir, "test_matrix", "yeast.sample.chrI.2_sorted.sam")
+        chrI = Chromosome.from_fasta(os.path.join(self.dir, "test_matrix", "chrI.fa"))
+        genome = Genome(chromosomes=[chrI])
+        pairs = self.pairs_class()
+        regions = genome.get_regions('HindIII')
+        pairs.add_regions(regions.regions)
+        pairs.add_read_pairs(SamBamReadPairGenerator(sam_file1, sam_file2))
+        genome.close()
+        regions.close()
+
+        assert len(pairs) == 7096
+        pcr_duplicate_filter = PCRDuplicateFilter(pairs=pairs, threshold=0)
+        assert len(pairs) == 7096
+        assert sum(not pcr_duplicate_filter.valid_pair(pair) for pair in pairs.pairs(lazy=True)) == 20
+        pairs.filter_pcr_duplicates(threshold=0, queue=queue)
+        pairs.run_queued_filters()
+        assert len(pairs) == 7076
+        pairs.filter_pcr_duplicates(threshold=50, queue=queue)
+        pairs.run_queued_filters()
+        assert len(pairs) == 5401
+        pairs.close()
+
     def test_re_dist(self):
         read1 = FragmentRead(GenomicRegion(chromosome='chr1', start=1, end=1000), position=200, strand=-1)
         assert read1.re_distance() == 199
@@ -199,6 +349,37 @@ class TestReadPairs:
         assert len(list(self.pairs.pairs(excluded_filters=[in_filter, 3]))) == 28
 
 
+def test_fragment_info_array():
+    fi = {'chr1': np.array([[0, 0, 1, 100], [1, 0, 101, 200]]),
+          'chr2': np.array([[2, 1, 1, 50], [3, 1, 51, 150]])}
+    fe = {chromosome: infos[:, 3] for chromosome, infos in fi.items()}
+    fragment_infos, skipped = _fragment_info_array(['chr2', 'chr1', 'chr3', 'chr1'], [60, 100, 10, 250],
+                                                   [16, 0, 0, 0],
+                                                   ['chr1', 'chr1', 'chr1', 'chr1'], [5, 150, 20, 20],
+                                                   [0, 16, 0, 0],
+                                                   fi, fe, [2])
+    assert skipped == 2
+    assert fragment_infos['source'].tolist() == [0, 1]
+    assert fragment_infos['sink'].tolist() == [3, 1]
+    assert fragment_infos['source_partition'].tolist() == [0, 0]
+    assert fragment_infos['sink_partition'].tolist() == [1, 0]
+    assert fragment_infos['left_read_position'].tolist() == [5, 100]
+    assert fragment_infos['left_read_strand'].tolist() == [1, 1]
+    assert fragment_infos['right_read_position'].tolist() == [60, 150]
+    assert fragment_infos['right_read_strand'].tolist() == [-1, -1]
+    assert fragment_infos['right_fragment_chromosome'].tolist() == [1, 0]
+    assert fragment_infos['right_fragment_start'].tolist() == [51, 101]
+    assert fragment_infos['right_fragment_end'].tolist() == [150, 200]
+
+    with ReadPairs() as pairs:
+        template = pairs._edge_row_template()
+    partitions = _split_fragment_info_array(fragment_infos, template)
+    assert sorted(partitions.keys()) == [(0, 0), (0, 1)]
+    assert partitions[(0, 0)].dtype == template.dtype
+    assert partitions[(0, 0)][['source', 'sink', 'left_read_position']].tolist() == [(1, 1, 100)]
+    assert partitions[(0, 1)][['source', 'sink', 'left_read_position']].tolist() == [(0, 3, 5)]
+
+
 class TestFragmentRead:
     def setup_method(self, method):
         fragment1 = GenomicRegion(start=1, end=1000, chromosome='chr1', strand=1, ix=0)
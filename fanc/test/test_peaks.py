@@ -1,11 +1,12 @@
 from __future__ import division
 import fanc
-from fanc.peaks import RaoPeakCaller, RaoPeakInfo
+from fanc.peaks import RaoPeakCaller, RaoPeakInfo, _summed_area_table, _neighborhood_sum
 from fanc.hic import Hic
 from fanc.matrix import RegionMatrix
 from genomic_regions import GenomicRegion
 from fanc.tools.general import pairwise
 import numpy as np
+from scipy.stats import poisson
 import math
 import pickle
 import os.path
@@ -111,6 +112,60 @@ class TestRaoPeakCaller:
         assert RaoPeakCaller.find_chunk(30) == 15
         assert RaoPeakCaller.find_chunk(1024) == 31
 
+    def test_find_chunks(self):
+        values = [np.nan, 0, 1, 1.001, 1.5, 1.7, 30, 1024, np.inf]
+        chunks, valid = RaoPeakCaller.find_chunks(values)
+        assert list(valid) == [False, True, True, True, True, True, True, True, False]
+        for value, chunk in zip(values[1:-1], chunks[1:-1]):
+            assert RaoPeakCaller.find_chunk(value) == chunk
+
+    def test_fdr_cutoffs(self):
+        distribution = np.array([[0, 4, 0, 2, 2],
+                                 [0, 0, 0, 0, 0],
+                                 [1, 0, 3, 0, 0]])
+        fdr_cutoffs = RaoPeakCaller._get_fdr_cutoffs({'ll': distribution})['ll']
+        assert fdr_cutoffs.shape == distribution.shape
+
+        for chunk in (0, 2):
+            left = 0
+            for observed in range(distribution.shape[1]):
+                if distribution[chunk, observed] == 0:
+                    assert fdr_cutoffs[chunk, observed] == 0
+                    continue
+                left += distribution[chunk, observed] / distribution[chunk].sum()
+                if 1 - left > 0:
+                    ratio = poisson.sf(observed, 2 ** (chunk / 3)) / (1 - left)
+                    assert np.isclose(fdr_cutoffs[chunk, observed], min(1, ratio))
+                else:
+                    assert fdr_cutoffs[chunk, observed] == 0
+        assert np.all(fdr_cutoffs[1] == 0)
+
+        fdr = RaoPeakCaller._fdr_lookup(fdr_cutoffs, np.array([0, 2, 3, 0]), np.array([1, 2, 0, 5]))
+        assert fdr[0] == fdr_cutoffs[0, 1]
+        assert fdr[1] == fdr_cutoffs[2, 2]
+        assert fdr[2] == 1
+        assert fdr[3] == 1
+
+    def test_neighborhood_sums(self):
+        m = np.array(self.m, dtype=float)
+        mask = np.zeros(m.shape, dtype=bool)
+        mask[1] = True
+        mask[:, 5] = True
+        m_masked = np.ma.masked_where(mask, m)
+
+        valid_sat = _summed_area_table(~mask)
+        sats = (_summed_area_table(np.where(mask, 0, m)), _summed_area_table(np.where(mask, 0, m) != 0))
+        i, j = [a.ravel() for a in np.meshgrid(np.arange(7), np.arange(7), indexing='ij')]
+        for neighborhood, sum_method in (('ll', RaoPeakCaller.e_ll_sum), ('h', RaoPeakCaller.e_h_sum),
+                                         ('v', RaoPeakCaller.e_v_sum), ('d', RaoPeakCaller.e_d_sum)):
+            sums = _neighborhood_sum(sats, valid_sat, neighborhood, i, j, 3, 1, masked=True)
+            for s, (ii, jj) in zip(sums, zip(i, j)):
+                expected = sum_method(m_masked, ii, jj, 3, 1)
+                if np.ma.is_masked(expected):
+                    assert np.isnan(s)
+                else:
+                    assert np.isclose(s, expected)
+
     def test_call_peaks(self):
         dir = os.path.dirname(os.path.realpath(__file__))
         hic_10kb = fanc.load(dir + "/test_peaks/rao2014.chr11_77400000_78600000.hic", mode='r')
@@ -134,6 +189,22 @@ class TestRaoPeakCaller:
         hic_10kb.close()
         peaks.close()
 
+    def test_call_peaks_max_distance(self):
+        dir = os.path.dirname(os.path.realpath(__file__))
+        hic_10kb = fanc.load(dir + "/test_peaks/rao2014.chr11_77400000_78600000.hic", mode='r')
+
+        peaks = RaoPeakCaller(slice_size=25).call_peaks(hic_10kb)
+        band_peaks = RaoPeakCaller(slice_size=25, max_distance='300kb').call_peaks(hic_10kb)
+
+        expected = {(peak.source, peak.sink): peak.e_d for peak in peaks.edges
+                    if peak.sink - peak.source <= 30}
+        band = {(peak.source, peak.sink): peak.e_d for peak in band_peaks.edges}
+        assert len(band) > 0
+        assert band == expected
+        hic_10kb.close()
+        peaks.close()
+        band_peaks.close()
+
     def test_merge_peaks(self):
         directory = os.path.dirname(os.path.realpath(__file__))
         peaks = RaoPeakInfo(directory + "/test_peaks/rao2014.chr11_77400000_78600000.peaks_filtered", mode='r')
@@ -144,6 +215,21 @@ class TestRaoPeakCaller:
         peaks.close()
         merged_peaks.close()
 
+    def test_merge_peak_clusters(self):
+        sources = np.array([10, 11, 30, 10, 50])
+        sinks = np.array([20, 21, 40, 22, 60])
+        weights = np.array([1., 5., 2., 3., 0.5])
+
+        clusters = RaoPeakInfo._merge_peak_clusters(sources, sinks, weights, 2)
+        assert [list(members) for members, _, _, _ in clusters] == [[1, 0, 3], [2], [4]]
+
+        members, x, y, radius = clusters[0]
+        assert x == 31/3
+        assert y == 21
+        assert radius == max(RaoPeakInfo._euclidian_distance(x, y, s, t)
+                             for s, t in zip(sources[members], sinks[members]))
+        assert clusters[1][1:] == (30, 40, 0)
+
 
 class TestOverlapPeaks:
     def setup_method(self, method):
@@ -183,3 +269,81 @@ class TestOverlapPeaks:
 
         for p in merged.values():
             p.close()
+
+    def test_overlap_consensus(self):
+        stats, merged = fanc.peaks.overlap_peaks(self.peaks, max_distance=100)
+
+        peak = next(iter(merged[frozenset((0, 1, 2))].peaks()))
+        assert np.isclose(peak.x, 10.5)
+        assert np.isclose(peak.y, (12 + 12 + 11.8) / 3)
+        assert peak.source == 10
+        assert peak.sink == 11
+        assert peak.weight == 1
+        assert peak.radius > 0
+
+        peak = next(iter(merged[frozenset((0,))].peaks()))
+        assert (peak.x, peak.y, peak.radius) == (1, 4, 0)
+
+        for p in merged.values():
+            p.close()
+
+    def test_overlap_pairwise(self):
+        # compare with the original pairwise clustering on random peaks
+        def hypotenuse(x, y):
+            return math.sqrt(x*x + y*y)
+
+        def pairwise_overlap(peaks, max_distance):
+            all_peaks = list(sorted(((s, p) for s, pi in peaks.items() for p in pi.peaks()),
+                                    key=lambda p: p[1].weight, reverse=True))
+            clusters = []
+            while len(all_peaks) > 0:
+                cur_p_list = [all_peaks.pop(0)]
+                cur_x, cur_y = cur_p_list[0][1].x, cur_p_list[0][1].y
+                r = 0.
+                cluster_radius = max_distance
+                for p in all_peaks:
+                    if hypotenuse(cur_x - p[1].x, cur_y - p[1].y) <= cluster_radius:
+                        cur_p_list.append(p)
+                        cur_x = np.mean([_p.x for _s, _p in cur_p_list])
+                        cur_y = np.mean([_p.y for _s, _p in cur_p_list])
+                        r = max(hypotenuse(cur_x - _p.x, cur_y - _p.y) for _s, _p in cur_p_list)
+                        cluster_radius = max_distance + r
+                for p in cur_p_list[1:]:
+                    all_peaks.remove(p)
+                clusters.append((frozenset(s for s, p in cur_p_list), cur_x, cur_y, r,
+                                 np.mean([p.weight for s, p in cur_p_list]),
+                                 sum(p.p_value for s, p in cur_p_list)))
+            return clusters
+
+        regions = [GenomicRegion('chr1', a + 1, b, ix=i)
+                   for i, (a, b) in enumerate(pairwise(np.arange(0, 10001, 100)))]
+        rs = np.random.RandomState(42)
+        centers = rs.uniform(0, 100, size=(15, 2))
+        peaks = {}
+        for sample in 'abc':
+            p = fanc.peaks.PeakInfo()
+            p.add_regions(regions)
+            edges = []
+            for center in centers[rs.choice(len(centers), 10, replace=False)]:
+                x, y = sorted(center + rs.normal(0, 1.5, size=2))
+                x, y = np.clip([x, y], 0, 99.5)
+                edges.append(fanc.peaks.Peak(x=x, y=y, source=math.floor(x), sink=math.floor(y),
+                                             weight=rs.randint(1, 5), p_value=rs.uniform(),
+                                             oe=1, uncorrected=1, expected_local=1, q_value_sum=0))
+            p.add_edges(edges)
+            p.flush()
+            peaks[sample] = p
+
+        expected = pairwise_overlap(peaks, 3)
+        stats, merged = fanc.peaks.overlap_peaks(peaks, max_distance=300)
+
+        assert sum(stats['n']) == len(expected)
+        for sample_set, pi in merged.items():
+            observed = sorted((p.x, p.y, p.radius, p.weight, p.p_value) for p in pi.peaks())
+            expected_set = sorted(c[1:] for c in expected if c[0] == sample_set)
+            assert np.allclose(observed, expected_set, atol=1e-4)
+            pi.close()
+        assert len({c[0] for c in expected}) == len(merged)
+
+        for p in peaks.values():
+            p.close()
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+from genomic_regions import GenomicRegion
+from fanc.hic import MultiResolutionHic
+from fanc.tools.load import load
+from fanc.plotting.hic_plotter import BufferedMatrix, _coarse_matrix, _resolution_sources
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestBufferedMatrixResolution:
+    def setup_method(self, method):
+        self.hic_cerevisiae = load(os.path.join(test_dir, 'test_matrix', 'cerevisiae.chrI.HindIII_upgrade.hic'),
+                                   mode='r')
+        self.hic = self.hic_cerevisiae.bin(10000)
+        self.region = GenomicRegion(chromosome='chrI', start=1, end=230000)
+
+    def teardown_method(self, method):
+        self.hic.close()
+        self.hic_cerevisiae.close()
+
+    @pytest.mark.parametrize("bin_size", [20000, 40000])
+    def test_coarse_matrix(self, bin_size):
+        binned = self.hic.bin(bin_size)
+        m = _coarse_matrix(self.hic, None, bin_size, norm=False)
+        m_binned = binned.matrix(norm=False)
+
+        assert m.shape == m_binned.shape
+        assert [(r.start, r.end) for r in m.row_regions] == \
+               [(r.start, r.end) for r in m_binned.row_regions]
+        assert np.allclose(np.asarray(m), np.asarray(m_binned))
+
+        # sub-matrices and coarsening of a stored lower resolution
+        key = ('chrI:40001-160000', 'chrI:80001-230000')
+        assert np.allclose(np.asarray(_coarse_matrix(self.hic, key, bin_size, norm=False)),
+                           np.asarray(binned.matrix(key, norm=False)))
+        if bin_size == 40000:
+            coarse_binned = self.hic.bin(20000)
+            assert np.allclose(np.asarray(_coarse_matrix(coarse_binned, None, bin_size, norm=False)),
+                               np.asarray(m_binned))
+            coarse_binned.close()
+        binned.close()
+
+    def test_resolution_single(self):
+        assert list(_resolution_sources(self.hic).keys()) == [10000]
+
+        buffered = BufferedMatrix(self.hic)
+        assert buffered._resolution([self.region]) == (None, None)
+        assert buffered._resolution([self.region], max_bins=1000) == (None, None)
+        # 46kb per bin is coarsened by the largest fitting power of 2
+        assert buffered._resolution([self.region], max_bins=5) == (10000, 40000)
+
+        buffered = BufferedMatrix(self.hic, resolution='40kb')
+        assert buffered._resolution([self.region]) == (10000, 40000)
+
+    def test_resolution_multi(self, tmpdir):
+        dest_file = os.path.join(str(tmpdir), "multi.hic")
+        binned = self.hic.bin(20000)
+        multi = MultiResolutionHic(file_name=dest_file, mode='w')
+        multi.add_hic(self.hic)
+        multi.add_hic(binned)
+        multi.close()
+
+        multi = MultiResolutionHic(file_name=dest_file, mode='r')
+        buffered = BufferedMatrix(multi)
+        assert buffered.data.bin_size == 10000
+        assert buffered._resolution([self.region], max_bins=12) == (None, None)
+        assert buffered._resolution([self.region], max_bins=10) == (20000, 20000)
+        assert buffered._resolution([self.region], max_bins=5) == (20000, 40000)
+
+        m = buffered.get_matrix(self.region, self.region, max_bins=10)
+        m_binned = binned.matrix((self.region, self.region))
+        assert m.shape == m_binned.shape
+        assert np.allclose(np.asarray(m), np.asarray(m_binned))
+
+        m = buffered.get_matrix(self.region, self.region)
+        assert m.shape == self.hic.matrix((self.region, self.region)).shape
+        buffered.close()
+
+        # stored and on the fly resolutions are on the same scale
+        buffered = BufferedMatrix(multi, norm=False)
+        binned_40kb = self.hic.bin(40000)
+        for max_bins, expected in ((10, binned), (5, binned_40kb)):
+            m = buffered.get_matrix(self.region, self.region, max_bins=max_bins)
+            m_expected = expected.matrix((self.region, self.region), norm=False)
+            assert np.allclose(np.asarray(m), np.asarray(m_expected))
+        buffered.close()
+        binned_40kb.close()
+
+        multi.close()
+        binned.close()
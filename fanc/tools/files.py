@@ -66,6 +66,70 @@ def create_or_open_pytables_file(file_name=None, mode='a'):
         return t.open_file(file_name, mode, chunk_cache_size=270536704, chunk_cache_nelmts=2084)
 
 
+def hdf5_reader_pool(processes, initializer=None, initargs=()):
+    """
+    Create a spawning process pool whose workers can open HDF5 files
+    that are still open for writing in the current process.
+
+    HDF5 file locking would otherwise prevent workers from opening
+    these files, even in read-only mode. Make sure all data has been
+    flushed to disk before workers access a file.
+
+    :param processes: Number of worker processes
+    :param initializer: Optional function called once in every worker
+                        on startup, e.g. to set up read-only lookup data
+    :param initargs: Arguments passed to initializer
+    :return: :class:`multiprocessing.pool.Pool`
+    """
+    file_locking = os.environ.get('HDF5_USE_FILE_LOCKING')
+    os.environ['HDF5_USE_FILE_LOCKING'] = 'FALSE'
+    try:
+        return multiprocessing.get_context("spawn").Pool(processes, initializer, initargs)
+    finally:
+        if file_locking is None:
+            del os.environ['HDF5_USE_FILE_LOCKING']
+        else:
+            os.environ['HDF5_USE_FILE_LOCKING'] = file_locking
+
+
+def hdf5_file_exists(file_name):
+    """
+    Check if the file name passed to a FAN-C object refers to existing data.
+
+    Besides paths, FAN-C objects can be initialised with open PyTables
+    files, e.g. for a single resolution of a multi-resolution file.
+    These always count as existing.
+
+    :param file_name: Path to file, PyTables File, or None
+    :return: bool
+    """
+    if isinstance(file_name, t.file.File):
+        return True
+    return file_name is not None and os.path.exists(os.path.expanduser(file_name))
+
+
+def hdf5_file_uri(hdf5_file):
+    """
+    Get a file name that can be passed to :func:`~fanc.load` in
+    another process to open the same data.
+
+    For files opened on a sub-group, such as one resolution of a
+    :class:`~fanc.hic.MultiResolutionHic`, the group is appended
+    to the file path as "<path>::<group>".
+
+    :param hdf5_file: PyTables File
+    :return: str, or None if the data is not stored on disk
+    """
+    file_name = getattr(hdf5_file, 'filename', None)
+    if file_name is None or not os.path.isfile(file_name):
+        return None
+
+    root = getattr(hdf5_file, 'root_uep', '/')
+    if root == '/':
+        return file_name
+    return '{}::{}'.format(file_name, root)
+
+
 def is_sambam_file(file_name):
     file_name = os.path.expanduser(file_name)
     if not os.path.isfile(file_name):
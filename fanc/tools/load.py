@@ -40,22 +40,45 @@ def load(file_name, *args, **kwargs):
       files
     - :class:`~pysam.AlignmentFile` for SAM/BAM files
 
-    :param file_name: Path to file
+    :param file_name: Path to file. For files with multiple resolutions
+                      (:class:`~MultiResolutionHic`, multi-resolution Cooler,
+                      Juicer), you can select a resolution using the
+                      "@" notation, e.g. "/path/to/file.hic@25kb"
     :param args: Positional arguments passed to the class/function that can
                  load the file
+    :param resolution: Resolution (bin size) to load from a file with
+                       multiple resolutions. Alternative to the "@" notation
     :param kwargs: Keyword arguments passed to the class/function that can
                    load the file
     :return: object (:class:`~RegionBased`, :class:`~RegionMatrixContainer`,
              :class:`~RegionPairsContainer`, or :class:`~pysam.AlignmentFile`)
     """
     mode = kwargs.pop('mode', 'r')
+    resolution = kwargs.pop('resolution', None)
     file_name = os.path.expanduser(file_name)
     logger.debug("Searching for file type compatible with {}".format(file_name))
 
+    # HDF5 group URI (file::/group), e.g. single resolution in MultiResolutionHic
+    hdf5_file_name, hdf5_group = file_name, '/'
+    if not os.path.exists(file_name) and '::' in file_name:
+        hdf5_file_name, hdf5_group = file_name.split('::', 1)
+
+    # resolution notation (file@resolution)
+    if not os.path.exists(hdf5_file_name) and '@' in hdf5_file_name:
+        fields = hdf5_file_name.split('@')
+        if len(fields) == 2 and os.path.exists(fields[0]):
+            from .general import str_to_int
+            hdf5_file_name = fields[0]
+            uri_resolution = str_to_int(fields[1])
+            if resolution is not None and str_to_int(str(resolution)) != uri_resolution:
+                raise ValueError("Resolution in file name ({}) does not match "
+                                 "resolution argument ({})".format(uri_resolution, resolution))
+            resolution = uri_resolution
+
     try:
         logger.debug("Trying FileBased classes")
 
-        f = tables.open_file(file_name, mode='r')
+        f = tables.open_file(hdf5_file_name, mode='r', root_uep=hdf5_group)
         try:
             classid = f.get_node('/', 'meta_information').meta_node.attrs['_classid']
             classid = classid.decode() if isinstance(classid, bytes) else classid
@@ -64,12 +87,30 @@ def load(file_name, *args, **kwargs):
         logger.debug("Class ID string: {}".format(classid))
         cls_ = class_id_dict[classid]
         logger.debug("Detected {}".format(cls_))
+
+        if classid == 'MULTIRESOLUTIONHIC' and resolution is not None:
+            container = cls_(file_name=hdf5_file_name, mode='r' if mode == 'r' else 'a')
+            try:
+                return container.hic(resolution, mode=mode)
+            finally:
+                container.close()
+        elif resolution is not None:
+            raise ValueError("{} does not contain multiple resolutions, cannot "
+                             "load resolution {}".format(hdf5_file_name, resolution))
+
+        if hdf5_group != '/':
+            hdf5_file = tables.open_file(hdf5_file_name, mode='r' if mode == 'r' else 'a',
+                                         root_uep=hdf5_group)
+            return cls_(file_name=hdf5_file, mode=mode, *args, **kwargs)
         return cls_(file_name=file_name, mode=mode, *args, **kwargs)
     except (tables.HDF5ExtError, AttributeError, KeyError) as e:
         logger.debug("Not a FileBased class (exception: {})".format(e))
     except OSError as e:
         logger.debug("Exact filename not found, might still be cooler uri (exception: {})".format(e))
 
+    if resolution is not None and '@' not in file_name:
+        file_name = '{}@{}'.format(file_name, resolution)
+
     try:
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
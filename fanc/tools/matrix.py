@@ -1,21 +1,43 @@
 import numpy as np
+import scipy.sparse as sp
 from scipy.stats.mstats import gmean
 
 
 def remove_sparse_rows(m, cutoff=None):
-    s = np.sum(m, 0)
+    """
+    Remove rows (and the corresponding columns) with a low sum from a matrix.
+
+    :param m: Symmetric numpy array or :mod:`scipy.sparse` matrix
+    :param cutoff: Rows with a sum lower than or equal to this value are
+                   removed. Defaults to the minimum row sum.
+    :return: matrix without sparse rows, indices of removed rows
+    """
+    s = np.asarray(m.sum(0)).ravel()
     
     if cutoff is None:
         cutoff = min(s)
     
     idxs = np.where(s <= cutoff)[0]
-    m_removed = np.delete(m, idxs, 0)
-    m_removed = np.delete(m_removed, idxs, 1)
+    if sp.issparse(m):
+        keep = np.ones(m.shape[0], dtype=bool)
+        keep[idxs] = False
+        m_removed = m.tocsr()[keep][:, keep]
+    else:
+        m_removed = np.delete(m, idxs, 0)
+        m_removed = np.delete(m_removed, idxs, 1)
     
     return m_removed, idxs
     
     
 def restore_sparse_rows(m, idx_sets, rows=None):
+    """
+    Restore rows removed with :func:`~remove_sparse_rows`, filling them with zeros.
+
+    :param m: numpy array, vector, or :mod:`scipy.sparse` matrix
+    :param idx_sets: list of index arrays, as returned by consecutive
+                     calls to :func:`~remove_sparse_rows`
+    :return: matrix or vector of the original size
+    """
     abs_idx = []
     for idxs in reversed(idx_sets):
         for i in sorted(idxs):
@@ -25,6 +47,14 @@ def restore_sparse_rows(m, idx_sets, rows=None):
                     shift += 1
             abs_idx.append(i - shift)
     abs_idx.sort()
+
+    if sp.issparse(m):
+        # position of each remaining row in the restored matrix
+        new_ixs = np.where(np.insert(np.arange(m.shape[0]), abs_idx, -1) >= 0)[0]
+        n = m.shape[0] + len(abs_idx)
+        coo = m.tocoo()
+        return sp.csr_matrix((coo.data, (new_ixs[coo.row], new_ixs[coo.col])), shape=(n, n))
+
     a = np.insert(m, abs_idx, 0, axis=0)
     if len(m.shape) > 1:
         a = np.insert(a, abs_idx, 0, axis=1)